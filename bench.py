@@ -0,0 +1,344 @@
+import argparse
+import ast
+import csv
+import datetime
+import itertools
+import json
+import os
+import platform
+import re
+import socket
+import sqlite3
+import subprocess
+import sys
+import time
+
+# Training script of each algorithm
+scripts = {"1d": "gcn_distr.py", "15d": "gcn_distr_15d.py", "2d": "gcn_distr_2d.py",
+                "3d": "gcn_distr_3d.py"}
+
+# With --tool=micro each configuration runs microbench.py instead, which also runs on CPU with gloo
+microbench = "microbench.py"
+
+repo_dir = os.path.dirname(os.path.abspath(__file__))
+
+# Measurement lines the training scripts print, either "rank: <r> <key>: <number>" or, for the
+# values only rank 0 prints, "<key>: <number>"
+measure_line = re.compile(r"^(?:rank: (\d+) )?([A-Za-z_]\w*): (-?\d+(?:\.\d*)?(?:[eE][-+]?\d+)?)\s*$")
+startup_line = re.compile(r"^rank: (\d+) startup: (\{.*\}) total: (\S+)s\s*$")
+# microbench.py results, "<algorithm> <name> ... time: <ms>ms [GFLOP/s: <x>] GB/s: <y>"
+micro_line = re.compile(r"^\S+ (\w+) .*time: (\S+)ms(?: GFLOP/s: (\S+))? GB/s: (\S+)\s*$")
+
+# Printed numbers that are not measurements
+skipped_keys = {"median_run", "median_idx", "Processes"}
+
+schema = """
+create table if not exists runs (
+    id integer primary key,
+    started text,
+    git_rev text,
+    git_dirty integer,
+    host text,
+    hardware text,
+    backend text,
+    algorithm text,
+    procs integer,
+    replication integer,
+    grid text,
+    midlayer integer,
+    graph text,
+    epochs integer,
+    args text,
+    returncode integer,
+    wall_time real,
+    log text
+);
+create table if not exists timings (
+    run_id integer,
+    rank integer,
+    phase text,
+    value real
+);
+"""
+
+csv_fields = ["run_id", "started", "git_rev", "algorithm", "procs", "replication", "grid",
+                "midlayer", "graph", "backend", "returncode", "phase", "min", "mean", "max"]
+
+def git_revision():
+    try:
+        rev = subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=repo_dir,
+                                        stderr=subprocess.DEVNULL).decode().strip()
+        status = subprocess.check_output(["git", "status", "--porcelain", "--untracked-files=no"],
+                                            cwd=repo_dir, stderr=subprocess.DEVNULL).decode()
+        return rev, len(status.strip()) > 0
+    except (OSError, subprocess.CalledProcessError):
+        return None, False
+
+def hardware_info():
+    info = dict()
+    info["platform"] = platform.platform()
+    info["python"] = platform.python_version()
+    info["processor"] = platform.processor()
+    info["cpu_count"] = os.cpu_count()
+
+    try:
+        gpus = subprocess.check_output(["nvidia-smi", "--query-gpu=name,memory.total",
+                                            "--format=csv,noheader"],
+                                            stderr=subprocess.DEVNULL).decode()
+        info["gpus"] = [g.strip() for g in gpus.splitlines() if g.strip()]
+    except (OSError, subprocess.CalledProcessError):
+        info["gpus"] = []
+
+    try:
+        import torch
+        info["torch"] = torch.__version__
+        info["cuda"] = torch.version.cuda
+    except ImportError:
+        info["torch"] = None
+    return info
+
+# Process grid of an algorithm on p processes, or None when the algorithm cannot run on p
+def process_grid(algorithm, p, c):
+    if algorithm == "1d":
+        return f"{p}"
+    if algorithm == "15d":
+        if c > p:
+            return None
+        return f"{p // c}x{c}"
+    if algorithm == "2d":
+        side = int(round(p ** (1. / 2.)))
+        if side * side != p:
+            return None
+        return f"{side}x{side}"
+    if algorithm == "3d":
+        side = int(round(p ** (1. / 3.)))
+        if side ** 3 != p:
+            return None
+        return f"{side}x{side}x{side}"
+
+def sweep_configs(args):
+    algorithms = args.algorithms.split(",")
+    procs = [int(p) for p in args.procs.split(",")]
+    replications = [int(c) for c in args.replication.split(",")]
+    mid_layers = [int(h) for h in args.midlayer.split(",")]
+    graphs = args.graphs.split(",")
+    # Microbenchmarks run on uniformly random blocks of --nodes vertices and --degree
+    if args.tool == "micro":
+        graphs = [f"uniform_n{args.nodes}_d{args.degree}"]
+
+    configs = []
+    for graph, algorithm, p, h in itertools.product(graphs, algorithms, procs, mid_layers):
+        # Replication only applies to 1.5D
+        for c in (replications if algorithm == "15d" else [1]):
+            grid = process_grid(algorithm, p, c)
+            if grid is None:
+                print(f"skipping {algorithm} p: {p} c: {c}, no process grid", flush=True)
+                continue
+            configs.append(dict(algorithm=algorithm, procs=p, replication=c, grid=grid,
+                                    midlayer=h, graph=graph))
+    return configs
+
+def launch_command(config, args):
+    if args.launcher == "torchrun":
+        cmd = [sys.executable, "-m", "torch.distributed.run", f"--nproc_per_node={config['procs']}"]
+    else:
+        cmd = [sys.executable, "-m", "torch.distributed.launch", f"--nproc_per_node={config['procs']}"]
+
+    # The hidden size is the dense width the microbenchmarks run at
+    if args.tool == "micro":
+        cmd += [os.path.join(repo_dir, microbench),
+                    f"--algorithms={config['algorithm']}",
+                    f"--device={args.device}",
+                    f"--backend={args.backend}",
+                    f"--accperrank={args.accperrank}",
+                    f"--nodes={args.nodes}",
+                    f"--degree={args.degree}",
+                    f"--features={config['midlayer']}",
+                    f"--midlayer={config['midlayer']}",
+                    f"--replication={config['replication']}"]
+        if args.extra is not None:
+            cmd += args.extra.split()
+        return cmd
+
+    cmd += [os.path.join(repo_dir, scripts[config["algorithm"]]),
+                f"--accperrank={args.accperrank}",
+                f"--epochs={args.epochs}",
+                f"--graphname={config['graph']}",
+                f"--timing={args.timing}",
+                f"--midlayer={config['midlayer']}",
+                f"--activations={args.activations}",
+                f"--accuracy=False",
+                f"--backend={args.backend}"]
+
+    # The 3D script runs once and always normalizes
+    if config["algorithm"] != "3d":
+        cmd += [f"--runcount={args.runcount}", f"--normalization={args.normalization}"]
+    if config["algorithm"] == "15d":
+        cmd += [f"--replication={config['replication']}"]
+    if args.extra is not None:
+        cmd += args.extra.split()
+    return cmd
+
+# Per-rank measurements in a training log, as {rank: {phase: value}}. Startup phases are stored as
+# startup_<phase>, and values printed without a rank come from rank 0. Microbenchmarks, which
+# rank 0 prints the max over the ranks of, are stored as <name>_time, <name>_gflops and <name>_gbs.
+def parse_log(text):
+    measures = dict()
+    for line in text.splitlines():
+        match = micro_line.match(line)
+        if match is not None:
+            name = match.group(1)
+            measures.setdefault(0, dict())[f"{name}_time"] = float(match.group(2)) / 1e3
+            if match.group(3) is not None:
+                measures[0][f"{name}_gflops"] = float(match.group(3))
+            measures[0][f"{name}_gbs"] = float(match.group(4))
+            continue
+
+        match = startup_line.match(line)
+        if match is not None:
+            rank = int(match.group(1))
+            phases = ast.literal_eval(match.group(2))
+            for phase, seconds in phases.items():
+                measures.setdefault(rank, dict())[f"startup_{phase}"] = float(seconds)
+            measures[rank]["startup_total"] = float(match.group(3))
+            continue
+
+        match = measure_line.match(line)
+        if match is None or match.group(2) in skipped_keys:
+            continue
+        rank = int(match.group(1)) if match.group(1) is not None else 0
+        phase = match.group(2)
+        # 2D and 3D print the run time as "Time"
+        if phase == "Time":
+            phase = "total_time"
+        measures.setdefault(rank, dict())[phase] = float(match.group(3))
+    return measures
+
+def store(db, config, info, cmd, returncode, wall_time, log_path, measures):
+    cur = db.cursor()
+    cur.execute("insert into runs (started, git_rev, git_dirty, host, hardware, backend, algorithm, " \
+                    "procs, replication, grid, midlayer, graph, epochs, args, returncode, wall_time, " \
+                    "log) values (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (info["started"], info["git_rev"], int(info["git_dirty"]), info["host"],
+                        json.dumps(info["hardware"]), info["backend"], config["algorithm"],
+                        config["procs"], config["replication"], config["grid"], config["midlayer"],
+                        config["graph"], info["epochs"], " ".join(cmd), returncode, wall_time,
+                        log_path))
+    run_id = cur.lastrowid
+    rows = [(run_id, rank, phase, value) for rank, phases in measures.items()
+                for phase, value in phases.items()]
+    cur.executemany("insert into timings (run_id, rank, phase, value) values (?, ?, ?, ?)", rows)
+    db.commit()
+    return run_id
+
+# One CSV row per phase with its min/mean/max over the ranks that printed it
+def csv_rows(run_id, config, info, returncode, measures):
+    phases = dict()
+    for rank in measures:
+        for phase, value in measures[rank].items():
+            phases.setdefault(phase, []).append(value)
+
+    rows = []
+    for phase in sorted(phases):
+        values = phases[phase]
+        row = dict(config)
+        row.update(run_id=run_id, started=info["started"], git_rev=info["git_rev"],
+                    backend=info["backend"], returncode=returncode, phase=phase, min=min(values),
+                    mean=sum(values) / len(values), max=max(values))
+        rows.append(row)
+    return rows
+
+def main():
+    configs = sweep_configs(args)
+    print(f"{len(configs)} configurations", flush=True)
+    if dryrun:
+        for config in configs:
+            print(" ".join(launch_command(config, args)))
+        return
+
+    git_rev, git_dirty = git_revision()
+    if git_dirty:
+        print(f"warning: uncommitted changes on top of {git_rev}", flush=True)
+    info = dict(git_rev=git_rev, git_dirty=git_dirty, host=socket.gethostname(),
+                    hardware=hardware_info(), backend=args.backend, epochs=args.epochs)
+
+    os.makedirs(args.logdir, exist_ok=True)
+    db = sqlite3.connect(args.db)
+    db.executescript(schema)
+
+    csv_file = None
+    if args.csv is not None:
+        new_csv = not os.path.exists(args.csv)
+        csv_file = open(args.csv, "a", newline="")
+        writer = csv.DictWriter(csv_file, fieldnames=csv_fields)
+        if new_csv:
+            writer.writeheader()
+
+    for config in configs:
+        cmd = launch_command(config, args)
+        name = f"{config['algorithm']}_{os.path.basename(config['graph'].rstrip('/'))}_" \
+                    f"p{config['procs']}_c{config['replication']}_h{config['midlayer']}"
+        log_path = os.path.join(args.logdir, f"{name}.out")
+        print(f"{name}: {' '.join(cmd)}", flush=True)
+
+        info["started"] = datetime.datetime.now().isoformat(timespec="seconds")
+        tstart = time.time()
+        with open(log_path, "w") as log:
+            try:
+                returncode = subprocess.run(cmd, stdout=log, stderr=subprocess.STDOUT, cwd=repo_dir,
+                                                timeout=args.timeout if args.timeout > 0 else None).returncode
+            except subprocess.TimeoutExpired:
+                returncode = -1
+        wall_time = time.time() - tstart
+
+        with open(log_path) as log:
+            measures = parse_log(log.read())
+
+        run_id = store(db, config, info, cmd, returncode, wall_time, log_path, measures)
+        if csv_file is not None:
+            writer.writerows(csv_rows(run_id, config, info, returncode, measures))
+            csv_file.flush()
+
+        total = max((m["total_time"] for m in measures.values() if "total_time" in m), default=None)
+        print(f"{name}: returncode: {returncode} wall_time: {wall_time:.1f}s total_time: {total} " \
+                f"measures: {sum(len(m) for m in measures.values())}", flush=True)
+
+    db.close()
+    if csv_file is not None:
+        csv_file.close()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--algorithms", type=str, default="1d,15d,2d,3d")
+    parser.add_argument("--procs", type=str, default="1,2,4,8")
+    parser.add_argument("--replication", type=str, default="1,2")
+    parser.add_argument("--midlayer", type=str, default="16")
+    parser.add_argument("--graphs", type=str, default="Cora")
+    parser.add_argument("--epochs", type=int, default=10)
+    parser.add_argument("--runcount", type=int, default=1)
+    parser.add_argument("--accperrank", type=int, default=1)
+    parser.add_argument("--timing", type=str, default="True")
+    parser.add_argument("--normalization", type=str, default="False")
+    parser.add_argument("--activations", type=str, default="True")
+    parser.add_argument("--backend", type=str, default="nccl")
+    parser.add_argument("--launcher", type=str, default="launch")
+    parser.add_argument("--extra", type=str, default=None)
+    parser.add_argument("--timeout", type=int, default=0)
+    parser.add_argument("--db", type=str, default="bench.db")
+    parser.add_argument("--csv", type=str, default=None)
+    parser.add_argument("--logdir", type=str, default="bench_logs")
+    parser.add_argument("--dryrun", type=str, default="False")
+    parser.add_argument("--tool", type=str, default="train")
+    parser.add_argument("--device", type=str, default="cuda")
+    parser.add_argument("--nodes", type=int, default=1 << 20)
+    parser.add_argument("--degree", type=int, default=16)
+    args = parser.parse_args()
+
+    dryrun = args.dryrun == "True"
+
+    # The training kernels are CUDA only, on CPU only the microbenchmarks run
+    if args.tool == "train" and args.device != "cuda":
+        print(f"Error: the training scripts need a GPU, use --tool=micro for --device={args.device}")
+        exit()
+
+    main()
@@ -0,0 +1,217 @@
+import os
+import queue
+import threading
+import time
+
+import torch
+
+# Checkpoint layout in the checkpoint directory:
+#   weights.pt              run, epoch, weights, optimizer state and early stopping state,
+#                           written by rank 0 only
+#                           since every rank holds the same replicated copy
+#   state_rank{r}.pt        run, epoch, RNG state and partition cache pointer of rank r
+#   partition_rank{r}.pt    rank r's partition, so resuming skips the partitioning
+# Inference writes outputs_rank{r}.pt to its own output directory.
+
+def weights_path(ckpt_dir):
+    return os.path.join(ckpt_dir, "weights.pt")
+
+def state_path(ckpt_dir, rank):
+    return os.path.join(ckpt_dir, f"state_rank{rank}.pt")
+
+def partition_path(ckpt_dir, rank):
+    return os.path.join(ckpt_dir, f"partition_rank{rank}.pt")
+
+def outputs_path(out_dir, rank):
+    return os.path.join(out_dir, f"outputs_rank{rank}.pt")
+
+# Copy every tensor in a nested dict/list/tuple to host memory
+# Host tensors are copied too, torch.save of a view would write its whole storage
+def to_cpu(obj):
+    if torch.is_tensor(obj):
+        return obj.detach().to("cpu", copy=True)
+    if isinstance(obj, dict):
+        return {key: to_cpu(value) for key, value in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return type(obj)(to_cpu(value) for value in obj)
+    return obj
+
+# Write to a temporary file first, so a crash mid-write never leaves a truncated checkpoint
+def atomic_save(obj, path):
+    tmp_path = path + ".tmp"
+    torch.save(obj, tmp_path)
+    os.replace(tmp_path, path)
+
+def write_all(saves):
+    for obj, path in saves:
+        atomic_save(obj, path)
+
+def save_partition(ckpt_dir, rank, partition):
+    os.makedirs(ckpt_dir, exist_ok=True)
+    atomic_save(to_cpu(partition), partition_path(ckpt_dir, rank))
+
+def load_partition(ckpt_dir, rank):
+    path = partition_path(ckpt_dir, rank)
+    if not os.path.exists(path):
+        return None
+    print(f"rank: {rank} loading partition from {path}", flush=True)
+    return torch.load(path)
+
+# Copy every tensor of obj into pinned host buffers, allocated on first use and reused by
+# later snapshots of the same structure
+def pin_copy(obj, bufs, idx=None):
+    if idx is None:
+        idx = [0]
+    if torch.is_tensor(obj):
+        if idx[0] == len(bufs):
+            bufs.append(torch.empty(obj.size(), dtype=obj.dtype, pin_memory=obj.is_cuda))
+        buf = bufs[idx[0]]
+        idx[0] += 1
+        buf.copy_(obj.detach(), non_blocking=True)
+        return buf
+    if isinstance(obj, dict):
+        return {key: pin_copy(value, bufs, idx) for key, value in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return type(obj)(pin_copy(value, bufs, idx) for value in obj)
+    return obj
+
+# Writes checkpoints on a background thread while training continues.
+# save() copies the weights and Adam moments into one of depth sets of pinned host buffers with
+# copies queued on the current stream behind the epoch's optimizer step, so it never waits for
+# the GPU. The writer thread waits for the copies and serializes them to disk. When all buffer
+# sets are in flight save() blocks, bounding both host memory and the number of queued writes.
+class CheckpointWriter:
+    def __init__(self, ckpt_dir, rank, device, depth=2):
+        self.ckpt_dir = ckpt_dir
+        self.rank = rank
+        self.device = device
+        self.written = [] # (run, epoch, seconds) of every completed checkpoint
+        self.error = None
+
+        self.free_bufs = queue.Queue()
+        for i in range(depth):
+            self.free_bufs.put([])
+        self.jobs = queue.Queue()
+
+        os.makedirs(ckpt_dir, exist_ok=True)
+        self.thread = threading.Thread(target=self.write_loop, daemon=True)
+        self.thread.start()
+
+    # best is the early stopping state, a dict of the best weights, their val and test accuracy
+    # and the evaluations since, or None without evaluation
+    def save(self, run, epoch, weights, optimizer, best=None):
+        if self.error is not None:
+            raise self.error
+
+        tstart = time.time()
+        bufs = self.free_bufs.get()
+
+        state = dict()
+        state["run"] = run
+        state["epoch"] = epoch
+        state["rng"] = torch.get_rng_state()
+        state["cuda_rng"] = torch.cuda.get_rng_state(self.device)
+        state["partition"] = partition_path(self.ckpt_dir, self.rank)
+        saves = [(state, state_path(self.ckpt_dir, self.rank))]
+
+        # Weights are replicated, rank 0 writes the only copy
+        if self.rank == 0:
+            ckpt = dict()
+            ckpt["run"] = run
+            ckpt["epoch"] = epoch
+            ckpt["weights"] = pin_copy(list(weights), bufs)
+            ckpt["optimizer"] = pin_copy(optimizer.state_dict(), bufs)
+            ckpt["best"] = pin_copy(best, bufs)
+            saves.append((ckpt, weights_path(self.ckpt_dir)))
+
+        copied = torch.cuda.Event()
+        copied.record(torch.cuda.current_stream(self.device))
+
+        self.jobs.put((run, epoch, saves, bufs, copied, tstart))
+
+    def write_loop(self):
+        while True:
+            job = self.jobs.get()
+            if job is None:
+                return
+
+            run, epoch, saves, bufs, copied, tstart = job
+            try:
+                copied.synchronize()
+                write_all(saves)
+                self.written.append((run, epoch, time.time() - tstart))
+                print(f"rank: {self.rank} checkpoint run {run} epoch {epoch} written in " \
+                        f"{time.time() - tstart}s", flush=True)
+            except Exception as e:
+                self.error = e
+            self.free_bufs.put(bufs)
+
+    # Block until every queued checkpoint is on disk and stop the writer thread
+    def close(self):
+        self.jobs.put(None)
+        self.thread.join()
+        if self.error is not None:
+            raise self.error
+        print(f"rank: {self.rank} checkpoints written: {len(self.written)}", flush=True)
+
+def load(ckpt_dir, rank):
+    if not os.path.exists(weights_path(ckpt_dir)):
+        return None
+
+    ckpt = torch.load(weights_path(ckpt_dir), map_location="cpu")
+    ckpt["rng"] = None
+    ckpt["cuda_rng"] = None
+
+    # The weights file decides where every rank resumes, this rank's RNG state is only
+    # restored when it was saved at the same epoch
+    if os.path.exists(state_path(ckpt_dir, rank)):
+        state = torch.load(state_path(ckpt_dir, rank))
+        if state["run"] == ckpt["run"] and state["epoch"] == ckpt["epoch"]:
+            ckpt["rng"] = state["rng"]
+            ckpt["cuda_rng"] = state["cuda_rng"]
+        else:
+            print(f"rank: {rank} RNG state is from run {state['run']} epoch {state['epoch']}, " \
+                    f"weights from run {ckpt['run']} epoch {ckpt['epoch']}", flush=True)
+
+    print(f"rank: {rank} resuming from run {ckpt['run']} epoch {ckpt['epoch']}", flush=True)
+    return ckpt
+
+# Returns the early stopping state saved with the weights, with the best weights on device
+def restore(ckpt, weights, optimizer, device):
+    with torch.no_grad():
+        for w, w_ckpt in zip(weights, ckpt["weights"]):
+            w.copy_(w_ckpt)
+
+    # load_state_dict moves the Adam moments onto each parameter's device
+    optimizer.load_state_dict(ckpt["optimizer"])
+
+    if ckpt["rng"] is not None:
+        torch.set_rng_state(ckpt["rng"])
+        torch.cuda.set_rng_state(ckpt["cuda_rng"], device)
+
+    # Checkpoints of older runs have no early stopping state
+    best = ckpt.get("best")
+    if best is not None and best["weights"] is not None:
+        best["weights"] = [w.to(device) for w in best["weights"]]
+    return best
+
+# Trained weights only, for inference
+def load_weights(ckpt_dir, weights):
+    ckpt = torch.load(weights_path(ckpt_dir), map_location="cpu")
+    with torch.no_grad():
+        for w, w_ckpt in zip(weights, ckpt["weights"]):
+            w.copy_(w_ckpt)
+    return ckpt["epoch"]
+
+# One rank's block of the outputs (predictions or hidden-layer embeddings), with its offsets in
+# the global n x f matrix so the shards can be stitched back together
+def save_outputs(out_dir, rank, outputs, row_start, col_start, pred=None):
+    os.makedirs(out_dir, exist_ok=True)
+
+    shard = dict()
+    shard["row_start"] = row_start
+    shard["col_start"] = col_start
+    shard["outputs"] = outputs.detach().cpu()
+    if pred is not None:
+        shard["pred"] = pred.cpu()
+    atomic_save(shard, outputs_path(out_dir, rank))
@@ -1,3 +1,6 @@
+import time
+startup_tstart = time.time()
+
 import os
 import os.path as osp
 import argparse
@@ -8,31 +11,31 @@ import math
 import torch
 import torch.distributed as dist
 
-from torch_geometric.data import Data, Dataset
-from torch_geometric.datasets import Planetoid, PPI
-from reddit import Reddit
-from torch_geometric.nn import GCNConv, ChebConv  # noqa
-from torch_geometric.utils import from_scipy_sparse_matrix, add_remaining_self_loops, to_dense_adj, dense_to_sparse, to_scipy_sparse_matrix
-import torch_geometric.transforms as T
+from torch_geometric.data import Data
+import checkpoint
+import topology
+import perf
+import synthetic
+import timeline
+from torch_geometric.utils import add_remaining_self_loops
 
 import torch.multiprocessing as mp
 
-from torch.multiprocessing import Manager, Process
-
 from torch.nn import Parameter
 import torch.nn.functional as F
 
-from torch_scatter import scatter_add
-import torch_sparse
-
-from sparse_coo_tensor_cpp import sparse_coo_tensor_gpu, spmm_gpu
+from sparse_coo_tensor_cpp import spmm_csr_gpu
 
 import socket
 import statistics
-import time
 import numpy as np
 
-from scipy.sparse import csr_matrix, coo_matrix
+# The dataset loaders, scipy and torch_sparse are imported where they are used, so a run only
+# loads what its graph and preprocessing need
+
+# Seconds spent in each startup phase, printed once the partition is ready
+startup = dict()
+startup["imports"] = time.time() - startup_tstart
 
 # comp_time = 0.0
 # comm_time = 0.0
@@ -52,6 +55,7 @@ barrier_time = dict()
 barrier_subset_time = dict()
 op1_comm_time = dict()
 op2_comm_time = dict()
+work = dict() # perf.Counts of the timed phases, indexed [run][rank] like the timers
 
 epochs = 0
 graphname = ""
@@ -61,10 +65,32 @@ normalization = False
 activations = False
 accuracy = False
 device = None
+implicit_values = dict() # device -> ones shared as the values of every all-1 block on it
 acc_per_rank = 0
 run_count = 0
 run = 0
 download = False
+eval_every = 0 # evaluate every k epochs during training (0 disables)
+patience = 0 # stop after this many evaluations without a better val accuracy (0 disables)
+ckpt_dir = None # checkpoint directory (None disables checkpointing)
+ckpt_every = 0 # checkpoint every k epochs (0 disables)
+ckpt_queue = 2 # checkpoints in flight before training waits for the writer
+resume = False
+mini_batch = 0 # seed vertices per rank per mini-batch (0 trains full-batch)
+fanouts = [] # neighbors sampled per vertex at each layer, from the input layer up
+inference = False # forward-only pass over the whole graph with trained weights
+out_dir = None # directory for each rank's output shard in inference
+layer_count = None # layers to run in inference, None runs all of them and writes predictions
+cache_features = 0 # MB for remote feature rows kept resident for layer 0 (0 disables, -1 no limit)
+precompute_ax = False # compute A * X once and make layer 0 a local GEMM
+hierarchical = False # two-level broadcasts, inter-node then intra-node
+bcast_group = None # topology.HierGroup over all ranks with hierarchical
+backend = "nccl" # torch.distributed backend, gloo where NCCL is unavailable
+synth_graph = None # synthetic.Graph each rank generates its own partition of, instead of graphname
+tracer = None # timeline.Timeline every timed phase is recorded in with --trace
+trace_path = None # Chrome trace file the ranks' timelines are merged into
+imbalance = 1.5 # nnz imbalance (max / mean) over which the pre-training balance report warns
+mem_bandwidth = 900. # GB/s the balance report predicts the SpMM stage times at
 
 def start_time(group, rank, subset=False, src=None):
     global barrier_time
@@ -80,12 +106,20 @@ def start_time(group, rank, subset=False, src=None):
     barrier_time[run][rank] += barrier_tstop - barrier_tstart
     if subset:
         barrier_subset_time[run][rank] += barrier_tstop - barrier_tstart
+    if tracer is not None:
+        tracer.event("barrier", barrier_tstart, barrier_tstop)
 
     tstart = 0.0
     tstart = time.time()
     return tstart
 
-def stop_time(group, rank, tstart):
+# Count a phase's flops and bytes next to its timer. Only timed work is counted, so the counts
+# match the seconds they are divided by.
+def count_work(rank, phase, phase_work):
+    if timing:
+        work[run][rank].add(phase, phase_work)
+
+def stop_time(group, rank, tstart, name=None):
     if not timing:
         return 0.0
     dist.barrier(group)
@@ -94,6 +128,8 @@ def stop_time(group, rank, tstart):
     # torch.cuda.synchronize(device=device)
 
     tstop = time.time()
+    if tracer is not None and name is not None:
+        tracer.event(name, tstart, tstop)
     return tstop - tstart
 
 def normalize(adj_matrix):
@@ -158,7 +194,7 @@ def outer_product(adj_matrix, grad_output, rank, size, group):
     # A * G^l
     ag = torch.mm(adj_matrix, grad_output)
 
-    dur = stop_time(group, rank, tstart_comp)
+    dur = stop_time(group, rank, tstart_comp, "dcomp")
     comp_time[run][rank] += dur
     dcomp_time[run][rank] += dur
 
@@ -167,7 +203,7 @@ def outer_product(adj_matrix, grad_output, rank, size, group):
     # reduction on A * G^l low-rank matrices
     dist.all_reduce(ag, op=dist.reduce_op.SUM, group=group)
 
-    dur = stop_time(group, rank, tstart_comm)
+    dur = stop_time(group, rank, tstart_comm, "op1_comm")
     comm_time[run][rank] += dur
     op1_comm_time[run][rank] += dur
 
@@ -188,22 +224,104 @@ def outer_product2(inputs, ag, rank, size, group):
     tstart_comp = start_time(group, rank)
     # (H^(l-1))^T * (A * G^l)
     grad_weight = torch.mm(inputs, ag)
+    count_work(rank, "dcomp", perf.gemm_work(inputs.size(0), inputs.size(1), ag.size(1)))
 
-    dur = stop_time(group, rank, tstart_comp)
+    dur = stop_time(group, rank, tstart_comp, "dcomp")
     comp_time[run][rank] += dur
     dcomp_time[run][rank] += dur
     
     tstart_comm = start_time(group, rank)
     # reduction on grad_weight low-rank matrices
     dist.all_reduce(grad_weight, op=dist.reduce_op.SUM, group=group)
+    count_work(rank, "op2_comm", perf.message_work(grad_weight))
 
-    dur = stop_time(group, rank, tstart_comm)
+    dur = stop_time(group, rank, tstart_comm, "op2_comm")
     comm_time[run][rank] += dur
     op2_comm_time[run][rank] += dur
 
     return grad_weight
 
-def broad_func(node_count, am_partitions, inputs, rank, size, group):
+# Broadcast over all ranks, sending one copy per node over the network with --hierarchical
+def broadcast(tensor, src, group):
+    if bcast_group is not None:
+        bcast_group.broadcast(tensor, src)
+    else:
+        dist.broadcast(tensor, src=src, group=group)
+
+# SpMM operand form of a coalesced block: (rowptr, colind, values, height, width) with int32 CSR
+# row offsets and column indices, converted once instead of on every SpMM. Blocks whose values are
+# all 1 (--normalization=False) keep an empty values tensor and share one ones vector at SpMM time.
+def compact_block(block):
+    rows = block.indices()[0]
+    rowptr = torch.cuda.IntTensor(block.size(0) + 1, device=device).fill_(0)
+    rowptr[1:] = torch.cumsum(torch.bincount(rows, minlength=block.size(0)), dim=0)
+    colind = block.indices()[1].int()
+
+    values = block.values()
+    if bool((values == 1).all()):
+        values = torch.cuda.FloatTensor(0, device=device)
+        implicit_ones(colind.size(0), device)
+
+    return (rowptr, colind, values, block.size(0), block.size(1))
+
+# Values of an all-1 block with nnz nonzeros. The shared vector is grown while the blocks are
+# compacted, so the SpMMs only slice it.
+def implicit_ones(nnz, device):
+    if device not in implicit_values or implicit_values[device].size(0) < nnz:
+        implicit_values[device] = torch.cuda.FloatTensor(nnz, device=device).fill_(1)
+    return implicit_values[device][:nnz]
+
+def block_bytes(block):
+    rowptr, colind, values, _, _ = block
+    return sum(t.numel() * t.element_size() for t in (rowptr, colind, values))
+
+# z += block * inputs
+def spmm_block(block, inputs, z):
+    rowptr, colind, values, height, width = block
+    if values.numel() == 0:
+        values = implicit_ones(colind.size(0), inputs.device)
+    spmm_csr_gpu(rowptr, colind, values, height, width, inputs, z)
+
+# Remote feature rows each rank needs for layer 0, so that stage's broadcast can be skipped every
+# epoch. A stage is only skipped if every rank cached it, so the choice is made on gathered costs
+# and is the same everywhere: cheapest stages first, since every skipped stage saves one broadcast.
+def build_feature_cache(inputs, am_partitions, rank, size, group):
+    needed = []
+    costs = torch.cuda.FloatTensor(size, device=device)
+    for i in range(size):
+        cols, inv = torch.unique(am_partitions[i][1].long(), return_inverse=True)
+        needed.append((cols, inv))
+        costs[i] = cols.size(0) * inputs.size(1) * 4 / 2**20
+
+    costs_recv = [torch.cuda.FloatTensor(size, device=device) for i in range(size)]
+    dist.all_gather(costs_recv, costs, group=group)
+    costs = torch.stack(costs_recv).max(dim=0)[0].tolist()
+
+    stages = []
+    total = 0.0
+    for i in sorted(range(size), key=lambda i: costs[i]):
+        if cache_features > 0 and total + costs[i] > cache_features:
+            break
+        stages.append(i)
+        total += costs[i]
+
+    cache = dict()
+    for i in sorted(stages):
+        if i == rank:
+            inputs_recv = inputs.detach().clone()
+        else:
+            inputs_recv = torch.cuda.FloatTensor(am_partitions[i][4], inputs.size(1), device=device)
+        broadcast(inputs_recv, i, group)
+
+        # Keep only the referenced rows, and renumber the block's columns to match
+        cols, inv = needed[i]
+        rowptr, _, values, height, _ = am_partitions[i]
+        cache[i] = ((rowptr, inv.int(), values, height, cols.size(0)), inputs_recv[cols])
+
+    print(f"rank: {rank} feature cache stages: {len(stages)}/{size} {total}MB", flush=True)
+    return cache
+
+def broad_func(node_count, am_partitions, inputs, rank, size, group, cache=None):
     global device
     global comm_time
     global comp_time
@@ -215,42 +333,90 @@ def broad_func(node_count, am_partitions, inputs, rank, size, group):
     n_per_proc = math.ceil(float(node_count) / size)
 
     # z_loc = torch.cuda.FloatTensor(adj_matrix.size(0), inputs.size(1), device=device).fill_(0)
-    z_loc = torch.cuda.FloatTensor(am_partitions[0].size(0), inputs.size(1), device=device).fill_(0)
+    z_loc = torch.cuda.FloatTensor(am_partitions[0][3], inputs.size(1), device=device).fill_(0)
     # z_loc = torch.zeros(adj_matrix.size(0), inputs.size(1))
     
     inputs_recv = torch.cuda.FloatTensor(n_per_proc, inputs.size(1), device=device).fill_(0)
     # inputs_recv = torch.zeros(n_per_proc, inputs.size(1))
 
     for i in range(size):
+        # Cached stages multiply their resident rows, no broadcast
+        if cache is not None and i in cache:
+            tstart_comp = start_time(group, rank)
+
+            block, rows = cache[i]
+            spmm_block(block, rows, z_loc)
+            count_work(rank, "scomp", perf.spmm_work(block[1].numel(), block[3], block[4], 
+                                                        rows.size(1)))
+
+            dur = stop_time(group, rank, tstart_comp, "scomp")
+            comp_time[run][rank] += dur
+            scomp_time[run][rank] += dur
+            continue
+
         if i == rank:
             inputs_recv = inputs.clone()
         elif i == size - 1:
-            inputs_recv = torch.cuda.FloatTensor(am_partitions[i].size(1), inputs.size(1), device=device).fill_(0)
+            inputs_recv = torch.cuda.FloatTensor(am_partitions[i][4], inputs.size(1), device=device).fill_(0)
             # inputs_recv = torch.zeros(list(am_partitions[i].t().size())[1], inputs.size(1))
 
         tstart_comm = start_time(group, rank)
 
-        dist.broadcast(inputs_recv, src=i, group=group)
+        broadcast(inputs_recv, i, group)
+        count_work(rank, "bcast_comm", perf.message_work(inputs_recv))
 
-        dur = stop_time(group, rank, tstart_comm)
+        dur = stop_time(group, rank, tstart_comm, "bcast_comm")
         comm_time[run][rank] += dur
         bcast_comm_time[run][rank] += dur
 
         tstart_comp = start_time(group, rank)
 
-        spmm_gpu(am_partitions[i].indices()[0].int(), am_partitions[i].indices()[1].int(), 
-                        am_partitions[i].values(), am_partitions[i].size(0), 
-                        am_partitions[i].size(1), inputs_recv, z_loc)
+        spmm_block(am_partitions[i], inputs_recv, z_loc)
+        block = am_partitions[i]
+        count_work(rank, "scomp", perf.spmm_work(block[1].numel(), block[3], block[4], 
+                                                    inputs_recv.size(1)))
 
-        dur = stop_time(group, rank, tstart_comp)
+        dur = stop_time(group, rank, tstart_comp, "scomp")
         comp_time[run][rank] += dur
         scomp_time[run][rank] += dur
 
     return z_loc
 
+# One GCN layer, sigma(A * H * W). Returns the pre-activation z as well for the backward.
+# With ax, the precomputed A * X of layer 0, the SpMM is skipped.
+def layer_forward(inputs, weight, adj_matrix, am_partitions, rank, size, group, func, cache=None, 
+                    ax=None):
+    global comp_time
+    global dcomp_time
+    global run
+
+    # z = block_row(adj_matrix.t(), am_partitions, inputs, weight, rank, size)
+    if ax is not None:
+        z = ax
+    else:
+        z = broad_func(adj_matrix.size(0), am_partitions, inputs, rank, size, group, cache)
+
+    tstart_comp = start_time(group, rank)
+
+    count_work(rank, "dcomp", perf.gemm_work(z.size(0), z.size(1), weight.size(1)))
+    z = torch.mm(z, weight)
+
+    dur = stop_time(group, rank, tstart_comp, "dcomp")
+    comp_time[run][rank] += dur
+    dcomp_time[run][rank] += dur
+
+    h = z
+    if activations:
+        if func is F.log_softmax:
+            h = func(z, dim=1)
+        elif func is F.relu:
+            h = func(z)
+
+    return z, h
+
 class GCNFunc(torch.autograd.Function):
     @staticmethod
-    def forward(ctx, inputs, weight, adj_matrix, am_partitions, rank, size, group, func):
+    def forward(ctx, inputs, weight, adj_matrix, am_partitions, rank, size, group, func, cache, ax):
         global comm_time
         global comp_time
         global dcomp_time
@@ -267,34 +433,17 @@ class GCNFunc(torch.autograd.Function):
         ctx.rank = rank
         ctx.size = size
         ctx.group = group
+        ctx.ax = ax
 
         ctx.func = func
 
-        # z = block_row(adj_matrix.t(), am_partitions, inputs, weight, rank, size)
-        z = broad_func(adj_matrix.size(0), am_partitions, inputs, rank, size, group)
-
-        tstart_comp = start_time(group, rank)
-
-        z = torch.mm(z, weight)
-
-        dur = stop_time(group, rank, tstart_comp)
-        comp_time[run][rank] += dur
-        dcomp_time[run][rank] += dur
+        z, h = layer_forward(inputs, weight, adj_matrix, am_partitions, rank, size, group, func, cache, 
+                                ax)
 
         z.requires_grad = True
         ctx.z = z
 
-        if activations:
-            if func is F.log_softmax:
-                h = func(z, dim=1)
-            elif func is F.relu:
-                h = func(z)
-            else:
-                h = z
-
-            return h
-        else:
-            return z
+        return h
 
     @staticmethod
     def backward(ctx, grad_output):
@@ -324,76 +473,234 @@ class GCNFunc(torch.autograd.Function):
                 sigmap = torch.autograd.grad(outputs=func_eval, inputs=z, grad_outputs=grad_output)[0]
                 grad_output = sigmap
 
+        # Layer 0 on A * X: the features need no gradient, and the weight gradient is (A * X)^T * G
+        if ctx.ax is not None:
+            grad_weight = outer_product2(ctx.ax.t(), grad_output, rank, size, group)
+            return None, grad_weight, None, None, None, None, None, None, None, None
+
         # First backprop equation
         ag = broad_func(adj_matrix.size(0), am_partitions, grad_output, rank, size, group)
 
         tstart_comp = start_time(group, rank)
 
         grad_input = torch.mm(ag, weight.t())
+        count_work(rank, "dcomp", perf.gemm_work(ag.size(0), ag.size(1), weight.size(0)))
 
-        dur = stop_time(group, rank, tstart_comp)
+        dur = stop_time(group, rank, tstart_comp, "dcomp")
         comp_time[run][rank] += dur
         dcomp_time[run][rank] += dur
 
         # Second backprop equation (reuses the A * G^l computation)
         grad_weight = outer_product2(inputs.t(), ag, rank, size, group)
 
-        return grad_input, grad_weight, None, None, None, None, None, None
+        return grad_input, grad_weight, None, None, None, None, None, None, None, None
 
-def train(inputs, weights,  adj_matrix, am_partitions, optimizer, data, rank, size, group):
+def train(inputs, weights,  adj_matrix, am_partitions, optimizer, data, rank, size, group, 
+            feature_cache=None, ax=None):
     outputs = inputs
     for i, w in enumerate(weights):
-        outputs = GCNFunc.apply(outputs, w, adj_matrix, am_partitions, rank, size, group, F.relu if i < len(weights) - 1 else F.log_softmax)
+        # Only layer 0 reads the static features
+        outputs = GCNFunc.apply(outputs, w, adj_matrix, am_partitions, rank, size, group, F.relu if i < len(weights) - 1 else F.log_softmax, 
+                                    feature_cache if i == 0 else None, ax if i == 0 else None)
     #for i in range(15):
      #   outputs = GCNFunc.apply(outputs, weight1, adj_matrix, am_partitions, rank, size, group, F.relu)
    # outputs = GCNFunc.apply(outputs, weight2, adj_matrix, am_partitions, rank, size, group, F.log_softmax)
 
     optimizer.zero_grad()
-    rank_train_mask = torch.split(data.train_mask.bool(), outputs.size(0), dim=0)[rank]
-    datay_rank = torch.split(data.y, outputs.size(0), dim=0)[rank]
-
-    # Note: bool type removes warnings, unsure of perf penalty
-    # loss = F.nll_loss(outputs[data.train_mask.bool()], data.y[data.train_mask.bool()])
-    if list(datay_rank[rank_train_mask].size())[0] > 0:
-    # if datay_rank.size(0) > 0:
-        loss = F.nll_loss(outputs[rank_train_mask], datay_rank[rank_train_mask])
-        # loss = F.nll_loss(outputs, torch.max(datay_rank, 1)[1])
-        loss.backward()
-    else:
-        fake_loss = (outputs * torch.cuda.FloatTensor(outputs.size(), device=device).fill_(0)).sum()
-        # fake_loss = (outputs * torch.zeros(outputs.size())).sum()
-        fake_loss.backward()
 
+    # Summed NLL of the local train rows over the global train count. The per-rank gradients add
+    # up to those of the global mean, and ranks without train rows simply contribute zero.
+    classes = torch.gather(outputs[data.train_mask], 1, data.y[data.train_mask].view(-1, 1))
+    loss = -torch.sum(classes) / data.train_count
+    loss.backward()
+
+    tstart_step = start_time(group, rank)
     optimizer.step()
+    stop_time(group, rank, tstart_step, "optimizer_step")
 
-    return outputs
+    # Global mean loss, for reporting only
+    loss = loss.detach()
+    dist.all_reduce(loss, op=dist.reduce_op.SUM, group=group)
+
+    return outputs, loss
+
+def test(outputs, data, group):
+    # Correct and total counts on the local rows for each mask, reduced together across ranks
+    pred = outputs.max(1)[1]
 
-def test(outputs, data, vertex_count, rank):
-    logits, accs = outputs, []
+    counts = []
     for _, mask in data('train_mask', 'val_mask', 'test_mask'):
-        pred = logits[mask].max(1)[1]
-        acc = pred.eq(data.y[mask]).sum().item() / mask.sum().item()
-        accs.append(acc)
+        counts.append(pred[mask].eq(data.y[mask]).sum())
+        counts.append(mask.sum())
+    counts = torch.stack(counts)
+    dist.all_reduce(counts, op=dist.reduce_op.SUM, group=group)
+    counts = counts.tolist()
+
+    accs = []
+    for i in range(0, len(counts), 2):
+        if counts[i + 1] > 0:
+            accs.append(counts[i] / counts[i + 1])
+        else:
+            accs.append(0)
 
-    if len(accs) == 1:
-        accs.append(0)
-        accs.append(0)
+    if len(accs) != 3:
+        accs = accs + [0] * (3 - len(accs))
 
     return accs
-    # logits, accs = outputs, []
-    # datay_rank = torch.split(data.y, vertex_count)[rank]
-    # for _, mask in data('train_mask', 'val_mask', 'test_mask'):
-    #     mask_rank = torch.split(mask, vertex_count)[rank]
-    #     count = mask_rank.nonzero().size(0)
-    #     if count > 0:
-    #         pred = logits[mask_rank].max(1)[1]
-    #         acc = pred.eq(datay_rank[mask_rank]).sum().item() / mask_rank.sum().item()
-    #         # pred = logits[mask].max(1)[1]
-    #         # acc = pred.eq(data.y[mask]).sum().item() / mask.sum().item()
-    #     else:
-    #         acc = -1
-    #     accs.append(acc)
-    # return accs
+
+
+# Neighbor lists of this rank's vertices in CSR, read off its column block of the symmetric A
+def sample_csr(adj_matrix_loc):
+    adj_matrix_loc = adj_matrix_loc.coalesce()
+    vtx = adj_matrix_loc.indices()[1]
+    order = torch.argsort(vtx)
+    deg = torch.bincount(vtx, minlength=adj_matrix_loc.size(1))
+
+    rowptr = torch.cat((deg.new_zeros(1), torch.cumsum(deg, 0)))
+    colind = adj_matrix_loc.indices()[0][order]
+    values = adj_matrix_loc.values()[order]
+    return rowptr, colind, values
+
+# Group global vertex ids by their owner rank in the 1D partition
+def split_by_owner(ids, n_per_proc, size):
+    owner = ids // n_per_proc
+    order = torch.argsort(owner)
+    counts = torch.bincount(owner, minlength=size).tolist()
+    return order, list(torch.split(ids[order], counts))
+
+# Send send_list[i] to rank i and receive one tensor from every rank, sizes are exchanged first
+def exchange(send_list, rank, size, group):
+    counts = torch.cuda.LongTensor([t.size(0) for t in send_list], device=device)
+    counts_recv = torch.cuda.LongTensor(size, device=device)
+    dist.all_to_all_single(counts_recv, counts, group=group)
+    counts_recv = counts_recv.tolist()
+
+    row_shape = list(send_list[rank].size())[1:]
+    recv_list = []
+    for i in range(size):
+        recv_list.append(torch.empty([counts_recv[i]] + row_shape, dtype=send_list[rank].dtype, 
+                                        device=device))
+
+    dist.all_to_all(recv_list, [t.contiguous() for t in send_list], group=group)
+    return recv_list
+
+# Sample fanout neighbors (with replacement) of every frontier vertex, each from the rank that
+# owns its adjacency. Weights deg(v) * a_vu / fanout make the sampled aggregation unbiased.
+def sample_neighbors(frontier, fanout, csr, n_per_proc, rank, size, group):
+    rowptr, colind, values = csr
+
+    order, requests = split_by_owner(frontier, n_per_proc, size)
+    requests = exchange(requests, rank, size, group)
+
+    nbrs = []
+    weights = []
+    for req in requests:
+        vtx = req - rank * n_per_proc
+        deg = rowptr[vtx + 1] - rowptr[vtx]
+        pick = rowptr[vtx].view(-1, 1) + \
+                    (torch.rand(vtx.size(0), fanout, device=device) * deg.view(-1, 1)).long()
+
+        # Vertices without neighbors pick -1, which the caller drops before fetching features
+        has_nbrs = deg > 0
+        nbr = torch.full((vtx.size(0), fanout), -1, dtype=torch.long, device=device)
+        weight = torch.zeros(vtx.size(0), fanout, dtype=values.dtype, device=device)
+        nbr[has_nbrs] = colind[pick[has_nbrs]]
+        weight[has_nbrs] = values[pick[has_nbrs]] * deg[has_nbrs].view(-1, 1).float() / fanout
+        nbrs.append(nbr)
+        weights.append(weight)
+
+    nbrs = torch.cat(exchange(nbrs, rank, size, group))
+    weights = torch.cat(exchange(weights, rank, size, group))
+
+    nbrs_out = torch.empty_like(nbrs)
+    weights_out = torch.empty_like(weights)
+    nbrs_out[order] = nbrs
+    weights_out[order] = weights
+    return nbrs_out, weights_out
+
+# Feature rows of arbitrary global vertices, fetched from their owners
+def fetch_features(ids, inputs_loc, n_per_proc, rank, size, group):
+    order, requests = split_by_owner(ids, n_per_proc, size)
+    requests = exchange(requests, rank, size, group)
+
+    rows = [inputs_loc[req - rank * n_per_proc] for req in requests]
+    rows = torch.cat(exchange(rows, rank, size, group))
+
+    features = torch.empty_like(rows)
+    features[order] = rows
+    return features
+
+# One epoch of sampled mini-batch training over this rank's train vertices. Every rank runs the
+# same number of batches so the exchanges line up, ranks out of seeds send empty batches.
+def train_minibatch(inputs_loc, weights, csr, optimizer, data, node_count, rank, size, group):
+    n_per_proc = math.ceil(float(node_count) / size)
+    seeds_loc = data.train_mask.nonzero().squeeze(1)
+    seeds_loc = seeds_loc[torch.randperm(seeds_loc.size(0), device=device)]
+
+    batch_count = torch.cuda.LongTensor([math.ceil(seeds_loc.size(0) / mini_batch)], device=device)
+    dist.all_reduce(batch_count, op=dist.reduce_op.MAX, group=group)
+
+    loss_sum = torch.cuda.FloatTensor(1, device=device).fill_(0)
+    vertex_count = 0
+    for b in range(batch_count.item()):
+        batch = seeds_loc[(b * mini_batch):((b + 1) * mini_batch)]
+
+        # Sample the blocks top-down, the rows of each block are the vertices of the layer above
+        frontier = batch + rank * n_per_proc
+        blocks = []
+        for i in reversed(range(len(weights))):
+            nbrs, nbr_weights = sample_neighbors(frontier, fanouts[i], csr, n_per_proc, rank, 
+                                                    size, group)
+            nbrs = nbrs.view(-1)
+            sampled = nbrs >= 0
+            nodes, cols = torch.unique(nbrs[sampled], return_inverse=True)
+            rows = torch.arange(frontier.size(0), device=device).repeat_interleave(fanouts[i])
+            blocks.insert(0, torch.sparse_coo_tensor(torch.stack((rows[sampled], cols)), 
+                                                        nbr_weights.view(-1)[sampled],
+                                                        size=(frontier.size(0), nodes.size(0))))
+            frontier = nodes
+
+        outputs = fetch_features(frontier, inputs_loc.detach(), n_per_proc, rank, size, group)
+        for i, w in enumerate(weights):
+            outputs = torch.mm(torch.sparse.mm(blocks[i], outputs), w)
+            # Same activations as the full-batch layer_forward
+            if activations:
+                outputs = F.relu(outputs) if i < len(weights) - 1 else F.log_softmax(outputs, dim=1)
+
+        # Gradients of the mean loss over every rank's seeds in this batch
+        batch_size = torch.cuda.FloatTensor([batch.size(0)], device=device)
+        dist.all_reduce(batch_size, op=dist.reduce_op.SUM, group=group)
+
+        optimizer.zero_grad()
+        classes = torch.gather(outputs, 1, data.y[batch].view(-1, 1))
+        loss = -torch.sum(classes) / batch_size
+        loss.backward()
+
+        for w in weights:
+            if w.grad is None:
+                w.grad = torch.zeros_like(w)
+            dist.all_reduce(w.grad, op=dist.reduce_op.SUM, group=group)
+        tstart_step = start_time(group, rank)
+        optimizer.step()
+        stop_time(group, rank, tstart_step, "optimizer_step")
+
+        loss_sum += loss.detach() * batch_size / data.train_count
+        vertex_count += int(batch_size.item())
+
+    dist.all_reduce(loss_sum, op=dist.reduce_op.SUM, group=group)
+    return loss_sum, vertex_count
+
+# Forward-only pass over the whole graph through the first layer_count layers. Bypasses
+# GCNFunc, so nothing is saved for a backward and no autograd graph is built.
+def forward(inputs, weights, adj_matrix, am_partitions, rank, size, group, layer_count=None, 
+                feature_cache=None, ax=None):
+    outputs = inputs
+    with torch.no_grad():
+        for i, w in enumerate(weights[:layer_count]):
+            _, outputs = layer_forward(outputs, w, adj_matrix, am_partitions, rank, size, group, 
+                                        F.relu if i < len(weights) - 1 else F.log_softmax, 
+                                        feature_cache if i == 0 else None, ax if i == 0 else None)
+    return outputs
 
 
 # Split a COO into partitions of size n_per_proc
@@ -416,6 +723,8 @@ def scale_elements(adj_matrix, adj_part, node_count, row_vtx, col_vtx):
     if not normalization:
         return adj_part
 
+    import torch_sparse
+
     # Scale each edge (u, v) by 1 / (sqrt(u) * sqrt(v))
     # indices = adj_part._indices()
     # values = adj_part._values()
@@ -521,35 +830,146 @@ def oned_partition(rank, size, inputs, adj_matrix, data, features, classes, devi
     print(f"rank: {rank} inputs.size: {inputs.size()}", flush=True)
     return inputs_loc, adj_matrix_loc, am_pbyp
 
+# oned_partition for a generated graph. This rank only generates its own columns of A, drawn as
+# the rows of A^T, and its rows of the features. Normalization would need global degrees, so the
+# values stay ones.
+def synthetic_partition(rank, size, node_count):
+    n_per_proc = math.ceil(float(node_count) / size)
+    col_start = rank * n_per_proc
+    col_stop = min(col_start + n_per_proc, node_count)
+    proc_node_count = col_stop - col_start
+
+    with torch.no_grad():
+        edge_index = synth_graph.edges(col_start, col_stop)
+        adj_cols = torch.stack([edge_index[1], edge_index[0] - col_start])
+
+        am_pbyp, vtx_indices = split_coo(adj_cols, node_count, n_per_proc, 0)
+        for i in range(len(am_pbyp)):
+            am_pbyp[i] = torch.sparse_coo_tensor(am_pbyp[i], torch.ones(am_pbyp[i].size(1)), 
+                                                    size=(vtx_indices[i + 1] - vtx_indices[i], 
+                                                            proc_node_count),
+                                                    requires_grad=False)
+
+        adj_matrix_loc = torch.sparse_coo_tensor(adj_cols, torch.ones(adj_cols.size(1)), 
+                                                    size=(node_count, proc_node_count),
+                                                    requires_grad=False)
+        inputs_loc = synth_graph.inputs(col_start, col_stop)
+
+    print(f"rank: {rank} adj_matrix_loc.size: {adj_matrix_loc.size()} nnz: {adj_cols.size(1)}", 
+            flush=True)
+    return inputs_loc, adj_matrix_loc, am_pbyp
+
+# Keep only this rank's rows of the labels and masks, so train() never touches the global tensors
+def label_partition(rank, size, data, node_count, device):
+    n_per_proc = math.ceil(float(node_count) / size)
+    row_start = rank * n_per_proc
+    row_stop = min(row_start + n_per_proc, node_count)
+
+    if synth_graph is not None:
+        data_loc = Data()
+        data_loc.y = synth_graph.labels(row_start, row_stop).to(device)
+        masks = synth_graph.masks(row_start, row_stop)
+        for key, mask in zip(['train_mask', 'val_mask', 'test_mask'], masks):
+            data_loc[key] = mask.to(device)
+        data_loc.train_count = synth_graph.train_count()
+        return data_loc
+
+    data_loc = Data()
+    data_loc.y = data.y[row_start:row_stop].to(device)
+    for key, mask in data('train_mask', 'val_mask', 'test_mask'):
+        data_loc[key] = mask[row_start:row_stop].bool().to(device)
+
+    data_loc.train_count = data.train_mask.bool().sum().item()
+    return data_loc
+
 def run(rank, size, inputs, adj_matrix, data, features, classes, device):
     global epochs
     global mid_layer
     global run
     global timing
     global num_layers
+    global bcast_group
+    global tracer
 
     layer_sizes = [features] + [mid_layer for i in range(num_layers - 1)] + [classes]
+    node_count = synth_graph.nodes if synth_graph is not None else inputs.size(0)
 
     best_val_acc = test_acc = 0
+    best_weights = None
     outputs = None
+
+    tstart = time.time()
     group = dist.new_group(list(range(size)))
 
+    if hierarchical:
+        bcast_group = topology.HierGroup(list(range(size)), topology.node_ids(size, device), group)
+    startup["groups"] = time.time() - tstart
+
     if rank >= size:
         return
 
     # adj_matrix_loc = torch.rand(node_count, n_per_proc)
     # inputs_loc = torch.rand(n_per_proc, inputs.size(1))
 
+    tstart = time.time()
+    partition = None
+    if resume:
+        partition = checkpoint.load_partition(ckpt_dir, rank)
+
+    if partition is None and synth_graph is not None:
+        inputs_loc, adj_matrix_loc, am_pbyp = synthetic_partition(rank, size, node_count)
+        if ckpt_dir is not None:
+            checkpoint.save_partition(ckpt_dir, rank, (inputs_loc, adj_matrix_loc, am_pbyp))
+    elif partition is None:
+        inputs_loc, adj_matrix_loc, am_pbyp = oned_partition(rank, size, inputs, adj_matrix, data, 
+                                                                    features, classes, device)
+        if ckpt_dir is not None:
+            checkpoint.save_partition(ckpt_dir, rank, (inputs_loc, adj_matrix_loc, am_pbyp))
+    else:
+        inputs_loc, adj_matrix_loc, am_pbyp = partition
 
-    inputs_loc, adj_matrix_loc, am_pbyp = oned_partition(rank, size, inputs, adj_matrix, data, 
-                                                                features, classes, device)
-
+    # Full-batch training only needs adj_matrix_loc's shape, so it stays on the host
     inputs_loc = inputs_loc.to(device)
-    adj_matrix_loc = adj_matrix_loc.to(device)
+    if mini_batch > 0:
+        adj_matrix_loc = adj_matrix_loc.to(device)
+
+    coo_bytes = 0
+    stages = []
     for i in range(len(am_pbyp)):
-        am_pbyp[i] = am_pbyp[i].t().coalesce().to(device)
+        block = am_pbyp[i].t().coalesce().to(device)
+        stages.append((block._nnz(), block.size(0), block.size(1)))
+        coo_bytes += block.indices().numel() * 8 + block.values().numel() * 4
+        am_pbyp[i] = compact_block(block)
+    print(f"rank: {rank} adjacency blocks: {sum(block_bytes(b) for b in am_pbyp) / 2**20}MB " \
+            f"(COO: {coo_bytes / 2**20}MB)", flush=True)
+
+    startup["partition"] = time.time() - tstart
+    print(f"rank: {rank} startup: {startup} total: {time.time() - startup_tstart}s", flush=True)
+    perf.balance(rank, group, stages, features, mem_bandwidth, imbalance, device)
+
+    data_loc = label_partition(rank, size, data, node_count, device)
+
+    if mini_batch > 0:
+        csr = sample_csr(adj_matrix_loc)
+
+    feature_cache = None
+    if cache_features != 0 and not precompute_ax:
+        feature_cache = build_feature_cache(inputs_loc, am_pbyp, rank, size, group)
+    ax = None
+
+    ckpt = None
+    if resume:
+        ckpt = checkpoint.load(ckpt_dir, rank)
+
+    ckpt_writer = None
+    if ckpt_dir is not None and ckpt_every > 0:
+        ckpt_writer = checkpoint.CheckpointWriter(ckpt_dir, rank, device, ckpt_queue)
 
     for i in range(run_count):
+        # Runs finished before the checkpoint are not repeated
+        if ckpt is not None and i < ckpt["run"]:
+            continue
+
         run = i
         torch.manual_seed(0)
         weights = []
@@ -563,6 +983,16 @@ def run(rank, size, inputs, adj_matrix, data, features, classes, device):
         #weight2 = Parameter(weight2_nonleaf)
 
         optimizer = torch.optim.Adam(weights, lr=0.01)
+
+        start_epoch = 1
+        best = None
+        if ckpt is not None and i == ckpt["run"]:
+            best = checkpoint.restore(ckpt, weights, optimizer, device)
+            start_epoch = ckpt["epoch"] + 1
+
+        if inference and ckpt_dir is not None:
+            checkpoint.load_weights(ckpt_dir, weights)
+
         dist.barrier(group)
 
         tstart = 0.0
@@ -578,6 +1008,7 @@ def run(rank, size, inputs, adj_matrix, data, features, classes, device):
         barrier_subset_time[i] = dict()
         op1_comm_time[i] = dict()
         op2_comm_time[i] = dict()
+        work[i] = dict()
 
         total_time[i][rank] = 0.0
         comm_time[i][rank] = 0.0
@@ -589,39 +1020,157 @@ def run(rank, size, inputs, adj_matrix, data, features, classes, device):
         barrier_subset_time[i][rank] = 0.0
         op1_comm_time[i][rank] = 0.0
         op2_comm_time[i][rank] = 0.0
-
-        timing_on = timing == True
-        timing = False
-        outputs = train(inputs_loc, weights, adj_matrix_loc, am_pbyp, optimizer, data, rank, size, group)
-        if timing_on:
-            timing = True
+        work[i][rank] = perf.Counts()
+
+        # The features never change, so A * X is computed once, untimed, and reused by every run
+        if precompute_ax and ax is None:
+            timing_on = timing == True
+            timing = False
+            with torch.no_grad():
+                ax = broad_func(node_count, am_pbyp, inputs_loc, rank, size, group)
+            if timing_on:
+                timing = True
+
+        # Each run is one forward pass in inference
+        if inference:
+            dist.barrier(group)
+            torch.cuda.reset_peak_memory_stats(device)
+            tstart = time.time()
+            outputs = forward(inputs_loc, weights, adj_matrix_loc, am_pbyp, rank, size, group, 
+                                layer_count, feature_cache, ax)
+            torch.cuda.synchronize(device=device)
+            total_time[i][rank] = time.time() - tstart
+            print(f"rank: {rank} run {i} inference_time: {total_time[i][rank]} " \
+                    f"peak_memory: {torch.cuda.max_memory_allocated(device) / 2**20}MB", flush=True)
+            continue
+
+        # The warm-up epoch also steps the optimizer, a resumed run already did it
+        if start_epoch == 1:
+            timing_on = timing == True
+            timing = False
+            if mini_batch > 0:
+                loss, _ = train_minibatch(inputs_loc, weights, csr, optimizer, data_loc, node_count, 
+                                            rank, size, group)
+            else:
+                outputs, loss = train(inputs_loc, weights, adj_matrix_loc, am_pbyp, optimizer, data_loc, 
+                                        rank, size, group, feature_cache, ax)
+            if timing_on:
+                timing = True
 
         dist.barrier(group)
+        # The trace clock starts at the barrier before the first timed run, on every rank at once
+        if trace_path is not None and tracer is None:
+            tracer = timeline.Timeline(trace_path, rank)
         tstart = time.time()
 
         # for epoch in range(1, 201):
         print(f"Starting training... rank {rank} run {i}", flush=True)
         tt = tstart
-        for epoch in range(1, epochs):
-            outputs = train(inputs_loc, weights, adj_matrix_loc, am_pbyp, optimizer, data, 
-                                    rank, size, group)
-            print("Epoch: {:03d} {}".format(epoch, time.time() - tt), flush=True)
+        best_val_acc = test_acc = 0
+        best_weights = None
+        bad_evals = 0
+        # A resumed run continues the early stopping of the checkpointed one
+        if best is not None:
+            best_weights = best["weights"]
+            best_val_acc = best["val_acc"]
+            test_acc = best["test_acc"]
+            bad_evals = best["bad_evals"]
+        for epoch in range(start_epoch, epochs):
+            # The outputs of an epoch come from the weights before its optimizer step
+            eval_epoch = eval_every > 0 and epoch % eval_every == 0
+            if eval_epoch:
+                weights_pre = [w.detach().clone() for w in weights]
+
+            if mini_batch > 0:
+                # Evaluate with a full-batch forward of the same weights the epoch starts from
+                if eval_epoch:
+                    outputs = forward(inputs_loc, weights, adj_matrix_loc, am_pbyp, rank, size, group, 
+                                        None, feature_cache, ax)
+                loss, vertex_count = train_minibatch(inputs_loc, weights, csr, optimizer, data_loc, 
+                                                        node_count, rank, size, group)
+            else:
+                outputs, loss = train(inputs_loc, weights, adj_matrix_loc, am_pbyp, optimizer, data_loc, 
+                                        rank, size, group, feature_cache, ax)
+                vertex_count = data_loc.train_count
+
+            # Throughput in train vertices per second, comparable between both modes
+            epoch_time = time.time() - tt
+            if tracer is not None:
+                tracer.event(f"epoch {epoch}", tt, tid=timeline.epoch_tid, cat="epoch")
+            print("Epoch: {:03d} {} loss: {:.4f} vertices/s: {:.1f}".format(epoch, epoch_time, 
+                    loss.item(), vertex_count / epoch_time), flush=True)
+
+            if eval_epoch:
+                train_acc, val_acc, tmp_test_acc = test(outputs, data_loc, group)
+                log = 'Epoch: {:03d}, Train: {:.4f}, Val: {:.4f}, Test: {:.4f}'
+                print(log.format(epoch, train_acc, val_acc, tmp_test_acc), flush=True)
+
+                # val_acc is globally reduced, so every rank takes the same early-stopping decision
+                if val_acc > best_val_acc:
+                    best_val_acc = val_acc
+                    test_acc = tmp_test_acc
+                    best_weights = weights_pre
+                    bad_evals = 0
+                else:
+                    bad_evals += 1
+                    if patience > 0 and bad_evals >= patience:
+                        print(f"rank: {rank} early stop at epoch {epoch} best val: {best_val_acc}", 
+                                flush=True)
+                        break
+
+            if ckpt_writer is not None and epoch % ckpt_every == 0:
+                ckpt_writer.save(i, epoch, weights, optimizer, dict(weights=best_weights, 
+                            val_acc=best_val_acc, test_acc=test_acc, bad_evals=bad_evals))
+
             tt = time.time() 
 
         # dist.barrier(group)
         tstop = time.time()
         total_time[i][rank] = tstop - tstart
 
+        # Keep the best weights seen by the periodic evaluation
+        if best_weights is not None:
+            with torch.no_grad():
+                for w, w_best in zip(weights, best_weights):
+                    w.copy_(w_best)
+
+        # The outputs so far came from the last epoch's weights, and a resumed run with no epochs
+        # left has none. Mini-batch training computes its full outputs after the last run.
+        if best_weights is not None or (outputs is None and mini_batch == 0):
+            timing_on = timing == True
+            timing = False
+            with torch.no_grad():
+                outputs = forward(inputs_loc, weights, adj_matrix_loc, am_pbyp, rank, size, group, None, 
+                                    feature_cache, ax)
+            if timing_on:
+                timing = True
+
+    if ckpt_writer is not None:
+        ckpt_writer.close()
+
+    # Mini-batch training leaves no full outputs behind, unless restoring the best weights already
+    # recomputed them
+    if mini_batch > 0 and not inference and best_weights is None:
+        outputs = forward(inputs_loc, weights, adj_matrix_loc, am_pbyp, rank, size, group, None, 
+                            feature_cache, ax)
+
+    if inference and out_dir is not None:
+        pred = outputs.max(1)[1] if layer_count is None else None
+        checkpoint.save_outputs(out_dir, rank, outputs, rank * math.ceil(float(node_count) / size), 
+                                    0, pred)
+
     # Get median runtime according to rank0 and print that run's breakdown
     dist.barrier(group)
     if rank == 0:
+        # A resumed process only has the runs from the checkpoint onwards
+        run_ids = sorted(total_time.keys())
         total_times_r0 = [] 
-        for i in range(run_count):
+        for i in run_ids:
             total_times_r0.append(total_time[i][0])
 
         print(f"total_times_r0: {total_times_r0}")
         median_run_time = statistics.median(total_times_r0)
-        median_idx = total_times_r0.index(median_run_time)
+        median_idx = run_ids[total_times_r0.index(median_run_time)]
         median_idx = torch.cuda.LongTensor([median_idx])
     else:
         median_idx = torch.cuda.LongTensor([0])
@@ -640,29 +1189,26 @@ def run(rank, size, inputs, adj_matrix, data, features, classes, device):
     print(f"rank: {rank} op1_comm_time: {op1_comm_time[median_idx][rank]}")
     print(f"rank: {rank} op2_comm_time: {op2_comm_time[median_idx][rank]}")
     print(f"rank: {rank} {outputs}")
+
+    # Phase timers are only filled with --timing
+    if timing:
+        phases = dict(scomp=scomp_time[median_idx][rank], dcomp=dcomp_time[median_idx][rank],
+                        bcast_comm=bcast_comm_time[median_idx][rank], 
+                        op2_comm=op2_comm_time[median_idx][rank],
+                        barrier=barrier_time[median_idx][rank])
+        perf.report(rank, group, phases, work[median_idx][rank], total_time[median_idx][rank], device)
     
     
-    if accuracy:
-        # All-gather outputs to test accuracy
-        output_parts = []
-        n_per_proc = math.ceil(float(inputs.size(0)) / size)
-        # print(f"rows: {am_pbyp[-1].size(0)} cols: {classes}", flush=True)
-        for i in range(size):
-            output_parts.append(torch.cuda.FloatTensor(n_per_proc, classes, device=device).fill_(0))
-
-        if outputs.size(0) != n_per_proc:
-            pad_row = n_per_proc - outputs.size(0) 
-            outputs = torch.cat((outputs, torch.cuda.FloatTensor(pad_row, classes, device=device)), dim=0)
-
-        dist.all_gather(output_parts, outputs)
-        output_parts[rank] = outputs
-        
-        padding = inputs.size(0) - n_per_proc * (size - 1)
-        output_parts[size - 1] = output_parts[size - 1][:padding,:]
-
-        outputs = torch.cat(output_parts, dim=0)
+    # Every rank writes its part of the trace, rank 0 merges them
+    if tracer is not None:
+        tracer.write()
+        dist.barrier(group)
+        if rank == 0:
+            timeline.merge(trace_path, dist.get_world_size(group))
+            print(f"trace: {trace_path}", flush=True)
 
-        train_acc, val_acc, tmp_test_acc = test(outputs, data, am_pbyp[0].size(1), rank)
+    if accuracy:
+        train_acc, val_acc, tmp_test_acc = test(outputs, data_loc, group)
         if val_acc > best_val_acc:
             best_val_acc = val_acc
             test_acc = tmp_test_acc
@@ -703,7 +1249,9 @@ def main():
             os.environ["MASTER_ADDR"] = "127.0.0.1"
 
         os.environ["MASTER_PORT"] = "1234"
-        dist.init_process_group(backend='nccl')
+        tstart = time.time()
+        dist.init_process_group(backend=backend)
+        startup["init"] = time.time() - tstart
         rank = dist.get_rank()
         size = dist.get_world_size()
         print("Processes: " + str(size))
@@ -716,7 +1264,10 @@ def main():
         # print(f"curr_devid: {curr_devid}", flush=True)
         devcount = torch.cuda.device_count()
 
+    tstart = time.time()
     if graphname == "Cora":
+        from torch_geometric.datasets import Planetoid
+        import torch_geometric.transforms as T
         path = osp.join(osp.dirname(osp.realpath(__file__)), '..', 'data', graphname)
         dataset = Planetoid(path, graphname, T.NormalizeFeatures())
         data = dataset[0]
@@ -729,6 +1280,8 @@ def main():
         num_features = dataset.num_features
         num_classes = dataset.num_classes
     elif graphname == "Reddit":
+        from reddit import Reddit
+        import torch_geometric.transforms as T
         path = osp.join(osp.dirname(osp.realpath(__file__)), '..', 'data', graphname)
         dataset = Reddit(path, T.NormalizeFeatures())
         data = dataset[0]
@@ -785,6 +1338,15 @@ def main():
         data = data.to(device)
         inputs.requires_grad = True
         data.y = data.y.to(device)
+    elif synth_graph is not None:
+        # Each rank generates its own partition in run(), nothing global is built here
+        if normalization:
+            print(f"normalization is not applied to generated graphs", flush=True)
+        inputs = None
+        data = None
+        edge_index = None
+        num_features = synth_graph.features
+        num_classes = synth_graph.classes
     elif graphname == 'ogb':
         from ogb.nodeproppred import PygNodePropPredDataset
         dataset = PygNodePropPredDataset(name = graphname, root = 'dataset/')
@@ -802,6 +1364,8 @@ def main():
         data = data.to(device)
         data.x.requires_grad = True
     else:
+        from scipy.sparse import csr_matrix
+        from torch_geometric.utils import from_scipy_sparse_matrix
         name = graphname
         with open(os.path.join(name, 'graph.bin'), 'rb') as f:
             s = f.read(11)
@@ -837,10 +1401,13 @@ def main():
     if download:
         exit()
 
-    if normalization:
+    if synth_graph is not None:
+        adj_matrix = None
+    elif normalization:
         adj_matrix, _ = add_remaining_self_loops(edge_index, num_nodes=inputs.size(0))
     else:
         adj_matrix = edge_index
+    startup["load"] = time.time() - tstart
 
 
     init_process(rank, size, inputs, adj_matrix, data, num_features, num_classes, device, outputs, 
@@ -856,6 +1423,9 @@ if __name__ == '__main__':
     parser.add_argument("--epochs", type=int)
     parser.add_argument("--graphname", type=str)
     parser.add_argument("--timing", type=str)
+    parser.add_argument("--trace", type=str, default=None)
+    parser.add_argument("--imbalance", type=float, default=1.5)
+    parser.add_argument("--membw", type=float, default=900.)
     parser.add_argument("--midlayer", type=int)
     parser.add_argument("--runcount", type=int)
     parser.add_argument("--normalization", type=str)
@@ -863,6 +1433,27 @@ if __name__ == '__main__':
     parser.add_argument("--accuracy", type=str)
     parser.add_argument("--download", type=bool)
     parser.add_argument("--layers", type=int, default=1)
+    parser.add_argument("--evalevery", type=int, default=0)
+    parser.add_argument("--patience", type=int, default=0)
+    parser.add_argument("--checkpoint", type=str, default=None)
+    parser.add_argument("--ckptevery", type=int, default=0)
+    parser.add_argument("--ckptqueue", type=int, default=2)
+    parser.add_argument("--resume", type=str, default="False")
+    parser.add_argument("--inference", type=str, default="False")
+    parser.add_argument("--outdir", type=str, default=None)
+    parser.add_argument("--embedlayer", type=int, default=0)
+    parser.add_argument("--cachefeatures", type=int, default=0)
+    parser.add_argument("--precomputeax", type=str, default="False")
+    parser.add_argument("--backend", type=str, default="nccl")
+    parser.add_argument("--nodes", type=int, default=1 << 20)
+    parser.add_argument("--degree", type=int, default=16)
+    parser.add_argument("--skew", type=str, default=synthetic.default_skew)
+    parser.add_argument("--features", type=int, default=128)
+    parser.add_argument("--classes", type=int, default=16)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--hierarchical", type=str, default="False")
+    parser.add_argument("--minibatch", type=int, default=0)
+    parser.add_argument("--fanout", type=str, default="10")
     args = parser.parse_args()
     print(args)
 
@@ -871,6 +1462,12 @@ if __name__ == '__main__':
     epochs = args.epochs
     graphname = args.graphname
     timing = args.timing == "True"
+    trace_path = args.trace
+    imbalance = args.imbalance
+    mem_bandwidth = args.membw
+    # The trace records the phase timers
+    if trace_path is not None:
+        timing = True
     mid_layer = args.midlayer
     run_count = args.runcount
     num_layers = args.layers
@@ -878,12 +1475,47 @@ if __name__ == '__main__':
     activations = args.activations == "True"
     accuracy = args.accuracy == "True"
     download = args.download
+    eval_every = args.evalevery
+    patience = args.patience
+    ckpt_dir = args.checkpoint
+    ckpt_every = args.ckptevery
+    ckpt_queue = args.ckptqueue
+    resume = args.resume == "True" and ckpt_dir is not None
+    inference = args.inference == "True"
+    out_dir = args.outdir
+    if args.embedlayer > 0:
+        layer_count = args.embedlayer
+    cache_features = args.cachefeatures
+    precompute_ax = args.precomputeax == "True"
+    backend = args.backend
+    if graphname == "rmat" or graphname == "er":
+        synth_graph = synthetic.Graph(graphname, args.nodes, args.degree, args.skew, args.features, 
+                                        args.classes, args.seed)
+    hierarchical = args.hierarchical == "True"
+    mini_batch = args.minibatch
+    fanouts = [int(f) for f in args.fanout.split(",")]
+    fanouts = fanouts + [fanouts[-1]] * (num_layers - len(fanouts))
 
     if not download:
         if (epochs is None) or (graphname is None) or (timing is None) or (mid_layer is None) or (run_count is None):
             print(f"Error: missing argument {epochs} {graphname} {timing} {mid_layer} {run_count}")
             exit()
 
+    # Mini-batch sampling exchanges vertices with all_to_all, which gloo does not implement
+    if mini_batch > 0 and backend == "gloo":
+        print(f"Error: --minibatch needs all_to_all, which the gloo backend does not support")
+        exit()
+
+    # Inference runs the trained weights of --checkpoint, without them it would score random ones
+    if inference and ckpt_dir is None:
+        print(f"Error: --inference=True needs the trained weights of --checkpoint")
+        exit()
+
+    # Inference embeddings are hidden features, not class scores to take the accuracy of
+    if inference and accuracy and layer_count is not None:
+        print(f"Error: --accuracy=True scores class predictions and cannot be used with --embedlayer")
+        exit()
+
     print(f"Arguments: epochs: {epochs} graph: {graphname} timing: {timing} mid: {mid_layer} norm: {normalization} act: {activations} acc: {accuracy} runs: {run_count}")
     
     print(main())
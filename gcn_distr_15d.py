@@ -1,3 +1,6 @@
+import time
+startup_tstart = time.time()
+
 import os
 import os.path as osp
 import argparse
@@ -8,31 +11,31 @@ import math
 import torch
 import torch.distributed as dist
 
-from torch_geometric.data import Data, Dataset
-from torch_geometric.datasets import Planetoid, PPI
-from reddit import Reddit
-from torch_geometric.nn import GCNConv, ChebConv  # noqa
-from torch_geometric.utils import from_scipy_sparse_matrix, add_remaining_self_loops, to_dense_adj, dense_to_sparse, to_scipy_sparse_matrix
-import torch_geometric.transforms as T
+from torch_geometric.data import Data
+import checkpoint
+import topology
+import perf
+import synthetic
+import timeline
+from torch_geometric.utils import add_remaining_self_loops
 
 import torch.multiprocessing as mp
 
-from torch.multiprocessing import Manager, Process
-
 from torch.nn import Parameter
 import torch.nn.functional as F
 
-from torch_scatter import scatter_add
-import torch_sparse
-
-from sparse_coo_tensor_cpp import sparse_coo_tensor_gpu, spmm_gpu
+from sparse_coo_tensor_cpp import spmm_csr_gpu
 
 import socket
 import statistics
-import time
 import numpy as np
 
-from scipy.sparse import csr_matrix, coo_matrix
+# The dataset loaders, scipy and torch_sparse are imported where they are used, so a run only
+# loads what its graph and preprocessing need
+
+# Seconds spent in each startup phase, printed once the partition is ready
+startup = dict()
+startup["imports"] = time.time() - startup_tstart
 
 # comp_time = 0.0
 # comm_time = 0.0
@@ -50,8 +53,10 @@ dcomp_time = dict()
 bcast_comm_time = dict()
 bcast_words = dict()
 reduce_comm_time = dict()
+gather_comm_time = dict()
 op_comm_time = dict()
 barrier_time = dict()
+work = dict() # perf.Counts of the timed phases, indexed [run][rank] like the timers
 
 epochs = 0
 graphname = ""
@@ -61,11 +66,32 @@ normalization = False
 activations = False
 accuracy = False
 device = None
+implicit_values = dict() # device -> ones shared as the values of every all-1 block on it
 acc_per_rank = 0
 run_count = 0
 run = 0
-replication = 0
+replication = 0 # ranks per block row, 0 picks it from the GPU memory
+mem_fraction = 0.8 # share of GPU memory the automatic replication factor plans for
 download = False
+eval_every = 0 # evaluate every k epochs during training (0 disables)
+patience = 0 # stop after this many evaluations without a better val accuracy (0 disables)
+ckpt_dir = None # checkpoint directory (None disables checkpointing)
+ckpt_every = 0 # checkpoint every k epochs (0 disables)
+ckpt_queue = 2 # checkpoints in flight before training waits for the writer
+resume = False
+inference = False # forward-only pass over the whole graph with trained weights
+out_dir = None # directory for each rank's output shard in inference
+layer_count = None # layers to run in inference, None runs all of them and writes predictions
+precompute_ax = False # compute A * X once and make layer 0 a local GEMM
+reduce_scatter = False # keep a 1/c slice of each block row instead of all-reducing it
+hierarchical = False # two-level column broadcasts, inter-node then intra-node
+col_bcast_groups = None # topology.HierGroup per column group with hierarchical
+backend = "nccl" # torch.distributed backend, gloo where NCCL is unavailable
+synth_graph = None # synthetic.Graph each rank generates its own partition of, instead of graphname
+tracer = None # timeline.Timeline every timed phase is recorded in with --trace
+trace_path = None # Chrome trace file the ranks' timelines are merged into
+imbalance = 1.5 # nnz imbalance (max / mean) over which the pre-training balance report warns
+mem_bandwidth = 900. # GB/s the balance report predicts the SpMM stage times at
 
 def start_time(group, rank, subset=False, src=None):
     global barrier_time
@@ -79,12 +105,17 @@ def start_time(group, rank, subset=False, src=None):
         torch.cuda.synchronize(device=device)
         barrier_tstop = time.time()
         barrier_time[run][rank] += barrier_tstop - barrier_tstart
-    tstart = 0.0
-    if rank == 0:
-        tstart = time.time()
+    # Every rank times its phases, for the imbalance in the performance report
+    tstart = time.time()
     return tstart
 
-def stop_time(group, rank, tstart):
+# Count a phase's flops and bytes next to its timer. Only timed work is counted, so the counts
+# match the seconds they are divided by.
+def count_work(rank, phase, phase_work):
+    if timing:
+        work[run][rank].add(phase, phase_work)
+
+def stop_time(group, rank, tstart, name=None):
     global barrier_time
     global run
 
@@ -96,9 +127,9 @@ def stop_time(group, rank, tstart):
         torch.cuda.synchronize(device=device)
         barrier_tstop = time.time()
         barrier_time[run][rank] += barrier_tstop - barrier_tstart
-    tstop = 0.0
-    if rank == 0:
-        tstop = time.time()
+    tstop = time.time()
+    if tracer is not None and name is not None:
+        tracer.event(name, tstart, tstop)
     return tstop - tstart
 
 def normalize(adj_matrix):
@@ -158,21 +189,98 @@ def outer_product2(inputs, ag, rank, size, group):
     tstart_comp = start_time(group, rank)
     # (H^(l-1))^T * (A * G^l)
     grad_weight = torch.mm(inputs, ag)
+    count_work(rank, "dcomp", perf.gemm_work(inputs.size(0), inputs.size(1), ag.size(1)))
 
-    dur = stop_time(group, rank, tstart_comp)
+    dur = stop_time(group, rank, tstart_comp, "dcomp")
     comp_time[run][rank] += dur
     dcomp_time[run][rank] += dur
     
     tstart_comm = start_time(group, rank)
     # reduction on grad_weight low-rank matrices
     dist.all_reduce(grad_weight, op=dist.reduce_op.SUM, group=group)
+    count_work(rank, "op_comm", perf.message_work(grad_weight))
 
-    dur = stop_time(group, rank, tstart_comm)
+    dur = stop_time(group, rank, tstart_comm, "op_comm")
     comm_time[run][rank] += dur
     op_comm_time[run][rank] += dur
 
     return grad_weight
 
+# SpMM operand form of a coalesced block: (rowptr, colind, values, height, width) with int32 CSR
+# row offsets and column indices, converted once instead of on every SpMM. Blocks whose values are
+# all 1 (--normalization=False) keep an empty values tensor and share one ones vector at SpMM time.
+def compact_block(block):
+    rows = block.indices()[0]
+    rowptr = torch.cuda.IntTensor(block.size(0) + 1, device=device).fill_(0)
+    rowptr[1:] = torch.cumsum(torch.bincount(rows, minlength=block.size(0)), dim=0)
+    colind = block.indices()[1].int()
+
+    values = block.values()
+    if bool((values == 1).all()):
+        values = torch.cuda.FloatTensor(0, device=device)
+        implicit_ones(colind.size(0), device)
+
+    return (rowptr, colind, values, block.size(0), block.size(1))
+
+# Values of an all-1 block with nnz nonzeros. The shared vector is grown while the blocks are
+# compacted, so the SpMMs only slice it.
+def implicit_ones(nnz, device):
+    if device not in implicit_values or implicit_values[device].size(0) < nnz:
+        implicit_values[device] = torch.cuda.FloatTensor(nnz, device=device).fill_(1)
+    return implicit_values[device][:nnz]
+
+def block_bytes(block):
+    rowptr, colind, values, _, _ = block
+    return sum(t.numel() * t.element_size() for t in (rowptr, colind, values))
+
+# z += block * inputs
+def spmm_block(block, inputs, z):
+    rowptr, colind, values, height, width = block
+    if values.numel() == 0:
+        values = implicit_ones(colind.size(0), inputs.device)
+    spmm_csr_gpu(rowptr, colind, values, height, width, inputs, z)
+
+# Rows [start, stop) of a block row of height rows that replica rank_col keeps with reduce_scatter
+def slice_range(rows, rank_col):
+    per_col = math.ceil(float(rows) / replication)
+    start = min(rank_col * per_col, rows)
+    return start, min(start + per_col, rows)
+
+# NCCL needs equal chunks, so slices are padded to ceil(rows / c) and trimmed after the collective
+def pad_rows(mat, rows):
+    if mat.size(0) == rows:
+        return mat.contiguous()
+    pad = torch.cuda.FloatTensor(rows - mat.size(0), mat.size(1), device=device).fill_(0)
+    return torch.cat((mat, pad), dim=0)
+
+# Full block row of height rows from the replicas' slices
+def gather_slices(mat, rows, rank, row_groups):
+    per_col = math.ceil(float(rows) / replication)
+    mat_recv = []
+    for i in range(replication):
+        mat_recv.append(torch.cuda.FloatTensor(per_col, mat.size(1), device=device))
+
+    dist.all_gather(mat_recv, pad_rows(mat, per_col), group=row_groups[rank // replication])
+    return torch.cat(mat_recv, dim=0)[:rows]
+
+# Sum the replicas' partial block rows, keeping only this replica's slice of the sum
+def scatter_slices(mat, rank, row_groups):
+    per_col = math.ceil(float(mat.size(0)) / replication)
+    mat_send = list(torch.split(pad_rows(mat, per_col * replication), per_col, dim=0))
+    mat_recv = torch.cuda.FloatTensor(per_col, mat.size(1), device=device)
+
+    dist.reduce_scatter(mat_recv, mat_send, op=dist.reduce_op.SUM, group=row_groups[rank // replication])
+
+    start, stop = slice_range(mat.size(0), rank % replication)
+    return mat_recv[:(stop - start)]
+
+# Group in which every row of the graph is held exactly once, for reductions over rows: one
+# replica of each block row, or every active rank when reduce_scatter leaves each with a slice
+def owner_group(rank, group, col_groups):
+    if reduce_scatter:
+        return group
+    return col_groups[rank % replication]
+
 def broad_func(node_count, am_partitions, inputs, rank, size, row_groups, col_groups, group):
     global device
     global comm_time
@@ -181,76 +289,135 @@ def broad_func(node_count, am_partitions, inputs, rank, size, row_groups, col_gr
     global bcast_comm_time
     global bcast_words
     global reduce_comm_time
+    global gather_comm_time
     global run
     global replication
 
     # n_per_proc = math.ceil(float(adj_matrix.size(1)) / size)
-    n_per_proc = math.ceil(float(node_count) / (size / replication))
+    n_per_proc = math.ceil(float(node_count) / block_count(size))
+
+    rank_c = rank // replication
+    rank_col = rank % replication
+
+    # The broadcasts need the whole block row, so the replicas' slices are gathered first
+    if reduce_scatter:
+        tstart_comm = start_time(row_groups[rank_c], rank)
+        inputs = gather_slices(inputs, am_partitions[0][3], rank, row_groups)
+        count_work(rank, "gather_comm", perf.message_work(inputs))
+        dur = stop_time(row_groups[rank_c], rank, tstart_comm, "gather_comm")
+
+        comm_time[run][rank] += dur
+        gather_comm_time[run][rank] += dur
 
     # z_loc = torch.cuda.FloatTensor(adj_matrix.size(0), inputs.size(1), device=device).fill_(0)
-    z_loc = torch.cuda.FloatTensor(am_partitions[0].size(0), inputs.size(1), device=device).fill_(0)
+    z_loc = torch.cuda.FloatTensor(am_partitions[0][3], inputs.size(1), device=device).fill_(0)
     # z_loc = torch.zeros(adj_matrix.size(0), inputs.size(1))
 
     inputs_recv = torch.cuda.FloatTensor(n_per_proc, inputs.size(1), device=device).fill_(0)
     # inputs_recv = torch.zeros(n_per_proc, inputs.size(1))
 
-    rank_c = rank // replication
-    rank_col = rank % replication
-
-    stages = size // (replication ** 2)
-    if rank_col == replication - 1:
-        stages = (size // replication) - (replication - 1) * stages
+    stage_start, stages = stage_range(rank_col, size)
 
     for i in range(stages):
-        # q = rank_c // (size // (replication ** 2)) * (size // (replication ** 2)) + i
-        # = q * replication + rank_c // (size // (replication **2))
-        q = (rank_col * (size // (replication ** 2)) + i) * replication + rank_col
-
-        q_c = q // replication
-
-        am_partid = rank_col * (size // replication ** 2) + i
+        # Block am_partid's features come from its replica in this column
+        am_partid = stage_start + i
+        q = am_partid * replication + rank_col
 
         if q == rank:
             inputs_recv = inputs.clone()
-        elif q_c == size // replication - 1:
-            inputs_recv = torch.cuda.FloatTensor(am_partitions[am_partid].size(1), inputs.size(1), device=device).fill_(0)
+        elif inputs_recv.size(0) != am_partitions[am_partid][4]:
+            inputs_recv = torch.cuda.FloatTensor(am_partitions[am_partid][4], inputs.size(1), device=device).fill_(0)
             # inputs_recv = torch.zeros(list(am_partitions[i].t().size())[1], inputs.size(1))
 
         tstart_comm = start_time(col_groups[rank_col], rank)
 
         inputs_recv = inputs_recv.contiguous()
         bcast_words[run][rank] += inputs_recv.size(0) * inputs_recv.size(1)
-        dist.broadcast(inputs_recv, src=q, group=col_groups[rank_col])
+        if col_bcast_groups is not None:
+            col_bcast_groups[rank_col].broadcast(inputs_recv, q)
+        else:
+            dist.broadcast(inputs_recv, src=q, group=col_groups[rank_col])
+        count_work(rank, "bcast_comm", perf.message_work(inputs_recv))
 
-        dur = stop_time(col_groups[rank_col], rank, tstart_comm)
+        dur = stop_time(col_groups[rank_col], rank, tstart_comm, "bcast_comm")
 
         comm_time[run][rank] += dur
         bcast_comm_time[run][rank] += dur
 
         tstart_comp = start_time(col_groups[rank_col], rank)
 
-        spmm_gpu(am_partitions[am_partid].indices()[0].int(), am_partitions[am_partid].indices()[1].int(), 
-                        am_partitions[am_partid].values(), am_partitions[am_partid].size(0), 
-                        am_partitions[am_partid].size(1), inputs_recv, z_loc)
+        spmm_block(am_partitions[am_partid], inputs_recv, z_loc)
+        block = am_partitions[am_partid]
+        count_work(rank, "scomp", perf.spmm_work(block[1].numel(), block[3], block[4], 
+                                                    inputs_recv.size(1)))
 
-        dur = stop_time(col_groups[rank_col], rank, tstart_comp)
+        dur = stop_time(col_groups[rank_col], rank, tstart_comp, "scomp")
         comp_time[run][rank] += dur
         scomp_time[run][rank] += dur
 
     z_loc = z_loc.contiguous()
 
     tstart_comm = start_time(row_groups[rank_c], rank)
-    dist.all_reduce(z_loc, op=dist.reduce_op.SUM, group=row_groups[rank_c])
-    dur = stop_time(row_groups[rank_c], rank, tstart_comm)
+    count_work(rank, "reduce_comm", perf.message_work(z_loc))
+    if reduce_scatter:
+        z_loc = scatter_slices(z_loc, rank, row_groups)
+    else:
+        dist.all_reduce(z_loc, op=dist.reduce_op.SUM, group=row_groups[rank_c])
+    dur = stop_time(row_groups[rank_c], rank, tstart_comm, "reduce_comm")
 
     comm_time[run][rank] += dur
     reduce_comm_time[run][rank] += dur
 
     return z_loc
 
+# One GCN layer, sigma(A * H * W). Returns the pre-activation z as well for the backward.
+# With ax, the precomputed A * X of layer 0, the SpMM is skipped.
+def layer_forward(inputs, weight, adj_matrix, am_partitions, rank, size, group, row_groups, 
+                    col_groups, func, ax=None):
+    global comp_time
+    global dcomp_time
+    global run
+
+    # z = block_row(adj_matrix.t(), am_partitions, inputs, weight, rank, size)
+    if ax is not None:
+        z = ax
+    else:
+        z = broad_func(adj_matrix.size(0), am_partitions, inputs, rank, size, row_groups, col_groups, group)
+
+    tstart_comp = start_time(row_groups[0], rank)
+
+    count_work(rank, "dcomp", perf.gemm_work(z.size(0), z.size(1), weight.size(1)))
+    z = torch.mm(z, weight)
+
+    dur = stop_time(row_groups[0], rank, tstart_comp, "dcomp")
+    comp_time[run][rank] += dur
+    dcomp_time[run][rank] += dur
+
+    h = z
+    if activations:
+        if func is F.log_softmax:
+            h = func(z, dim=1)
+        elif func is F.relu:
+            h = func(z)
+
+    return z, h
+
+# Forward-only pass over the whole graph through the first layer_count layers. Bypasses
+# GCNFunc, so nothing is saved for a backward and no autograd graph is built.
+def forward(inputs, weights, adj_matrix, am_partitions, rank, size, group, row_groups, col_groups, 
+                layer_count=None, ax=None):
+    outputs = inputs
+    with torch.no_grad():
+        for i, w in enumerate(weights[:layer_count]):
+            _, outputs = layer_forward(outputs, w, adj_matrix, am_partitions, rank, size, group, 
+                                        row_groups, col_groups, 
+                                        F.relu if i < len(weights) - 1 else F.log_softmax, 
+                                        ax if i == 0 else None)
+    return outputs
+
 class GCNFunc(torch.autograd.Function):
     @staticmethod
-    def forward(ctx, inputs, weight, adj_matrix, am_partitions, rank, size, group, row_groups, col_groups, func):
+    def forward(ctx, inputs, weight, adj_matrix, am_partitions, rank, size, group, row_groups, col_groups, func, ax):
         global comm_time
         global comp_time
         global dcomp_time
@@ -269,34 +436,17 @@ class GCNFunc(torch.autograd.Function):
         ctx.row_groups = row_groups
         ctx.col_groups = col_groups
         ctx.am_partitions = am_partitions
+        ctx.ax = ax
 
         ctx.func = func
 
-        # z = block_row(adj_matrix.t(), am_partitions, inputs, weight, rank, size)
-        z = broad_func(adj_matrix.size(0), am_partitions, inputs, rank, size, row_groups, col_groups, group)
-
-        tstart_comp = start_time(row_groups[0], rank)
-
-        z = torch.mm(z, weight)
-
-        dur = stop_time(row_groups[0], rank, tstart_comp)
-        comp_time[run][rank] += dur
-        dcomp_time[run][rank] += dur
+        z, h = layer_forward(inputs, weight, adj_matrix, am_partitions, rank, size, group, 
+                                row_groups, col_groups, func, ax)
 
         z.requires_grad = True
         ctx.z = z
 
-        if activations:
-            if func is F.log_softmax:
-                h = func(z, dim=1)
-            elif func is F.relu:
-                h = func(z)
-            else:
-                h = z
-
-            return h
-        else:
-            return z
+        return h
 
     @staticmethod
     def backward(ctx, grad_output):
@@ -316,8 +466,6 @@ class GCNFunc(torch.autograd.Function):
         func = ctx.func
         z = ctx.z
 
-        rank_col = rank % replication
-
         if activations:
             with torch.set_grad_enabled(True):
                 if func is F.log_softmax:
@@ -330,6 +478,12 @@ class GCNFunc(torch.autograd.Function):
             sigmap = torch.autograd.grad(outputs=func_eval, inputs=z, grad_outputs=grad_output)[0]
             grad_output = sigmap
 
+        # Layer 0 on A * X: the features need no gradient, and the weight gradient is (A * X)^T * G
+        if ctx.ax is not None:
+            grad_weight = outer_product2(ctx.ax.t(), grad_output, rank, size, 
+                                            owner_group(rank, group, col_groups))
+            return None, grad_weight, None, None, None, None, None, None, None, None, None
+
         # First backprop equation
         # ag = outer_product(adj_matrix, grad_output, rank, size, group)
         ag = broad_func(adj_matrix.size(0), am_partitions, grad_output, rank, size, row_groups, col_groups, group)
@@ -337,87 +491,124 @@ class GCNFunc(torch.autograd.Function):
         tstart_comp = start_time(group, rank)
 
         grad_input = torch.mm(ag, weight.t())
+        count_work(rank, "dcomp", perf.gemm_work(ag.size(0), ag.size(1), weight.size(0)))
 
-        dur = stop_time(group, rank, tstart_comp)
+        dur = stop_time(group, rank, tstart_comp, "dcomp")
         comp_time[run][rank] += dur
         dcomp_time[run][rank] += dur
 
         # Second backprop equation (reuses the A * G^l computation)
         # grad_weight = outer_product2(inputs.t(), ag, rank, size, group)
-        grad_weight = outer_product2(inputs.t(), ag, rank, size, col_groups[rank_col])
+        grad_weight = outer_product2(inputs.t(), ag, rank, size, owner_group(rank, group, col_groups))
 
-        return grad_input, grad_weight, None, None, None, None, None, None, None, None
+        return grad_input, grad_weight, None, None, None, None, None, None, None, None, None
 
-def train(inputs, weight1, weight2, adj_matrix, am_partitions, optimizer, data, rank, size, group, row_groups, col_groups):
+def train(inputs, weight1, weight2, adj_matrix, am_partitions, optimizer, data, rank, size, group, row_groups, col_groups, 
+            ax=None):
 
-    outputs = GCNFunc.apply(inputs, weight1, adj_matrix, am_partitions, rank, size, group, row_groups, col_groups, F.relu)
-    outputs = GCNFunc.apply(outputs, weight2, adj_matrix, am_partitions, rank, size, group, row_groups, col_groups, F.log_softmax)
+    outputs = GCNFunc.apply(inputs, weight1, adj_matrix, am_partitions, rank, size, group, row_groups, col_groups, F.relu, ax)
+    outputs = GCNFunc.apply(outputs, weight2, adj_matrix, am_partitions, rank, size, group, row_groups, col_groups, F.log_softmax, None)
 
     optimizer.zero_grad()
 
-    rank_c = rank // replication
+    # Summed NLL of the local train rows over the global train count. The per-rank gradients add
+    # up to those of the global mean, and ranks without train rows simply contribute zero.
+    classes = torch.gather(outputs[data.train_mask], 1, data.y[data.train_mask].view(-1, 1))
+    loss = -torch.sum(classes) / data.train_count
+    loss.backward()
 
-    rank_train_mask = torch.split(data.train_mask.bool(), outputs.size(0), dim=0)[rank_c]
-    datay_rank = torch.split(data.y, outputs.size(0), dim=0)[rank_c]
+    tstart_step = start_time(group, rank)
+    optimizer.step()
+    stop_time(group, rank, tstart_step, "optimizer_step")
 
-    # Note: bool type removes warnings, unsure of perf penalty
-    # loss = F.nll_loss(outputs[data.train_mask.bool()], data.y[data.train_mask.bool()])
-    if list(datay_rank[rank_train_mask].size())[0] > 0:
-    # if datay_rank.size(0) > 0:
-        loss = F.nll_loss(outputs[rank_train_mask], datay_rank[rank_train_mask])
-        # loss = F.nll_loss(outputs, torch.max(datay_rank, 1)[1])
-        loss.backward()
-    else:
-        fake_loss = (outputs * torch.cuda.FloatTensor(outputs.size(), device=device).fill_(0)).sum()
-        # fake_loss = (outputs * torch.zeros(outputs.size())).sum()
-        fake_loss.backward()
+    # Global mean loss, for reporting only
+    loss = loss.detach()
+    dist.all_reduce(loss, op=dist.reduce_op.SUM, group=owner_group(rank, group, col_groups))
 
-    optimizer.step()
+    return outputs, loss
 
-    return outputs
+def test(outputs, data, group):
+    # Correct and total counts on the local rows for each mask, reduced together across a group
+    # that holds every row once
+    pred = outputs.max(1)[1]
 
-def test(outputs, data, vertex_count, rank):
-    logits, accs = outputs, []
+    counts = []
     for _, mask in data('train_mask', 'val_mask', 'test_mask'):
-        pred = logits[mask].max(1)[1]
-        acc = pred.eq(data.y[mask]).sum().item() / mask.sum().item()
-        accs.append(acc)
+        counts.append(pred[mask].eq(data.y[mask]).sum())
+        counts.append(mask.sum())
+    counts = torch.stack(counts)
+    dist.all_reduce(counts, op=dist.reduce_op.SUM, group=group)
+    counts = counts.tolist()
+
+    accs = []
+    for i in range(0, len(counts), 2):
+        if counts[i + 1] > 0:
+            accs.append(counts[i] / counts[i + 1])
+        else:
+            accs.append(0)
+
+    if len(accs) != 3:
+        accs = accs + [0] * (3 - len(accs))
+
     return accs
-    # logits, accs = outputs, []
-    # datay_rank = torch.split(data.y, vertex_count)[rank]
-    # for _, mask in data('train_mask', 'val_mask', 'test_mask'):
-    #     mask_rank = torch.split(mask, vertex_count)[rank]
-    #     count = mask_rank.nonzero().size(0)
-    #     if count > 0:
-    #         pred = logits[mask_rank].max(1)[1]
-    #         acc = pred.eq(datay_rank[mask_rank]).sum().item() / mask_rank.sum().item()
-    #         # pred = logits[mask].max(1)[1]
-    #         # acc = pred.eq(data.y[mask]).sum().item() / mask.sum().item()
-    #     else:
-    #         acc = -1
-    #     accs.append(acc)
-    # return accs
+
+# Block rows of the 1.5D layout, each replicated on a row group of replication consecutive ranks.
+# When size is not a multiple of replication, the last size % replication ranks stay idle.
+def block_count(size):
+    return size // replication
+
+# First block and number of blocks of A * H that replica rank_col multiplies. The blocks are split
+# as evenly as possible: the first block_count % replication replicas take one extra stage.
+def stage_range(rank_col, size):
+    blocks = block_count(size)
+    per_col = blocks // replication
+    extra = blocks % replication
+    return rank_col * per_col + min(rank_col, extra), per_col + (1 if rank_col < extra else 0)
+
+# Largest replication factor that divides size, leaves at least as many block rows as replicas,
+# and whose estimated per-rank footprint (adjacency column block, features and activations of
+# one block row) fits in mem_fraction of the smallest GPU
+def auto_replication(size, node_count, nnz, features, classes):
+    total_mem = torch.cuda.FloatTensor([torch.cuda.get_device_properties(device).total_memory])
+    dist.all_reduce(total_mem, op=dist.reduce_op.MIN)
+    budget = total_mem.item() * mem_fraction
+
+    best = 1
+    for c in range(1, size + 1):
+        if size % c != 0 or c * c > size:
+            continue
+
+        rows = math.ceil(float(node_count) / (size // c))
+        adj_bytes = nnz * c / size * (12 if normalization else 8)
+        act_bytes = rows * (2 * features + 4 * mid_layer + 4 * classes) * 4
+        if dist.get_rank() == 0:
+            print(f"replication {c}: {(adj_bytes + act_bytes) / 2**30}GB per rank, " \
+                    f"budget {budget / 2**30}GB", flush=True)
+        if adj_bytes + act_bytes <= budget:
+            best = c
+    return best
 
 def get_proc_groups(rank, size):
     global replication
     
     rank_c = rank // replication
+    active = block_count(size) * replication
      
     row_procs = []
-    for i in range(0, size, replication):
+    for i in range(0, active, replication):
         row_procs.append(list(range(i, i + replication)))
 
     col_procs = []
     for i in range(replication):
-        col_procs.append(list(range(i, size, replication)))
+        col_procs.append(list(range(i, active, replication)))
 
     row_groups = []
     for i in range(len(row_procs)):
-        row_groups.append(dist.new_group(row_procs[i]))
+        row_groups.append(topology.new_group(row_procs[i], rank))
 
     col_groups = []
     for i in range(len(col_procs)):
-        col_groups.append(dist.new_group(col_procs[i]))
+        col_groups.append(topology.new_group(col_procs[i], rank))
 
     return row_groups, col_groups
 
@@ -441,6 +632,8 @@ def scale_elements(adj_matrix, adj_part, node_count, row_vtx, col_vtx):
     if not normalization:
         return adj_part
 
+    import torch_sparse
+
     # Scale each edge (u, v) by 1 / (sqrt(u) * sqrt(v))
     # indices = adj_part._indices()
     # values = adj_part._values()
@@ -500,7 +693,7 @@ def scale_elements(adj_matrix, adj_part, node_count, row_vtx, col_vtx):
 def oned_partition(rank, size, inputs, adj_matrix, data, features, classes, device):
     node_count = inputs.size(0)
     # n_per_proc = math.ceil(float(node_count) / size)
-    n_per_proc = math.ceil(float(node_count) / (size / replication))
+    n_per_proc = math.ceil(float(node_count) / block_count(size))
 
     am_partitions = None
     am_pbyp = None
@@ -515,7 +708,7 @@ def oned_partition(rank, size, inputs, adj_matrix, data, features, classes, devi
         proc_node_count = vtx_indices[rank_c + 1] - vtx_indices[rank_c]
         am_pbyp, _ = split_coo(am_partitions[rank_c], node_count, n_per_proc, 0)
         for i in range(len(am_pbyp)):
-            if i == size // replication - 1:
+            if i == block_count(size) - 1:
                 last_node_count = vtx_indices[i + 1] - vtx_indices[i]
                 am_pbyp[i] = torch.sparse_coo_tensor(am_pbyp[i], torch.ones(am_pbyp[i].size(1)), 
                                                         size=(last_node_count, proc_node_count),
@@ -539,7 +732,7 @@ def oned_partition(rank, size, inputs, adj_matrix, data, features, classes, devi
                                                     requires_grad=False)
             am_partitions[i] = scale_elements(adj_matrix, am_partitions[i], node_count,  0, vtx_indices[i])
 
-        input_partitions = torch.split(inputs, math.ceil(float(inputs.size(0)) / (size / replication)), dim=0)
+        input_partitions = torch.split(inputs, math.ceil(float(inputs.size(0)) / block_count(size)), dim=0)
 
         adj_matrix_loc = am_partitions[rank_c]
         inputs_loc = input_partitions[rank_c]
@@ -548,38 +741,163 @@ def oned_partition(rank, size, inputs, adj_matrix, data, features, classes, devi
     print(f"rank: {rank} inputs_loc.size: {inputs_loc.size()}", flush=True)
     return inputs_loc, adj_matrix_loc, am_pbyp
 
+# oned_partition for a generated graph. This rank only generates its block column of A, drawn as
+# the rows of A^T, and its block row of the features. Replicas generate the same block.
+# Normalization would need global degrees, so the values stay ones.
+def synthetic_partition(rank, size, node_count):
+    n_per_proc = math.ceil(float(node_count) / block_count(size))
+    rank_c = rank // replication
+    col_start = rank_c * n_per_proc
+    col_stop = min(col_start + n_per_proc, node_count)
+    proc_node_count = col_stop - col_start
+
+    with torch.no_grad():
+        edge_index = synth_graph.edges(col_start, col_stop)
+        adj_cols = torch.stack([edge_index[1], edge_index[0] - col_start])
+
+        am_pbyp, vtx_indices = split_coo(adj_cols, node_count, n_per_proc, 0)
+        for i in range(len(am_pbyp)):
+            am_pbyp[i] = torch.sparse_coo_tensor(am_pbyp[i], torch.ones(am_pbyp[i].size(1)), 
+                                                    size=(vtx_indices[i + 1] - vtx_indices[i], 
+                                                            proc_node_count),
+                                                    requires_grad=False)
+
+        adj_matrix_loc = torch.sparse_coo_tensor(adj_cols, torch.ones(adj_cols.size(1)), 
+                                                    size=(node_count, proc_node_count),
+                                                    requires_grad=False)
+        inputs_loc = synth_graph.inputs(col_start, col_stop)
+
+    print(f"rank: {rank} adj_matrix_loc.size: {adj_matrix_loc.size()} nnz: {adj_cols.size(1)}", 
+            flush=True)
+    return inputs_loc, adj_matrix_loc, am_pbyp
+
+# Global rows [start, stop) this rank computes: its block row, or its slice of it with reduce_scatter
+def local_rows(rank, size, node_count):
+    n_per_proc = math.ceil(float(node_count) / block_count(size))
+    row_start = (rank // replication) * n_per_proc
+    row_stop = min(row_start + n_per_proc, node_count)
+    if reduce_scatter:
+        start, stop = slice_range(row_stop - row_start, rank % replication)
+        row_start, row_stop = row_start + start, row_start + stop
+    return row_start, row_stop
+
+# Keep only this rank's labels and masks, so train() never touches the global tensors
+def label_partition(rank, size, data, node_count, device):
+    row_start, row_stop = local_rows(rank, size, node_count)
+
+    if synth_graph is not None:
+        data_loc = Data()
+        data_loc.y = synth_graph.labels(row_start, row_stop).to(device)
+        masks = synth_graph.masks(row_start, row_stop)
+        for key, mask in zip(['train_mask', 'val_mask', 'test_mask'], masks):
+            data_loc[key] = mask.to(device)
+        data_loc.train_count = synth_graph.train_count()
+        return data_loc
+
+    data_loc = Data()
+    data_loc.y = data.y[row_start:row_stop].to(device)
+    for key, mask in data('train_mask', 'val_mask', 'test_mask'):
+        data_loc[key] = mask[row_start:row_stop].bool().to(device)
+
+    data_loc.train_count = data.train_mask.bool().sum().item()
+    return data_loc
+
 def run(rank, size, inputs, adj_matrix, data, features, classes, device):
     global epochs
     global mid_layer
     global timing
     global run
+    global col_bcast_groups
+    global tracer
 
+    node_count = synth_graph.nodes if synth_graph is not None else inputs.size(0)
     best_val_acc = test_acc = 0
     outputs = None
 
     # adj_matrix_loc = torch.rand(node_count, n_per_proc)
     # inputs_loc = torch.rand(n_per_proc, inputs.size(1))
 
-    group = dist.new_group(list(range(size)))
+    tstart = time.time()
+    group = topology.new_group(list(range(block_count(size) * replication)), rank)
     row_groups, col_groups = get_proc_groups(rank, size) 
 
+    # The replication groups reduce whole block rows and should stay on a node, the column
+    # broadcasts are the ones that cross nodes
+    active = block_count(size) * replication
+    node_of = topology.node_ids(size, device)
+    topology.check_local([list(range(i, i + replication)) for i in range(0, active, replication)], 
+                            node_of, "replication", rank)
+    if hierarchical:
+        col_bcast_groups = []
+        for i in range(replication):
+            col_bcast_groups.append(topology.HierGroup(list(range(i, active, replication)), node_of, 
+                                                        col_groups[i]))
+    startup["groups"] = time.time() - tstart
+
     rank_c = rank // replication
     rank_col = rank % replication
-    if rank_c >= (size // replication):
+    if rank_c >= block_count(size):
+        print(f"rank: {rank} idle, {size} ranks do not split into block rows of {replication}", 
+                flush=True)
         return
 
-    inputs_loc, adj_matrix_loc, am_pbyp = oned_partition(rank, size, inputs, adj_matrix, data, 
-                                                                features, classes, device)
+    tstart = time.time()
+    partition = None
+    if resume:
+        partition = checkpoint.load_partition(ckpt_dir, rank)
+
+    if partition is None and synth_graph is not None:
+        inputs_loc, adj_matrix_loc, am_pbyp = synthetic_partition(rank, size, node_count)
+        if ckpt_dir is not None:
+            checkpoint.save_partition(ckpt_dir, rank, (inputs_loc, adj_matrix_loc, am_pbyp))
+    elif partition is None:
+        inputs_loc, adj_matrix_loc, am_pbyp = oned_partition(rank, size, inputs, adj_matrix, data, 
+                                                                    features, classes, device)
+        if ckpt_dir is not None:
+            checkpoint.save_partition(ckpt_dir, rank, (inputs_loc, adj_matrix_loc, am_pbyp))
+    else:
+        inputs_loc, adj_matrix_loc, am_pbyp = partition
 
+    # Training only needs adj_matrix_loc's shape, so it stays on the host
     inputs_loc = inputs_loc.to(device)
-    adj_matrix_loc = adj_matrix_loc.to(device)
-    for i in range(len(am_pbyp)):
-        am_pbyp[i] = am_pbyp[i].t().coalesce().to(device)
 
-    adj_matrix_loc.coalesce()
+    coo_bytes = 0
+    stages = []
+    for i in range(len(am_pbyp)):
+        block = am_pbyp[i].t().coalesce().to(device)
+        stages.append((block._nnz(), block.size(0), block.size(1)))
+        coo_bytes += block.indices().numel() * 8 + block.values().numel() * 4
+        am_pbyp[i] = compact_block(block)
+    print(f"rank: {rank} adjacency blocks: {sum(block_bytes(b) for b in am_pbyp) / 2**20}MB " \
+            f"(COO: {coo_bytes / 2**20}MB)", flush=True)
+
+    startup["partition"] = time.time() - tstart
+    print(f"rank: {rank} startup: {startup} total: {time.time() - startup_tstart}s", flush=True)
+    perf.balance(rank, group, stages, features, mem_bandwidth, imbalance, device)
+
+    # Each replica only keeps its slice of the features, the other rows are gathered when needed
+    if reduce_scatter:
+        start, stop = slice_range(inputs_loc.size(0), rank_col)
+        inputs_loc = inputs_loc[start:stop]
+
+    data_loc = label_partition(rank, size, data, node_count, device)
     dist.barrier(group)
 
+    ax = None
+
+    ckpt = None
+    if resume:
+        ckpt = checkpoint.load(ckpt_dir, rank)
+
+    ckpt_writer = None
+    if ckpt_dir is not None and ckpt_every > 0:
+        ckpt_writer = checkpoint.CheckpointWriter(ckpt_dir, rank, device, ckpt_queue)
+
     for i in range(run_count):
+        # Runs finished before the checkpoint are not repeated
+        if ckpt is not None and i < ckpt["run"]:
+            continue
+
         run = i
         torch.manual_seed(0)
         weight1_nonleaf = torch.rand(features, mid_layer, requires_grad=True)
@@ -595,6 +913,15 @@ def run(rank, size, inputs, adj_matrix, data, features, classes, device):
 
         optimizer = torch.optim.Adam([weight1, weight2], lr=0.01)
 
+        start_epoch = 1
+        best = None
+        if ckpt is not None and i == ckpt["run"]:
+            best = checkpoint.restore(ckpt, [weight1, weight2], optimizer, device)
+            start_epoch = ckpt["epoch"] + 1
+
+        if inference and ckpt_dir is not None:
+            checkpoint.load_weights(ckpt_dir, [weight1, weight2])
+
         total_time[i] = dict()
         comm_time[i] = dict()
         comp_time[i] = dict()
@@ -603,8 +930,10 @@ def run(rank, size, inputs, adj_matrix, data, features, classes, device):
         bcast_comm_time[i] = dict()
         bcast_words[i] = dict()
         reduce_comm_time[i] = dict()
+        gather_comm_time[i] = dict()
         op_comm_time[i] = dict()
         barrier_time[i] = dict()
+        work[i] = dict()
 
         total_time[i][rank] = 0.0
         comm_time[i][rank] = 0.0
@@ -614,53 +943,151 @@ def run(rank, size, inputs, adj_matrix, data, features, classes, device):
         bcast_comm_time[i][rank] = 0.0
         bcast_words[i][rank] = 0
         reduce_comm_time[i][rank] = 0.0
+        gather_comm_time[i][rank] = 0.0
         op_comm_time[i][rank] = 0.0
         barrier_time[i][rank] = 0.0
+        work[i][rank] = perf.Counts()
+
+        # The features never change, so A * X is computed once, untimed, and reused by every run
+        if precompute_ax and ax is None:
+            timing_on = timing == True
+            timing = False
+            with torch.no_grad():
+                ax = broad_func(node_count, am_pbyp, inputs_loc, rank, size, row_groups, col_groups, 
+                                    group)
+            if timing_on:
+                timing = True
+
+        # Each run is one forward pass in inference
+        if inference:
+            dist.barrier(group)
+            torch.cuda.reset_peak_memory_stats(device)
+            tstart = time.time()
+            outputs = forward(inputs_loc, [weight1, weight2], adj_matrix_loc, am_pbyp, rank, size, 
+                                group, row_groups, col_groups, layer_count, ax)
+            torch.cuda.synchronize(device=device)
+            total_time[i][rank] = time.time() - tstart
+            print(f"rank: {rank} run {i} inference_time: {total_time[i][rank]} " \
+                    f"peak_memory: {torch.cuda.max_memory_allocated(device) / 2**20}MB", flush=True)
+            continue
 
         # Do not time first epoch
-        timing_on = timing == True
-        timing = False
+        # The warm-up epoch also steps the optimizer, a resumed run already did it
+        if start_epoch == 1:
+            timing_on = timing == True
+            timing = False
 
-        outputs = train(inputs_loc, weight1, weight2, adj_matrix_loc, am_pbyp, optimizer, data, 
-                                    rank, size, group, row_groups, col_groups)
-        if timing_on:
-            timing = True
+            outputs, loss = train(inputs_loc, weight1, weight2, adj_matrix_loc, am_pbyp, optimizer, 
+                                        data_loc, rank, size, group, row_groups, col_groups, ax)
+            if timing_on:
+                timing = True
 
         dist.barrier(group)
+        # The trace clock starts at the barrier before the first timed run, on every rank at once
+        if trace_path is not None and tracer is None:
+            tracer = timeline.Timeline(trace_path, rank)
         tstart = time.time()
 
         # for epoch in range(1, 201):
         print(f"Starting training... rank {rank} run {i}", flush=True)
         tt = time.time()
-        for epoch in range(1, epochs):
-            outputs = train(inputs_loc, weight1, weight2, adj_matrix_loc, am_pbyp, optimizer, data, 
-                                    rank, size, group, row_groups, col_groups)
+        best_val_acc = test_acc = 0
+        best_weights = None
+        bad_evals = 0
+        # A resumed run continues the early stopping of the checkpointed one
+        if best is not None:
+            best_weights = best["weights"]
+            best_val_acc = best["val_acc"]
+            test_acc = best["test_acc"]
+            bad_evals = best["bad_evals"]
+        for epoch in range(start_epoch, epochs):
+            # The outputs of an epoch come from the weights before its optimizer step
+            eval_epoch = eval_every > 0 and epoch % eval_every == 0
+            if eval_epoch:
+                weights_pre = [w.detach().clone() for w in [weight1, weight2]]
+
+            outputs, loss = train(inputs_loc, weight1, weight2, adj_matrix_loc, am_pbyp, optimizer, 
+                                    data_loc, rank, size, group, row_groups, col_groups, ax)
             ttt = time.time()
-            print("Epoch: {:03d} {}".format(epoch, ttt - tt), flush=True)
-            tt = ttt
+            if tracer is not None:
+                tracer.event(f"epoch {epoch}", tt, ttt, tid=timeline.epoch_tid, cat="epoch")
+            print("Epoch: {:03d} {} loss: {:.4f}".format(epoch, ttt - tt, loss.item()), flush=True)
+
+            if eval_epoch:
+                train_acc, val_acc, tmp_test_acc = test(outputs, data_loc, owner_group(rank, group, col_groups))
+                log = 'Epoch: {:03d}, Train: {:.4f}, Val: {:.4f}, Test: {:.4f}'
+                print(log.format(epoch, train_acc, val_acc, tmp_test_acc), flush=True)
+
+                # val_acc is globally reduced, so every rank takes the same early-stopping decision
+                if val_acc > best_val_acc:
+                    best_val_acc = val_acc
+                    test_acc = tmp_test_acc
+                    best_weights = weights_pre
+                    bad_evals = 0
+                else:
+                    bad_evals += 1
+                    if patience > 0 and bad_evals >= patience:
+                        print(f"rank: {rank} early stop at epoch {epoch} best val: {best_val_acc}", 
+                                flush=True)
+                        break
+
+            if ckpt_writer is not None and epoch % ckpt_every == 0:
+                ckpt_writer.save(i, epoch, [weight1, weight2], optimizer, dict(weights=best_weights, 
+                            val_acc=best_val_acc, test_acc=test_acc, bad_evals=bad_evals))
+
+            tt = time.time()
 
         # dist.barrier(group)
         torch.cuda.synchronize(device=device)
         tstop = time.time()
         total_time[i][rank] = tstop - tstart
 
+        # Keep the best weights seen by the periodic evaluation
+        if best_weights is not None:
+            with torch.no_grad():
+                for w, w_best in zip([weight1, weight2], best_weights):
+                    w.copy_(w_best)
+
+        # The outputs so far came from the last epoch's weights, and a resumed run with no epochs
+        # left has none.
+        if best_weights is not None or outputs is None:
+            timing_on = timing == True
+            timing = False
+            with torch.no_grad():
+                outputs = forward(inputs_loc, [weight1, weight2], adj_matrix_loc, am_pbyp, rank, size, 
+                                    group, row_groups, col_groups, None, ax)
+            if timing_on:
+                timing = True
+
+    if ckpt_writer is not None:
+        ckpt_writer.close()
+
+    # Replicas hold the same block row, the first one writes it. Slices are all written.
+    if inference and out_dir is not None and (rank_col == 0 or reduce_scatter):
+        pred = outputs.max(1)[1] if layer_count is None else None
+        row_start, _ = local_rows(rank, size, node_count)
+        checkpoint.save_outputs(out_dir, rank, outputs, row_start, 0, pred)
+
     # Get median runtime according to rank0 and print that run's breakdown
     dist.barrier(group)
 
     if rank == 0:
+        # A resumed process only has the runs from the checkpoint onwards
+        run_ids = sorted(total_time.keys())
         total_times_r0 = [] 
-        for i in range(run_count):
+        for i in run_ids:
             total_times_r0.append(total_time[i][0])
 
         print(f"total_times_r0: {total_times_r0}")
         median_run_time = statistics.median(total_times_r0)
-        median_idx = total_times_r0.index(median_run_time)
+        median_idx = run_ids[total_times_r0.index(median_run_time)]
         median_idx = torch.cuda.LongTensor([median_idx])
     else:
         median_idx = torch.cuda.LongTensor([0])
         
     dist.barrier(group)
-    # dist.broadcast(median_idx, src=0, group=group)        
+    # Every rank reports the same run
+    dist.broadcast(median_idx, src=0, group=group)        
     median_idx = median_idx.item()
     print(f"rank: {rank} median_run: {median_idx}")
     print(f"rank: {rank} total_time: {total_time[median_idx][rank]}")
@@ -671,35 +1098,32 @@ def run(rank, size, inputs, adj_matrix, data, features, classes, device):
     print(f"rank: {rank} bcast_comm_time: {bcast_comm_time[median_idx][rank]}")
     print(f"rank: {rank} bcast_words: {bcast_words[median_idx][rank]}")
     print(f"rank: {rank} reduce_comm_time: {reduce_comm_time[median_idx][rank]}")
+    print(f"rank: {rank} gather_comm_time: {gather_comm_time[median_idx][rank]}")
     print(f"rank: {rank} op_comm_time: {op_comm_time[median_idx][rank]}")
     print(f"rank: {rank} barrier_time: {barrier_time[median_idx][rank]}")
     print(f"rank: {rank} {outputs}")
+
+    # Phase timers are only filled with --timing
+    if timing:
+        phases = dict(scomp=scomp_time[median_idx][rank], dcomp=dcomp_time[median_idx][rank],
+                        bcast_comm=bcast_comm_time[median_idx][rank], 
+                        reduce_comm=reduce_comm_time[median_idx][rank],
+                        gather_comm=gather_comm_time[median_idx][rank],
+                        op_comm=op_comm_time[median_idx][rank],
+                        barrier=barrier_time[median_idx][rank])
+        perf.report(rank, group, phases, work[median_idx][rank], total_time[median_idx][rank], device)
     
     
-    if accuracy:
-        # All-gather outputs to test accuracy
-        output_parts = []
-        # n_per_proc = math.ceil(float(inputs.size(0)) / size)
-        n_per_proc = math.ceil(float(inputs.size(0)) / (size / replication))
-        # print(f"rows: {am_pbyp[-1].size(0)} cols: {classes}", flush=True)
-        for i in range(size // replication):
-            output_parts.append(torch.cuda.FloatTensor(n_per_proc, classes, device=device).fill_(0))
-
-        if outputs.size(0) != n_per_proc:
-            pad_row = n_per_proc - outputs.size(0) 
-            outputs = torch.cat((outputs, torch.cuda.FloatTensor(pad_row, classes, device=device)), dim=0)
-
-        # dist.all_gather(output_parts, outputs)
-        dist.all_gather(output_parts, outputs, group=col_groups[rank_col])
-        # output_parts[rank] = outputs
-        output_parts[rank_c] = outputs
-        
-        padding = inputs.size(0) - n_per_proc * ((size // replication) - 1)
-        output_parts[(size // replication) - 1] = output_parts[(size // replication) - 1][:padding,:]
-
-        outputs = torch.cat(output_parts, dim=0)
+    # Every rank writes its part of the trace, rank 0 merges them
+    if tracer is not None:
+        tracer.write()
+        dist.barrier(group)
+        if rank == 0:
+            timeline.merge(trace_path, dist.get_world_size(group))
+            print(f"trace: {trace_path}", flush=True)
 
-        train_acc, val_acc, tmp_test_acc = test(outputs, data, am_pbyp[0].size(1), rank)
+    if accuracy:
+        train_acc, val_acc, tmp_test_acc = test(outputs, data_loc, owner_group(rank, group, col_groups))
         if val_acc > best_val_acc:
             best_val_acc = val_acc
             test_acc = tmp_test_acc
@@ -719,6 +1143,7 @@ def init_process(rank, size, inputs, adj_matrix, data, features, classes, device
 def main():
     global device
     global graphname
+    global replication
 
     print(socket.gethostname())
     seed = 0
@@ -729,7 +1154,9 @@ def main():
         if "OMPI_COMM_WORLD_RANK" in os.environ.keys():
             os.environ["RANK"] = os.environ["OMPI_COMM_WORLD_RANK"]
 
-        dist.init_process_group(backend='nccl')
+        tstart = time.time()
+        dist.init_process_group(backend=backend)
+        startup["init"] = time.time() - tstart
         rank = dist.get_rank()
         size = dist.get_world_size()
         print("Processes: " + str(size))
@@ -742,7 +1169,10 @@ def main():
         # print(f"curr_devid: {curr_devid}", flush=True)
         devcount = torch.cuda.device_count()
 
+    tstart = time.time()
     if graphname == "Cora":
+        from torch_geometric.datasets import Planetoid
+        import torch_geometric.transforms as T
         path = osp.join(osp.dirname(osp.realpath(__file__)), '..', 'data', graphname)
         dataset = Planetoid(path, graphname, T.NormalizeFeatures())
         data = dataset[0]
@@ -755,6 +1185,8 @@ def main():
         num_features = dataset.num_features
         num_classes = dataset.num_classes
     elif graphname == "Reddit":
+        from reddit import Reddit
+        import torch_geometric.transforms as T
         path = osp.join(osp.dirname(osp.realpath(__file__)), '..', 'data', graphname)
         dataset = Reddit(path, T.NormalizeFeatures())
         data = dataset[0]
@@ -805,6 +1237,15 @@ def main():
         data = data.to(device)
         inputs.requires_grad = True
         data.y = data.y.to(device)
+    elif synth_graph is not None:
+        # Each rank generates its own partition in run(), nothing global is built here
+        if normalization:
+            print(f"normalization is not applied to generated graphs", flush=True)
+        inputs = None
+        data = None
+        edge_index = None
+        num_features = synth_graph.features
+        num_classes = synth_graph.classes
     elif graphname == 'ogb':
         from ogb.nodeproppred import PygNodePropPredDataset
         dataset = PygNodePropPredDataset(name = graphname, root = 'dataset/')
@@ -822,6 +1263,8 @@ def main():
         data = data.to(device)
         data.x.requires_grad = True
     else:
+        from scipy.sparse import csr_matrix
+        from torch_geometric.utils import from_scipy_sparse_matrix
         name = graphname
         with open(os.path.join(name, 'graph.bin'), 'rb') as f:
             s = f.read(11)
@@ -857,11 +1300,22 @@ def main():
     if download:
         exit()
 
-    if normalization:
+    if synth_graph is not None:
+        adj_matrix = None
+    elif normalization:
         adj_matrix, _ = add_remaining_self_loops(edge_index, num_nodes=inputs.size(0))
     else:
         adj_matrix = edge_index
+    startup["load"] = time.time() - tstart
 
+    if replication == 0 and synth_graph is not None:
+        replication = auto_replication(size, synth_graph.nodes, synth_graph.nodes * synth_graph.degree, 
+                                            num_features, int(num_classes))
+        print(f"rank: {rank} replication: {replication}", flush=True)
+    elif replication == 0:
+        replication = auto_replication(size, inputs.size(0), adj_matrix.size(1), num_features, 
+                                            int(num_classes))
+        print(f"rank: {rank} replication: {replication}", flush=True)
 
     init_process(rank, size, inputs, adj_matrix, data, num_features, num_classes, device, outputs, 
                     run)
@@ -876,6 +1330,9 @@ if __name__ == '__main__':
     parser.add_argument("--epochs", type=int)
     parser.add_argument("--graphname", type=str)
     parser.add_argument("--timing", type=str)
+    parser.add_argument("--trace", type=str, default=None)
+    parser.add_argument("--imbalance", type=float, default=1.5)
+    parser.add_argument("--membw", type=float, default=900.)
     parser.add_argument("--midlayer", type=int)
     parser.add_argument("--runcount", type=int)
     parser.add_argument("--replication", type=int)
@@ -884,6 +1341,25 @@ if __name__ == '__main__':
     parser.add_argument("--accuracy", type=str)
     parser.add_argument("--download", type=bool)
 
+    parser.add_argument("--evalevery", type=int, default=0)
+    parser.add_argument("--patience", type=int, default=0)
+    parser.add_argument("--checkpoint", type=str, default=None)
+    parser.add_argument("--ckptevery", type=int, default=0)
+    parser.add_argument("--ckptqueue", type=int, default=2)
+    parser.add_argument("--resume", type=str, default="False")
+    parser.add_argument("--inference", type=str, default="False")
+    parser.add_argument("--outdir", type=str, default=None)
+    parser.add_argument("--embedlayer", type=int, default=0)
+    parser.add_argument("--precomputeax", type=str, default="False")
+    parser.add_argument("--backend", type=str, default="nccl")
+    parser.add_argument("--nodes", type=int, default=1 << 20)
+    parser.add_argument("--degree", type=int, default=16)
+    parser.add_argument("--skew", type=str, default=synthetic.default_skew)
+    parser.add_argument("--features", type=int, default=128)
+    parser.add_argument("--classes", type=int, default=16)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--reducescatter", type=str, default="False")
+    parser.add_argument("--hierarchical", type=str, default="False")
     args = parser.parse_args()
     print(args)
 
@@ -892,19 +1368,52 @@ if __name__ == '__main__':
     epochs = args.epochs
     graphname = args.graphname
     timing = args.timing == "True"
+    trace_path = args.trace
+    imbalance = args.imbalance
+    mem_bandwidth = args.membw
+    # The trace records the phase timers
+    if trace_path is not None:
+        timing = True
     mid_layer = args.midlayer
     run_count = args.runcount
     normalization = args.normalization == "True"
     activations = args.activations == "True"
     accuracy = args.accuracy == "True"
-    replication = args.replication
+    replication = args.replication if args.replication is not None else 0
     download = args.download
+    eval_every = args.evalevery
+    patience = args.patience
+    ckpt_dir = args.checkpoint
+    ckpt_every = args.ckptevery
+    ckpt_queue = args.ckptqueue
+    resume = args.resume == "True" and ckpt_dir is not None
+    inference = args.inference == "True"
+    out_dir = args.outdir
+    if args.embedlayer > 0:
+        layer_count = args.embedlayer
+    precompute_ax = args.precomputeax == "True"
+    backend = args.backend
+    if graphname == "rmat" or graphname == "er":
+        synth_graph = synthetic.Graph(graphname, args.nodes, args.degree, args.skew, args.features, 
+                                        args.classes, args.seed)
+    reduce_scatter = args.reducescatter == "True"
+    hierarchical = args.hierarchical == "True"
 
     if not download:
         if (epochs is None) or (graphname is None) or (timing is None) or (mid_layer is None) or (run_count is None):
             print(f"Error: missing argument {epochs} {graphname} {timing} {mid_layer} {run_count}")
             exit()
 
+    # Inference runs the trained weights of --checkpoint, without them it would score random ones
+    if inference and ckpt_dir is None:
+        print(f"Error: --inference=True needs the trained weights of --checkpoint")
+        exit()
+
+    # Inference embeddings are hidden features, not class scores to take the accuracy of
+    if inference and accuracy and layer_count is not None:
+        print(f"Error: --accuracy=True scores class predictions and cannot be used with --embedlayer")
+        exit()
+
     print(f"Arguments: epochs: {epochs} graph: {graphname} timing: {timing} mid: {mid_layer} norm: {normalization} act: {activations} acc: {accuracy} runs: {run_count} rep: {replication}")
     
     print(main())
@@ -1,3 +1,6 @@
+import time
+startup_tstart = time.time()
+
 import os
 import os.path as osp
 import argparse
@@ -5,37 +8,33 @@ import argparse
 import math
 
 import torch
-import torch_sparse
 import torch.distributed as dist
 
-from torch_geometric.data import Data, Dataset
-from torch_geometric.datasets import Planetoid, PPI
-from reddit import Reddit
-from torch_geometric.nn import GCNConv, ChebConv  # noqa
-from torch_geometric.utils import (
-        add_remaining_self_loops, 
-        to_dense_adj, 
-        dense_to_sparse, 
-        to_scipy_sparse_matrix
-)
-import torch_geometric.transforms as T
+from torch_geometric.data import Data
+import checkpoint
+import topology
+import perf
+import synthetic
+import timeline
+from torch_geometric.utils import add_remaining_self_loops
 
 import torch.multiprocessing as mp
 
-from torch.multiprocessing import Manager, Process
-
 import statistics
 
 from torch.nn import Parameter
 import torch.nn.functional as F
 
-from torch_scatter import scatter_add
-
-import socket
-import time
 import numpy as np
 
-from sparse_coo_tensor_cpp import sparse_coo_tensor_gpu, spmm_gpu
+from sparse_coo_tensor_cpp import spmm_csr_gpu
+
+# The dataset loaders and torch_sparse are imported where they are used, so a run only loads what
+# its graph and preprocessing need
+
+# Seconds spent in each startup phase, printed once the first partition is ready
+startup = dict()
+startup["imports"] = time.time() - startup_tstart
 
 # comp_time = 0.0
 # comm_time = 0.0
@@ -72,6 +71,7 @@ summa_bcast2 = dict()
 summa_sparse_comp = dict()
 summa_comp = dict()
 summa_loc_bcast = dict()
+summa_loc_comp = dict()
 fwd_time = dict()
 bwd_time = dict()
 transpose_time = dict()
@@ -80,6 +80,7 @@ loss_calc_time = dict()
 summa_sparse_time = dict()
 summa_time = dict()
 summa_loc_time = dict()
+work = dict() # perf.Counts of the timed phases, indexed [run][rank] like the timers
 
 epochs = 0
 graphname = ""
@@ -88,10 +89,32 @@ timing = False
 normalization = False
 activations = False
 accuracy = False
-no_occur_val = 42.1234
 run_count = 0
 run = 0
 download = False
+eval_every = 0 # evaluate every k epochs during training (0 disables)
+patience = 0 # stop after this many evaluations without a better val accuracy (0 disables)
+ckpt_dir = None # checkpoint directory (None disables checkpointing)
+ckpt_every = 0 # checkpoint every k epochs (0 disables)
+ckpt_queue = 2 # checkpoints in flight before training waits for the writer
+resume = False
+inference = False # forward-only pass over the whole graph with trained weights
+out_dir = None # directory for each rank's output shard in inference
+layer_count = None # layers to run in inference, None runs all of them and writes predictions
+precompute_ax = False # compute A * X once and skip layer 0's SpMM
+
+# Compact SUMMA wire format state, filled once by summa_sparse_setup
+acol_nnzs = None # nnz of the A block sent in each row stage
+acol_loc = None  # this rank's A block, already packed for broadcasting
+acol_cache = dict() # stage -> A block kept resident so its broadcast is skipped
+cache_adj = 0 # MB of GPU memory allowed for cached A blocks (0 disables the cache)
+pipeline = False # overlap SUMMA stage k + 1's broadcasts with stage k's multiply
+backend = "nccl" # torch.distributed backend, gloo where NCCL is unavailable
+synth_graph = None # synthetic.Graph each rank generates its own block of, instead of graphname
+tracer = None # timeline.Timeline every timed phase is recorded in with --trace
+trace_path = None # Chrome trace file the ranks' timelines are merged into
+imbalance = 1.5 # nnz imbalance (max / mean) over which the pre-training balance report warns
+mem_bandwidth = 900. # GB/s the balance report predicts the SpMM stage times at
 
 def sync_and_sleep(rank, device):
     torch.cuda.synchronize(device=device)
@@ -113,23 +136,68 @@ def start_time(group, rank):
     if group is not None:
         # dist.barrier(group)
         torch.cuda.synchronize(device=device)
-    tstart = 0.0
-    if rank == 0:
-        tstart = time.time()
+    tstart = time.time()
     return tstart
 
-def stop_time(group, rank, tstart):
+# Count a phase's flops and bytes next to its timer. Only timed work is counted, so the counts
+# match the seconds they are divided by.
+def count_work(rank, phase, phase_work):
+    if timing:
+        work[run][rank].add(phase, phase_work)
+
+def stop_time(group, rank, tstart, name=None):
     device = torch.device('cuda:{}'.format(rank_to_devid(rank, acc_per_rank)))
     if not timing:
         return 0.0
     if group is not None:
        # dist.barrier(group)
        torch.cuda.synchronize(device=device)
-    tstop = 0.0
-    if rank == 0:
-        tstop = time.time()
+    # Every rank times, the perf report compares the ranks
+    tstop = time.time()
+    if tracer is not None and name is not None:
+        tracer.event(name, tstart, tstop)
     return tstop - tstart
 
+# Phase timers of the pipelined SUMMAs. There the host only queues work, so each phase is bracketed
+# by CUDA events on the compute stream and read once the call is done. A broadcast interval covers
+# the wait() alone: the stream stalls there only for the part of the broadcast not hidden behind
+# the work queued before it. Compute intervals cover the multiply kernels.
+class StageTimer:
+    def __init__(self):
+        self.phases = []
+
+    def start(self):
+        if not timing:
+            return None
+        event = torch.cuda.Event(enable_timing=True)
+        event.record()
+        return event
+
+    # Adds the phase's seconds to each [run][rank] timer in timers once read
+    def stop(self, name, start, timers):
+        if start is None:
+            return
+        event = torch.cuda.Event(enable_timing=True)
+        event.record()
+        self.phases.append((name, start, event, timers))
+
+    def read(self, rank):
+        if len(self.phases) == 0:
+            return
+        end = torch.cuda.Event(enable_timing=True)
+        end.record()
+        end.synchronize()
+        tend = time.time()
+        for name, start, stop, timers in self.phases:
+            dur = start.elapsed_time(stop) / 1000.
+            for timer in timers:
+                timer[run][rank] += dur
+            # Events are placed on the host clock backwards from the end of the call
+            if tracer is not None:
+                tracer.event(name, tend - start.elapsed_time(end) / 1000., 
+                                tend - stop.elapsed_time(end) / 1000.)
+        self.phases = []
+
 def transpose(mat, row, col, height, width, size, acc_per_rank, transpose_group):
     proc_row = proc_row_size(size)
     proc_col = proc_col_size(size)
@@ -194,6 +262,10 @@ def summa(adj_matrix, inputs, rank, row, col, size, acc_per_rank, row_groups, co
     global summa_time
     global run
 
+    if pipeline:
+        return summa_pipe(adj_matrix, inputs, rank, row, col, size, acc_per_rank, row_groups, col_groups,
+                            height, middim, width)
+
     # tstart_summa_time = start_time(row_groups[0], rank)
 
     proc_row = proc_row_size(size)
@@ -250,9 +322,10 @@ def summa(adj_matrix, inputs, rank, row, col, size, acc_per_rank, row_groups, co
         # dist.broadcast_multigpu([acol], row_src_rank, row_groups[row])
         dist.broadcast(acol, row_src_rank, row_groups[row])
 
-        dur = stop_time(row_groups[row], rank, tstart)
+        dur = stop_time(row_groups[row], rank, tstart, "summa_bcast1")
         comm_time[run][rank] += dur
         summa_bcast1[run][rank] += dur
+        count_work(rank, "summa_bcast1", perf.message_work(acol))
 
         if col_src_rank == rank:
             brow = inputs
@@ -266,23 +339,191 @@ def summa(adj_matrix, inputs, rank, row, col, size, acc_per_rank, row_groups, co
         # dist.broadcast_multigpu([brow], col_src_rank, col_groups[col])
         dist.broadcast(brow, col_src_rank, col_groups[col])
 
-        dur = stop_time(col_groups[col], rank, tstart)
+        dur = stop_time(col_groups[col], rank, tstart, "summa_bcast2")
         comm_time[run][rank] += dur
         summa_bcast2[run][rank] += dur
+        count_work(rank, "summa_bcast2", perf.message_work(brow))
 
-        # tstart = start_time(row_groups[0], rank)
-        tstart = start_time(None, rank)
+        # The multiply is only queued, so its timer synchronizes to measure it
+        tstart = start_time(row_groups[row], rank)
 
         z_loc += torch.mm(acol.float(), brow)
 
-        # dur = stop_time(row_groups[0], rank, tstart)
-        dur = stop_time(None, rank, tstart)
+        dur = stop_time(row_groups[row], rank, tstart, "summa_comp")
         comp_time[run][rank] += dur
         summa_comp[run][rank] += dur
+        count_work(rank, "summa_comp", perf.gemm_work(acol.size(0), acol.size(1), brow.size(1)))
 
     # summa_time += stop_time(row_groups[0], rank, tstart_summa_time)
     return z_loc
 
+# Pipelined SUMMA: stage k + 1's broadcasts are posted asynchronously before stage k's multiply,
+# alternating between two buffer sets sized for the largest stage. With timing on, the bcast
+# timers only record the time spent waiting on a stage's data, i.e. the communication not hidden.
+def summa_pipe(adj_matrix, inputs, rank, row, col, size, acc_per_rank, row_groups, col_groups, 
+                height, middim, width):
+
+    global comm_time
+    global comp_time
+
+    global summa_bcast1
+    global summa_bcast2
+
+    global summa_comp
+    global run
+
+    proc_row = proc_row_size(size)
+    proc_col = proc_col_size(size)
+
+    height_per_proc = height // proc_row
+    width_per_proc  = width // proc_col
+    # TODO: Not sure how to handle this w/o square grid
+    middim_per_proc = middim // proc_row
+    device = torch.device('cuda:{}'.format(rank_to_devid(rank, acc_per_rank)))
+
+    if row == proc_row - 1:
+        height_per_proc = height - height_per_proc * (proc_row - 1)
+
+    if col == proc_col - 1:
+        width_per_proc = width - width_per_proc * (proc_col - 1)
+
+    middims = [middim_per_proc] * proc_col
+    middims[-1] = middim - middim_per_proc * (proc_col - 1)
+    max_middim = max(middims)
+
+    acol_bufs = []
+    brow_bufs = []
+    for i in range(2):
+        acol_bufs.append(torch.cuda.FloatTensor(height_per_proc * max_middim, device=device))
+        brow_bufs.append(torch.cuda.FloatTensor(max_middim * width_per_proc, device=device))
+
+    def post_stage(k):
+        row_src_rank = k + proc_col * row
+        col_src_rank = k * proc_col + col
+
+        if row_src_rank == rank:
+            acol = adj_matrix.contiguous()
+        else:
+            acol = acol_bufs[k % 2][:(height_per_proc * middims[k])]
+            acol = acol.view(height_per_proc, middims[k])
+
+        if col_src_rank == rank:
+            brow = inputs.contiguous()
+        else:
+            brow = brow_bufs[k % 2][:(middims[k] * width_per_proc)]
+            brow = brow.view(middims[k], width_per_proc)
+
+        acol_req = dist.broadcast(acol, row_src_rank, row_groups[row], async_op=True)
+        brow_req = dist.broadcast(brow, col_src_rank, col_groups[col], async_op=True)
+        return acol, brow, acol_req, brow_req
+
+    z_loc = torch.cuda.FloatTensor(height_per_proc, width_per_proc, device=device).fill_(0)
+
+    timer = StageTimer()
+    stage = post_stage(0)
+    for k in range(proc_col):
+        acol, brow, acol_req, brow_req = stage
+
+        tstart = timer.start()
+        acol_req.wait()
+        timer.stop("summa_bcast1", tstart, [comm_time, summa_bcast1])
+        count_work(rank, "summa_bcast1", perf.message_work(acol))
+
+        tstart = timer.start()
+        brow_req.wait()
+        timer.stop("summa_bcast2", tstart, [comm_time, summa_bcast2])
+        count_work(rank, "summa_bcast2", perf.message_work(brow))
+
+        # Buffer set (k + 1) % 2 was last read by stage k - 1's multiply, which is already queued
+        if k < proc_col - 1:
+            stage = post_stage(k + 1)
+
+        tstart = timer.start()
+
+        z_loc += torch.mm(acol.float(), brow)
+
+        timer.stop("summa_comp", tstart, [comp_time, summa_comp])
+        count_work(rank, "summa_comp", perf.gemm_work(acol.size(0), acol.size(1), brow.size(1)))
+
+    timer.read(rank)
+    return z_loc
+
+
+# Bytes needed to send a height-row block with nnz nonzeros in the compact wire format
+def csr_nbytes(height, nnz):
+    return 4 * (height + 1 + 2 * nnz)
+
+# View a packed block as its int32 row offsets, int32 column indices and float32 values
+def csr_unpack(buf, height, nnz):
+    words = buf.view(torch.int32)
+    rowptr = words[:(height + 1)]
+    colind = words[(height + 1):(height + 1 + nnz)]
+    values = words[(height + 1 + nnz):(height + 1 + 2 * nnz)].view(torch.float32)
+    return rowptr, colind, values
+
+# Pack a coalesced COO block into one byte buffer laid out as rowptr | colind | values.
+# Indices stay exact up to 2^31 and the block costs height + 1 + 2 * nnz words on the wire.
+def csr_pack(adj_matrix, device):
+    height = adj_matrix.size(0)
+    nnz = adj_matrix._nnz()
+    indices = adj_matrix.indices()
+
+    buf = torch.cuda.ByteTensor(csr_nbytes(height, nnz), device=device)
+    rowptr, colind, values = csr_unpack(buf, height, nnz)
+
+    rowptr[0] = 0
+    rowptr[1:] = torch.cumsum(torch.bincount(indices[0], minlength=height), dim=0)
+    colind.copy_(indices[1])
+    values.copy_(adj_matrix.values())
+    return buf
+
+# A never changes, so pack the local block and exchange every stage's nnz once per run
+def summa_sparse_setup(adj_matrix, rank, row, size, acc_per_rank, row_groups):
+    global acol_nnzs
+    global acol_loc
+    global acol_cache
+
+    proc_col = proc_col_size(size)
+    device = torch.device('cuda:{}'.format(rank_to_devid(rank, acc_per_rank)))
+
+    acol_loc = csr_pack(adj_matrix, device)
+
+    nnz = torch.cuda.LongTensor([adj_matrix._nnz()], device=device)
+    nnz_recv = []
+    for i in range(proc_col):
+        nnz_recv.append(torch.cuda.LongTensor(1, device=device))
+
+    # Row group members are ordered by stage, so entry k is the nnz of stage k's block
+    dist.all_gather(nnz_recv, nnz, group=row_groups[row])
+    acol_nnzs = torch.cat(nnz_recv).tolist()
+
+    # Largest blocks first, so the budget removes as many words per stage as possible. Member m
+    # of the row already holds stage m's block, so the budget only holds the blocks it receives.
+    # A stage is added when it fits the member receiving the most, so all members pick the same stages.
+    height = adj_matrix.size(0)
+    budget = cache_adj * 1024 * 1024
+    stage_nbytes = [csr_nbytes(height, nnz) for nnz in acol_nnzs]
+    cached_stages = []
+    for k in sorted(range(proc_col), key=lambda k: -acol_nnzs[k]):
+        stages = cached_stages + [k]
+        received = max(sum(stage_nbytes[j] for j in stages if j != m) for m in range(proc_col))
+        if received <= budget:
+            cached_stages.append(k)
+
+    acol_cache = dict()
+    for k in sorted(cached_stages):
+        row_src_rank = k + proc_col * row
+        if row_src_rank == rank:
+            acol = acol_loc
+        else:
+            acol = torch.cuda.ByteTensor(csr_nbytes(height, acol_nnzs[k]), device=device)
+
+        dist.broadcast(acol, row_src_rank, row_groups[row])
+        acol_cache[k] = acol
+
+    if cached_stages:
+        print(f"rank: {rank} cached A stages: {sorted(cached_stages)}", flush=True)
+
 def summa_sparse(adj_matrix, inputs, rank, row, col, size, acc_per_rank, row_groups, col_groups, 
                     height, middim, width):
 
@@ -299,6 +540,10 @@ def summa_sparse(adj_matrix, inputs, rank, row, col, size, acc_per_rank, row_gro
     global summa_sparse_time
     global run
 
+    if pipeline:
+        return summa_sparse_pipe(adj_matrix, inputs, rank, row, col, size, acc_per_rank, row_groups,
+                                    col_groups, height, middim, width)
+
     # tstart_summa_sparse_time = start_time(row_groups[0], rank)
 
     proc_row = proc_row_size(size)
@@ -339,55 +584,30 @@ def summa_sparse(adj_matrix, inputs, rank, row, col, size, acc_per_rank, row_gro
             # middim_per_proc -= proc_col * middim_per_proc - middim
             middim_per_proc = middim - middim_per_proc * (proc_col - 1)
 
-        if row_src_rank == rank:
-            # acol = adj_matrix.clone()
-            acol_indices_len = torch.cuda.LongTensor(
-                                            [adj_matrix.indices().contiguous()[0].size(0)], 
-                                            device=device)
-            acol_values_len = torch.cuda.LongTensor([adj_matrix.values().contiguous().size(0)],
-                                                    device=device)
-        else:
-            # acol = torch.sparse.FloatTensor(height_per_proc, middim_per_proc)
-            acol_indices_len = torch.cuda.LongTensor([0], device=device)
-            acol_values_len = torch.cuda.LongTensor([0], device=device)
-
-        dist.broadcast(acol_indices_len, row_src_rank, row_groups[row])
-        # dist.broadcast_multigpu([acol_indices_len], row_src_rank, row_groups[row])
-
-        acol_indices_len = acol_indices_len.item() # nnz
-        # acol_values_len = acol_values_len.item()
-        acol_values_len = acol_indices_len
-
-        if row_src_rank == rank:
-            acol_indices = adj_matrix.indices().contiguous().long()
-            acol_values = adj_matrix.values().contiguous().float()
+        # Block nnz were exchanged once in summa_sparse_setup, so no length broadcast is needed
+        acol_nnz = acol_nnzs[k]
+        if k in acol_cache:
+            # Cached at setup, so only the dense operand moves this stage
+            acol = acol_cache[k]
         else:
-            acol_indices = torch.cuda.LongTensor(2, acol_indices_len, device=device).fill_(0)
-            acol_values = torch.cuda.FloatTensor(acol_values_len, device=device).fill_(0)
-        
-
-        acol = torch.cat((acol_indices.float(), acol_values.unsqueeze(0)), dim=0).contiguous()
-
-        tstart = start_time(row_groups[row], rank)
-
-        # dist.broadcast_multigpu([acol], row_src_rank, row_groups[row])
-        dist.broadcast(acol, row_src_rank, row_groups[row])
+            if row_src_rank == rank:
+                acol = acol_loc
+            else:
+                acol = torch.cuda.ByteTensor(csr_nbytes(height_per_proc, acol_nnz), device=device)
 
-        dur = stop_time(row_groups[row], rank, tstart)
-        comm_time[run][rank] += dur
-        summa_sparse_bcast1[run][rank] += dur
-        if rank == 0:
-            summa_sparse_bcast1_words[run][rank] += 3 * acol_values_len
+            tstart = start_time(row_groups[row], rank)
 
-        acol_indices = acol[:2].long()
-        acol_values = acol[2].squeeze(0)
+            # dist.broadcast_multigpu([acol], row_src_rank, row_groups[row])
+            dist.broadcast(acol, row_src_rank, row_groups[row])
 
-        if row_src_rank == rank:
-            acol = adj_matrix
-        else:
-            acol = sparse_coo_tensor_gpu(acol_indices, acol_values, 
-                                            torch.Size([height_per_proc, middim_per_proc]))
+            dur = stop_time(row_groups[row], rank, tstart, "summa_sparse_bcast1")
+            comm_time[run][rank] += dur
+            summa_sparse_bcast1[run][rank] += dur
+            count_work(rank, "summa_sparse_bcast1", perf.message_work(acol))
+            if rank == 0:
+                summa_sparse_bcast1_words[run][rank] += acol.size(0) // 4
 
+        acol_rowptr, acol_colind, acol_values = csr_unpack(acol, height_per_proc, acol_nnz)
 
         if col_src_rank == rank:
             brow = inputs
@@ -402,29 +622,137 @@ def summa_sparse(adj_matrix, inputs, rank, row, col, size, acc_per_rank, row_gro
         # dist.broadcast_multigpu([brow], col_src_rank, col_groups[col])
         dist.broadcast(brow, col_src_rank, col_groups[col])
 
-        dur = stop_time(row_groups[0], rank, tstart)
+        dur = stop_time(row_groups[0], rank, tstart, "summa_sparse_bcast2")
         # dur = stop_time(col_groups[col], rank, tstart)
 
         comm_time[run][rank] += dur
         summa_sparse_bcast2[run][rank] += dur
+        count_work(rank, "summa_sparse_bcast2", perf.message_work(brow))
         if rank == 0:
             summa_sparse_bcast2_words[run][rank] += brow.size(0) * brow.size(1)
 
-        # tstart = start_time(row_groups[0], rank)
-        tstart = start_time(None, rank)
+        # The SpMM is only queued, so its timer synchronizes to measure it
+        tstart = start_time(row_groups[row], rank)
 
-        spmm_gpu(acol_indices[0].int(), acol_indices[1].int(), acol_values, 
+        spmm_csr_gpu(acol_rowptr, acol_colind, acol_values, 
                         height_per_proc, middim_per_proc, brow, z_loc)
 
-        # dur = stop_time(row_groups[0], rank, tstart)
-        dur = stop_time(None, rank, tstart)
+        dur = stop_time(row_groups[row], rank, tstart, "summa_sparse_comp")
         # dur = stop_time(col_groups[col], rank, tstart)
         comp_time[run][rank] += dur
         summa_sparse_comp[run][rank] += dur
+        count_work(rank, "summa_sparse_comp", perf.spmm_work(acol_nnz, height_per_proc, 
+                                                                middim_per_proc, brow.size(1)))
 
     # summa_sparse_time += stop_time(row_groups[0], rank, tstart_summa_sparse_time)
     return z_loc
 
+# Pipelined summa_sparse, see summa_pipe. Cached A stages only post the dense broadcast.
+def summa_sparse_pipe(adj_matrix, inputs, rank, row, col, size, acc_per_rank, row_groups, 
+                        col_groups, height, middim, width):
+
+    global comm_time
+    global comp_time
+
+    global summa_sparse_bcast1
+    global summa_sparse_bcast2
+
+    global summa_sparse_bcast1_words
+    global summa_sparse_bcast2_words
+
+    global summa_sparse_comp
+    global run
+
+    proc_row = proc_row_size(size)
+    proc_col = proc_col_size(size)
+
+    height_per_proc = height // proc_row
+    width_per_proc  = width // proc_col
+
+    # TODO: Not sure how to handle this w/o square grid
+    middim_per_proc = middim // proc_col
+    device = torch.device('cuda:{}'.format(rank_to_devid(rank, acc_per_rank)))
+
+    if row == proc_row - 1:
+        height_per_proc = height - height_per_proc * (proc_row - 1)
+
+    if col == proc_col - 1:
+        width_per_proc = width - width_per_proc * (proc_col - 1)
+
+    middims = [middim_per_proc] * proc_col
+    middims[-1] = middim - middim_per_proc * (proc_col - 1)
+    max_middim = max(middims)
+    max_acol_nbytes = max([csr_nbytes(height_per_proc, acol_nnz) for acol_nnz in acol_nnzs])
+
+    acol_bufs = []
+    brow_bufs = []
+    for i in range(2):
+        acol_bufs.append(torch.cuda.ByteTensor(max_acol_nbytes, device=device))
+        brow_bufs.append(torch.cuda.FloatTensor(max_middim * width_per_proc, device=device))
+
+    def post_stage(k):
+        row_src_rank = k + proc_col * row
+        col_src_rank = k * proc_col + col
+
+        acol_req = None
+        if k in acol_cache:
+            acol = acol_cache[k]
+        else:
+            if row_src_rank == rank:
+                acol = acol_loc
+            else:
+                acol = acol_bufs[k % 2][:csr_nbytes(height_per_proc, acol_nnzs[k])]
+            acol_req = dist.broadcast(acol, row_src_rank, row_groups[row], async_op=True)
+
+        if col_src_rank == rank:
+            brow = inputs.contiguous()
+        else:
+            brow = brow_bufs[k % 2][:(middims[k] * width_per_proc)]
+            brow = brow.view(middims[k], width_per_proc)
+
+        brow_req = dist.broadcast(brow, col_src_rank, col_groups[col], async_op=True)
+        return acol, brow, acol_req, brow_req
+
+    z_loc = torch.cuda.FloatTensor(height_per_proc, width_per_proc, device=device).fill_(0)
+
+    timer = StageTimer()
+    stage = post_stage(0)
+    for k in range(proc_col):
+        acol, brow, acol_req, brow_req = stage
+
+        if acol_req is not None:
+            tstart = timer.start()
+            acol_req.wait()
+            timer.stop("summa_sparse_bcast1", tstart, [comm_time, summa_sparse_bcast1])
+            count_work(rank, "summa_sparse_bcast1", perf.message_work(acol))
+            if rank == 0:
+                summa_sparse_bcast1_words[run][rank] += acol.size(0) // 4
+
+        tstart = timer.start()
+        brow_req.wait()
+        timer.stop("summa_sparse_bcast2", tstart, [comm_time, summa_sparse_bcast2])
+        count_work(rank, "summa_sparse_bcast2", perf.message_work(brow))
+        if rank == 0:
+            summa_sparse_bcast2_words[run][rank] += brow.size(0) * brow.size(1)
+
+        # Buffer set (k + 1) % 2 was last read by stage k - 1's SpMM, which is already queued
+        if k < proc_col - 1:
+            stage = post_stage(k + 1)
+
+        acol_rowptr, acol_colind, acol_values = csr_unpack(acol, height_per_proc, acol_nnzs[k])
+
+        tstart = timer.start()
+
+        spmm_csr_gpu(acol_rowptr, acol_colind, acol_values, 
+                        height_per_proc, middims[k], brow, z_loc)
+
+        timer.stop("summa_sparse_comp", tstart, [comp_time, summa_sparse_comp])
+        count_work(rank, "summa_sparse_comp", perf.spmm_work(acol_nnzs[k], height_per_proc, 
+                                                                middims[k], brow.size(1)))
+
+    timer.read(rank)
+    return z_loc
+
 def summa_loc(mata, matb, rank, row, col, size, acc_per_rank, row_groups, col_groups, 
                     height, middim, width):
 
@@ -432,9 +760,14 @@ def summa_loc(mata, matb, rank, row, col, size, acc_per_rank, row_groups, col_gr
     global comp_time
 
     global summa_loc_bcast
+    global summa_loc_comp
     global summa_loc_time
     global run
 
+    if pipeline:
+        return summa_loc_pipe(mata, matb, rank, row, col, size, acc_per_rank, row_groups, col_groups,
+                                height, middim, width)
+
     # tstart_summa_loc_time = start_time(row_groups[0], rank)
 
     proc_row = proc_row_size(size)
@@ -488,9 +821,10 @@ def summa_loc(mata, matb, rank, row, col, size, acc_per_rank, row_groups, col_gr
         # dist.broadcast_multigpu([acol], row_src_rank, row_groups[row])
         dist.broadcast(acol, row_src_rank, row_groups[row])
 
-        dur = stop_time(row_groups[row], rank, tstart)
+        dur = stop_time(row_groups[row], rank, tstart, "summa_loc_bcast")
         comm_time[run][rank] += dur
         summa_loc_bcast[run][rank] += dur
+        count_work(rank, "summa_loc_bcast", perf.message_work(acol))
 
         # if col_src_rank == rank:
         #     brow = matb.clone()
@@ -501,18 +835,92 @@ def summa_loc(mata, matb, rank, row, col, size, acc_per_rank, row_groups, col_gr
 
         brow = matb[col_src_rank]
 
-        # tstart = start_time(row_groups[0], rank)
-        tstart = start_time(None, rank)
+        # The multiply is only queued, so its timer synchronizes to measure it
+        tstart = start_time(row_groups[row], rank)
 
         z_loc += torch.mm(acol, brow)
 
-        # dur = stop_time(row_groups[0], rank, tstart)
-        dur = stop_time(None, rank, tstart)
+        dur = stop_time(row_groups[row], rank, tstart, "summa_loc_comp")
         comp_time[run][rank] += dur
+        summa_loc_comp[run][rank] += dur
+        count_work(rank, "summa_loc_comp", perf.gemm_work(acol.size(0), acol.size(1), brow.size(1)))
 
     # summa_loc_time += stop_time(row_groups[0], rank, tstart_summa_loc_time)
     return z_loc
 
+# Pipelined summa_loc, see summa_pipe. Only the A operand moves, B is already local.
+def summa_loc_pipe(mata, matb, rank, row, col, size, acc_per_rank, row_groups, col_groups, 
+                    height, middim, width):
+
+    global comm_time
+    global comp_time
+
+    global summa_loc_bcast
+    global summa_loc_comp
+    global run
+
+    proc_row = proc_row_size(size)
+    proc_col = proc_col_size(size)
+
+    height_per_proc = height // proc_row
+    device = torch.device('cuda:{}'.format(rank_to_devid(rank, acc_per_rank)))
+
+    if row == proc_row - 1:
+        height_per_proc = height - height_per_proc * (proc_row - 1)
+
+    width_per_proc = matb[rank].size(1)
+
+    middims = []
+    for k in range(proc_col):
+        middims.append(matb[k * proc_col + col].size(0))
+    max_middim = max(middims)
+
+    acol_bufs = []
+    for i in range(2):
+        acol_bufs.append(torch.cuda.FloatTensor(height_per_proc * max_middim, device=device))
+
+    def post_stage(k):
+        row_src_rank = k + proc_col * row
+
+        if row_src_rank == rank:
+            acol = mata.contiguous()
+        else:
+            acol = acol_bufs[k % 2][:(height_per_proc * middims[k])]
+            acol = acol.view(height_per_proc, middims[k])
+
+        acol_req = dist.broadcast(acol, row_src_rank, row_groups[row], async_op=True)
+        return acol, acol_req
+
+    z_loc = torch.cuda.FloatTensor(height_per_proc, width_per_proc, device=device).fill_(0)
+
+    timer = StageTimer()
+    stage = post_stage(0)
+    for k in range(proc_col):
+        col_src_rank = k * proc_col + col
+        acol, acol_req = stage
+
+        tstart = timer.start()
+        acol_req.wait()
+        timer.stop("summa_loc_bcast", tstart, [comm_time, summa_loc_bcast])
+        count_work(rank, "summa_loc_bcast", perf.message_work(acol))
+
+        # Buffer set (k + 1) % 2 was last read by stage k - 1's multiply, which is already queued
+        if k < proc_col - 1:
+            stage = post_stage(k + 1)
+
+        brow = matb[col_src_rank]
+
+        tstart = timer.start()
+
+        z_loc += torch.mm(acol, brow)
+
+        timer.stop("summa_loc_comp", tstart, [comp_time, summa_loc_comp])
+        count_work(rank, "summa_loc_comp", perf.gemm_work(acol.size(0), acol.size(1), brow.size(1)))
+
+    timer.read(rank)
+    return z_loc
+
+
 def get_proc_groups(rank, size, group):
     proc_row = proc_row_size(size)
     proc_col = proc_col_size(size)
@@ -525,129 +933,112 @@ def get_proc_groups(rank, size, group):
 
     for i in range(proc_row):
         # dist.barrier(group)
-        row_groups.append(dist.new_group(list(range(i * proc_col, i * proc_col + proc_col))))
+        row_groups.append(topology.new_group(list(range(i * proc_col, i * proc_col + proc_col)), rank))
 
     # dist.barrier(group)
     for i in range(proc_col):
         # dist.barrier(group)
-        col_groups.append(dist.new_group(list(range(i, size, proc_row))))
+        col_groups.append(topology.new_group(list(range(i, size, proc_row)), rank))
 
     return row_groups, col_groups
 
 def dist_log_softmax(z, rank, size, acc_per_rank, group):
-    torch.set_printoptions(edgeitems=4)
+    # Row maxes and normalizers are combined with one n x 1 all_reduce each, so the
+    # class dimension never leaves its rank
+    maxes = torch.max(z, dim=1, keepdim=True)[0]
+    dist.all_reduce(maxes, op=dist.reduce_op.MAX, group=group)
+
+    sm_sum = torch.sum(torch.exp(z - maxes), dim=1, keepdim=True)
+    dist.all_reduce(sm_sum, op=dist.reduce_op.SUM, group=group)
+
+    # Log of each row's softmax normalizer, kept for the backward pass
+    lse = maxes + torch.log(sm_sum)
+    h = z - lse
+    return h, lse
+
+def dist_log_softmax_backward(z, lse, grad_output, group):
+    # d log_softmax(z) = g - softmax(z) * rowsum(g), with the row sum taken over every class
+    grad_sum = torch.sum(grad_output, dim=1, keepdim=True)
+    dist.all_reduce(grad_sum, op=dist.reduce_op.SUM, group=group)
+    return grad_output - torch.exp(z - lse) * grad_sum
+
+# One GCN layer, sigma(A * H * W) on the 2D grid. Returns the pre-activation z and the
+# log_softmax normalizer as well for the backward.
+# With ax, the precomputed (A * X, (A * X)^T) of layer 0, the SpMM is skipped.
+def layer_forward(inputs, weight, node_count, adj_matrix, rank, size, acc_per_rank, row_groups, 
+                    col_groups, func, ax=None):
     proc_row = proc_row_size(size)
     proc_col = proc_col_size(size)
+
     rank_row = int(rank / proc_col)
     rank_col = rank % proc_col
-    device = torch.device('cuda:{}'.format(rank_to_devid(rank, acc_per_rank)))
-    
-    maxes = torch.max(z, dim=1, keepdim=True)[0]
-    maxes_recv = []
-    for i in range(proc_col):
-        maxes_recv.append(torch.cuda.FloatTensor(maxes.size(), device=device))
-
-    # dist.all_reduce(maxes, op=dist.reduce_op.MAX, group=group)
-    dist.all_gather(maxes_recv, maxes, group=group)
-    maxes_recv[rank_col] = maxes
-    maxes = torch.max(torch.cat(maxes_recv, dim=1), dim=1, keepdim=True)[0]
-
-    h = torch.exp(z - maxes)
-    sm_sum = torch.sum(h, dim=1, keepdim=True)
 
-    sm_sum_recv = []
-    for i in range(proc_col):
-        sm_sum_recv.append(torch.cuda.FloatTensor(sm_sum.size(), device=device))
-
-    # dist.all_reduce(sm_sum, op=dist.reduce_op.SUM, group=group)
-    dist.all_gather(sm_sum_recv, sm_sum, group=group)
-    sm_sum_recv[rank_col] = sm_sum
-    sm_sum = torch.sum(torch.cat(sm_sum_recv, dim=1), dim=1, keepdim=True)
-    sm_sum = torch.log(sm_sum)
-    h = z - maxes - sm_sum
-    return h
+    adj_matrix_t = adj_matrix # Only true for undirected graphs
 
-def dist_log_softmax2(z, rank, size, width, acc_per_rank, group, grad_output):
-    proc_row = proc_row_size(size)
-    proc_col = proc_col_size(size)
-    rank_row = int(rank / proc_col)
-    rank_col = rank % proc_col
-    device = torch.device('cuda:{}'.format(rank_to_devid(rank, acc_per_rank)))
+    # TODO: will need to change height argument when n % sqrt(P) != 0 and non-square grid
+    if ax is not None:
+        z = ax[0]
+    else:
+        z = summa_sparse(adj_matrix_t, inputs, rank, rank_row, rank_col, size, acc_per_rank, 
+                            row_groups, col_groups, node_count, node_count, weight.size(0))
 
+    # tstart_grad_weight = start_time(row_groups[0], rank)
+    chunk_sizes_row = []
     chunk_sizes_col = []
-    width_per_col = width // proc_col
+    weight_per_row = weight.size(0) // proc_row
+    weight_per_col = weight.size(1) // proc_col
+    for i in range(proc_row):
+        if i == proc_row - 1:
+            chunk_sizes_row.append(weight.size(0) - weight_per_row * (proc_row - 1))
+        else:
+            chunk_sizes_row.append(weight_per_row)
 
     for i in range(proc_col):
         if i == proc_col - 1:
-            chunk_sizes_col.append(width - width_per_col * (proc_col - 1))
+            chunk_sizes_col.append(weight.size(1) - weight_per_col * (proc_col - 1))
         else:
-            chunk_sizes_col.append(width_per_col)
-
-    width_per_proc = width - width_per_col * (proc_col - 1)
-    if z.size(1) != width_per_proc:
-        z = torch.cat((z, torch.cuda.FloatTensor(z.size(0), width_per_proc - z.size(1))), dim=1)
-
-    z_recv = []
-    for i in range(proc_col):
-        z_recv.append(torch.cuda.FloatTensor(z.size()))
-
-    dist.all_gather(z_recv, z, group=group)
-    z_recv[rank_col] = z
-
-    for i in range(proc_col - 1):
-        pad_col = width // proc_col
-        z_recv[i] = z_recv[i][:,:pad_col]
-
-    z = torch.cat(z_recv, dim=1)
-
-    if grad_output is not None:
-        if grad_output.size(1) != width_per_proc:
-            grad_output = torch.cat((grad_output, 
-                                        torch.cuda.FloatTensor(grad_output.size(0), 
-                                                        width_per_proc - grad_output.size(1))), 
-                                        dim=1)
-
-        grad_output_recv = []
-        for i in range(proc_col):
-            grad_output_recv.append(torch.cuda.FloatTensor(grad_output.size()))
-
-        dist.all_gather(grad_output_recv, grad_output, group=group)
-        grad_output_recv[rank_col] = grad_output
-
-        for i in range(proc_col - 1):
-            pad_col = width // proc_col
-            grad_output_recv[i] = grad_output_recv[i][:,:pad_col]
-
-        grad_output = torch.cat(grad_output_recv, dim=1)
-
-    maxes = torch.max(z, dim=1, keepdim=True)[0]
-    h = torch.exp(z - maxes)
-    sm_sum = torch.sum(h, dim=1, keepdim=True)
-    sm_sum = torch.log(sm_sum)
-
-    h = z - maxes - sm_sum
-
-    # if h.requires_grad:
-    #     if rank_col == 0:
-    #         sm_sigma = torch.autograd.grad(outputs=h, inputs=z,
-    #                                             grad_outputs=grad_output)[0]
-    #         print(f"rank: {rank} sm_sigma: {sm_sigma}", flush=True)
-    #     else:
-    #         sm_sigma = torch.autograd.grad(outputs=h, inputs=z,
-    #                                             grad_outputs=grad_output)[0]
-    #         print(f"rank: {rank} sm_sigma: {sm_sigma}", flush=True)
-
-    # Only works for P = 4
-    # if rank_col == 0:
-    #     return h[:,:width_per_proc]
-    # else:
-    #     return h[:,width_per_proc:]
-    return h, z, grad_output
+            chunk_sizes_col.append(weight_per_col)
+
+    # weight_rows = torch.split(weight, math.ceil(float(weight.size(0)) / proc_row), dim=0)
+    weight_rows = torch.split(weight, chunk_sizes_row, dim=0)
+    weight_parts = []
+    for i in weight_rows:
+        # weight_cols = torch.split(i, math.ceil(float(weight.size(1)) / proc_col), dim=1)
+        weight_cols = torch.split(i, chunk_sizes_col, dim=1)
+        weight_parts.extend(weight_cols)
+    # grad_weight_time += stop_time(row_groups[0], rank, tstart_grad_weight)
+
+    # z = torch.mm(z, weight)
+    z = summa_loc(z, weight_parts, rank, rank_row, rank_col, size, acc_per_rank, row_groups, 
+                    col_groups, node_count, weight.size(0), weight.size(1))
+
+    h = z
+    lse = None
+    if activations:
+        if func is F.log_softmax:
+            h, lse = dist_log_softmax(z, rank, size, acc_per_rank, row_groups[rank_row])
+        elif func is F.relu:
+            h = func(z)
+
+    return z, h, lse
+
+# Forward-only pass over the whole graph through the first layer_count layers. Bypasses
+# GCNFunc, so nothing is saved for a backward and no autograd graph is built.
+def forward(inputs, weights, node_count, adj_matrix, rank, size, acc_per_rank, row_groups, col_groups, 
+                layer_count=None, ax=None):
+    outputs = inputs
+    with torch.no_grad():
+        for i, w in enumerate(weights[:layer_count]):
+            _, outputs, _ = layer_forward(outputs, w, node_count, adj_matrix, rank, size, acc_per_rank, 
+                                            row_groups, col_groups, 
+                                            F.relu if i < len(weights) - 1 else F.log_softmax, 
+                                            ax if i == 0 else None)
+    return outputs
 
 class GCNFunc(torch.autograd.Function):
     @staticmethod
     def forward(ctx, inputs, weight, node_count, adj_matrix, am_partitions, rank, size, 
-                        acc_per_rank, group, row_groups, col_groups, transpose_group, func):
+                        acc_per_rank, group, row_groups, col_groups, transpose_group, func, ax):
         # inputs: H
         # adj_matrix: A
         # weight: W
@@ -677,62 +1068,21 @@ class GCNFunc(torch.autograd.Function):
         ctx.row_groups = row_groups
         ctx.col_groups = col_groups
         ctx.transpose_group = transpose_group
+        ctx.ax = ax
 
         ctx.func = func
 
-        adj_matrix_t = adj_matrix # Only true for undirected graphs
-
         tmp_summa_sparse_bcast2 = summa_sparse_bcast2[run][rank]
 
-        # TODO: will need to change height argument when n % sqrt(P) != 0 and non-square grid
-        z = summa_sparse(adj_matrix_t, inputs, rank, rank_row, rank_col, size, acc_per_rank, 
-                            row_groups, col_groups, node_count, node_count, weight.size(0))
-
-        # tstart_grad_weight = start_time(row_groups[0], rank)
-        chunk_sizes_row = []
-        chunk_sizes_col = []
-        weight_per_row = weight.size(0) // proc_row
-        weight_per_col = weight.size(1) // proc_col
-        for i in range(proc_row):
-            if i == proc_row - 1:
-                chunk_sizes_row.append(weight.size(0) - weight_per_row * (proc_row - 1))
-            else:
-                chunk_sizes_row.append(weight_per_row)
-
-        for i in range(proc_col):
-            if i == proc_col - 1:
-                chunk_sizes_col.append(weight.size(1) - weight_per_col * (proc_col - 1))
-            else:
-                chunk_sizes_col.append(weight_per_col)
-
-        # weight_rows = torch.split(weight, math.ceil(float(weight.size(0)) / proc_row), dim=0)
-        weight_rows = torch.split(weight, chunk_sizes_row, dim=0)
-        weight_parts = []
-        for i in weight_rows:
-            # weight_cols = torch.split(i, math.ceil(float(weight.size(1)) / proc_col), dim=1)
-            weight_cols = torch.split(i, chunk_sizes_col, dim=1)
-            weight_parts.extend(weight_cols)
-        # grad_weight_time += stop_time(row_groups[0], rank, tstart_grad_weight)
-
-        # z = torch.mm(z, weight)
-        z = summa_loc(z, weight_parts, rank, rank_row, rank_col, size, acc_per_rank, row_groups, 
-                        col_groups, node_count, weight.size(0), weight.size(1))
+        z, h, ctx.lse = layer_forward(inputs, weight, node_count, adj_matrix, rank, size, acc_per_rank, 
+                                        row_groups, col_groups, func, ax)
 
         z.requires_grad = True
         ctx.z = z
 
         summa_sparse_bcast2_fwd[run][rank] += summa_sparse_bcast2[run][rank] - tmp_summa_sparse_bcast2
 
-        if activations:
-            if func is F.log_softmax:
-                h = dist_log_softmax(z, rank, size, acc_per_rank, row_groups[rank_row])
-            elif func is F.relu:
-                h = func(z)
-            else:
-                h = z
-            return h
-        else:
-            return z
+        return h
 
         # dur = stop_time(row_groups[0], rank, tstart)
         # fwd_time += dur
@@ -773,28 +1123,8 @@ class GCNFunc(torch.autograd.Function):
         if activations:
             with torch.set_grad_enabled(True):
                 if func is F.log_softmax:
-                    # func_eval = dist_log_softmax2(z, rank, size, acc_per_rank, row_groups[rank_row])
-                    func_eval, z_gathered, go_gathered = dist_log_softmax2(z, rank, size, 
-                                                                    weight.size(1), 
-                                                                    acc_per_rank, 
-                                                                    row_groups[rank_row], grad_output)
-                    width = z_gathered.size(1)
-
-                    sigmap = torch.autograd.grad(outputs=func_eval, inputs=z_gathered,
-                                                    grad_outputs=go_gathered)[0]
-
-                    chunk_sizes_col = []
-                    sigmap_per_col = width // proc_col
-
-                    for i in range(proc_col):
-                        if i == proc_col - 1:
-                            chunk_sizes_col.append(width - sigmap_per_col * (proc_col - 1))
-                        else:
-                            chunk_sizes_col.append(sigmap_per_col)
-
-                    grad_output = sigmap.split(chunk_sizes_col, dim=1)[rank_col]
-                    del z_gathered
-                    del go_gathered
+                    grad_output = dist_log_softmax_backward(z, ctx.lse, grad_output, 
+                                                                row_groups[rank_row])
                 elif func is F.relu:
                     func_eval = func(z)
                     sigmap = torch.autograd.grad(outputs=func_eval, inputs=z,grad_outputs=grad_output)[0]
@@ -807,106 +1137,75 @@ class GCNFunc(torch.autograd.Function):
 
         tmp_summa_sparse_bcast2 = summa_sparse_bcast2[run][rank]
 
-        # First backprop equation
-        # TODO: will need to change height argument when n % sqrt(P) != 0 and non-square grid
-        ag = summa_sparse(adj_matrix, grad_output, rank, rank_row, rank_col, size, acc_per_rank, 
-                            row_groups, col_groups, node_count, node_count, weight.t().size(0))
-
-        # tstart_grad_weight = start_time(row_groups[0], rank)
-        chunk_sizes_row = []
-        chunk_sizes_col = []
-        weight_per_row = weight.t().size(0) // proc_row
-        weight_per_col = weight.t().size(1) // proc_col
-        for i in range(proc_row):
-            if i == proc_row - 1:
-                chunk_sizes_row.append(weight.t().size(0) - weight_per_row * (proc_row - 1))
-            else:
-                chunk_sizes_row.append(weight_per_row)
-
-        for i in range(proc_col):
-            if i == proc_col - 1:
-                chunk_sizes_col.append(weight.t().size(1) - weight_per_col * (proc_col - 1))
-            else:
-                chunk_sizes_col.append(weight_per_col)
-        # weight_rows = torch.split(weight.t(), math.ceil(float(weight.t().size(0)) / proc_row), 
-        weight_rows = torch.split(weight.t(), chunk_sizes_row, dim=0)
-
-        weight_parts = []
-        for i in weight_rows:
-            # weight_cols = torch.split(i, math.ceil(float(weight.t().size(1)) / proc_col), dim=1)
-            weight_cols = torch.split(i, chunk_sizes_col, dim=1)
-            weight_parts.extend(weight_cols)
-
-        # grad_input = torch.mm(ag, weight.t())
-        grad_input = summa_loc(ag, weight_parts, rank, rank_row, rank_col, size, acc_per_rank, 
-                                    row_groups, col_groups, node_count, weight.t().size(0), 
-                                    weight.t().size(1))
-        # grad_weight_time += stop_time(row_groups[0], rank, tstart_grad_weight)
-
-        # Second backprop equation (reuses the A * G^l computation)
-        # col_groups twice because of transpose
-        # TODO: will need to change height argument when n % sqrt(P) != 0 and non-square grid
+        # Layer 0 on A * X: the features need no gradient, and the weight gradient is
+        # (A * X)^T * G with the transpose precomputed as well
+        if ctx.ax is not None:
+            ag = grad_output
+            grad_input = None
+            inputs_t = ctx.ax[1]
+        else:
+            # First backprop equation
+            # TODO: will need to change height argument when n % sqrt(P) != 0 and non-square grid
+            ag = summa_sparse(adj_matrix, grad_output, rank, rank_row, rank_col, size, acc_per_rank, 
+                                row_groups, col_groups, node_count, node_count, weight.t().size(0))
+
+            # tstart_grad_weight = start_time(row_groups[0], rank)
+            chunk_sizes_row = []
+            chunk_sizes_col = []
+            weight_per_row = weight.t().size(0) // proc_row
+            weight_per_col = weight.t().size(1) // proc_col
+            for i in range(proc_row):
+                if i == proc_row - 1:
+                    chunk_sizes_row.append(weight.t().size(0) - weight_per_row * (proc_row - 1))
+                else:
+                    chunk_sizes_row.append(weight_per_row)
 
-        # tstart_transpose = start_time(row_groups[0], rank)
-        tstart_transpose = start_time(transpose_group, rank)
-        inputs_t = transpose(inputs, rank_row, rank_col, node_count, weight.size(0), size,
-                                acc_per_rank, transpose_group)
-        # transpose_time[run][rank] += stop_time(row_groups[0], rank, tstart_transpose)
-        transpose_time[run][rank] += stop_time(transpose_group, rank, tstart_transpose)
+            for i in range(proc_col):
+                if i == proc_col - 1:
+                    chunk_sizes_col.append(weight.t().size(1) - weight_per_col * (proc_col - 1))
+                else:
+                    chunk_sizes_col.append(weight_per_col)
+            # weight_rows = torch.split(weight.t(), math.ceil(float(weight.t().size(0)) / proc_row), 
+            weight_rows = torch.split(weight.t(), chunk_sizes_row, dim=0)
+
+            weight_parts = []
+            for i in weight_rows:
+                # weight_cols = torch.split(i, math.ceil(float(weight.t().size(1)) / proc_col), dim=1)
+                weight_cols = torch.split(i, chunk_sizes_col, dim=1)
+                weight_parts.extend(weight_cols)
+
+            # grad_input = torch.mm(ag, weight.t())
+            grad_input = summa_loc(ag, weight_parts, rank, rank_row, rank_col, size, acc_per_rank, 
+                                        row_groups, col_groups, node_count, weight.t().size(0), 
+                                        weight.t().size(1))
+            # grad_weight_time += stop_time(row_groups[0], rank, tstart_grad_weight)
+
+            # Second backprop equation (reuses the A * G^l computation)
+            # col_groups twice because of transpose
+            # TODO: will need to change height argument when n % sqrt(P) != 0 and non-square grid
+
+            # tstart_transpose = start_time(row_groups[0], rank)
+            tstart_transpose = start_time(transpose_group, rank)
+            inputs_t = transpose(inputs, rank_row, rank_col, node_count, weight.size(0), size,
+                                    acc_per_rank, transpose_group)
+            # transpose_time[run][rank] += stop_time(row_groups[0], rank, tstart_transpose)
+            transpose_time[run][rank] += stop_time(transpose_group, rank, tstart_transpose, "transpose")
+            count_work(rank, "transpose", perf.message_work(inputs_t))
 
         grad_weight = summa(inputs_t, ag, rank, rank_row, rank_col, size, acc_per_rank, row_groups,
                                 col_groups, weight.size(0), node_count, weight.size(1))
 
         # tstart_grad_weight = start_time(row_groups[0], rank)
-        # Collect grad_weight's across processes
-        grad_weight_recv = []
-        max_row_chunk = max(chunk_sizes_col) #transpose
-        max_col_chunk = max(chunk_sizes_row)
-        for i in range(size):
-            grad_weight_recv.append(torch.cuda.FloatTensor(
-                                                max_row_chunk,
-                                                max_col_chunk,
-                                                device=device))
-
-        # pad_row = math.ceil(float(weight.size(0)) / proc_row) - grad_weight.size(0)
-        # pad_col = math.ceil(float(weight.size(1)) / proc_col) - grad_weight.size(1)
-        pad_row = max_row_chunk - grad_weight.size(0)
-        pad_col = max_col_chunk - grad_weight.size(1)
-
-        # TODO: make this part less hacky
-        grad_weight = torch.cat((grad_weight, 
-                        torch.cuda.FloatTensor(pad_row, grad_weight.size(1), device=device).fill_(no_occur_val)), 
-                        dim=0) 
-        grad_weight = torch.cat((grad_weight, 
-                        torch.cuda.FloatTensor(grad_weight.size(0), pad_col, device=device).fill_(no_occur_val)), 
-                        dim=1) 
-
-        dist.all_gather(grad_weight_recv, grad_weight)
-        # dist.all_gather_multigpu([grad_weight_recv], [grad_weight])
-
-        # for i in range(size):
-        #     if rank == i:
-        #         grad_weight_recv[i] = grad_weight
-        #     dist.broadcast(grad_weight_recv[i], i, group)
-        # grad_weight_recv[0] = grad_weight
-
-        for i in range(len(grad_weight_recv)):
-            grad_weight_recv[i] = grad_weight_recv[i][(grad_weight_recv[i][:, 0] != no_occur_val)
-                                                                .nonzero().squeeze(1)]
-
-            grad_weight_recv_t = grad_weight_recv[i].t()
-            grad_weight_recv_t = grad_weight_recv_t[(grad_weight_recv_t[:, 0] != no_occur_val)
-                                                                .nonzero().squeeze(1)]
-
-            grad_weight_recv[i] = grad_weight_recv_t.t()
-        
-        grad_weight_fin = torch.cuda.FloatTensor(device=device)
-        for i in range(proc_row):
-            grad_weight_row = torch.cuda.FloatTensor(device=device)
-            for j in range(proc_col):
-                rank_wt = i * proc_row + j
-                grad_weight_row = torch.cat((grad_weight_row, grad_weight_recv[rank_wt]), dim=1)
-            grad_weight_fin = torch.cat((grad_weight_fin, grad_weight_row), dim=0)
+        # Collect grad_weight's across processes. Each rank's block lands at its offset in a
+        # zero buffer of the full weight size, so a single all_reduce assembles the gradient.
+        grad_weight_fin = torch.cuda.FloatTensor(weight.size(0), weight.size(1), 
+                                                    device=device).fill_(0)
+        row_off = rank_row * (weight.size(0) // proc_row)
+        col_off = rank_col * (weight.size(1) // proc_col)
+        grad_weight_fin[row_off:(row_off + grad_weight.size(0)), 
+                            col_off:(col_off + grad_weight.size(1))] = grad_weight
+
+        dist.all_reduce(grad_weight_fin, op=dist.reduce_op.SUM)
 
         summa_sparse_bcast2_bwd[run][rank] += summa_sparse_bcast2[run][rank] - tmp_summa_sparse_bcast2
 
@@ -915,21 +1214,21 @@ class GCNFunc(torch.autograd.Function):
 
         # grad_weight_time += stop_time(row_groups[0], rank, tstart_grad_weight)
 
-        return grad_input, grad_weight_fin, None, None, None, None, None, None, None, None, None, None, None
+        return grad_input, grad_weight_fin, None, None, None, None, None, None, None, None, None, None, None, None
 
 def train(inputs, weight1, weight2, node_count, adj_matrix, am_partitions, optimizer, data, rank, 
-                size, acc_per_rank, group, row_groups, col_groups, transpose_group):
+                size, acc_per_rank, group, row_groups, col_groups, transpose_group, ax=None):
 
     global loss_calc_time
     global run
 
     outputs = GCNFunc.apply(inputs, weight1, node_count, adj_matrix, am_partitions, rank, size, 
                                     acc_per_rank, group, row_groups, col_groups, transpose_group, 
-                                    F.relu)
+                                    F.relu, ax)
 
     outputs = GCNFunc.apply(outputs, weight2, node_count, adj_matrix, am_partitions, rank, size, 
                                     acc_per_rank, group, row_groups, col_groups, transpose_group, 
-                                    F.log_softmax)
+                                    F.log_softmax, None)
 
     proc_row = proc_row_size(size)
     proc_col = proc_col_size(size)
@@ -996,35 +1295,49 @@ def train(inputs, weight1, weight2, node_count, adj_matrix, am_partitions, optim
         # fake_loss = (outputs * torch.zeros(outputs.size())).sum()
         fake_loss.backward()
 
+    tstart_step = start_time(group, rank)
     optimizer.step()
+    stop_time(group, rank, tstart_step, "optimizer_step")
 
     return outputs
 
-def test(outputs, data, vertex_count, rank):
-    logits, accs = outputs, []
+# Row-wise argmax of a matrix whose columns are split across group. Ties go to the lowest class.
+def dist_argmax(z, col_offset, classes, group):
+    maxes, pred = torch.max(z, dim=1)
+    pred += col_offset
+
+    maxes_glob = maxes.clone()
+    dist.all_reduce(maxes_glob, op=dist.reduce_op.MAX, group=group)
+
+    # Ranks that do not hold a row's max propose a class past the last one
+    pred[maxes != maxes_glob] = classes
+    dist.all_reduce(pred, op=dist.reduce_op.MIN, group=group)
+    return pred
+
+# Scores this rank's rows and classes, so only a handful of counts are reduced
+def test(outputs, data, col_offset, classes, row_group, col_group):
+    pred = dist_argmax(outputs.detach(), col_offset, classes, row_group)
+
+    # Every member of a process row holds the same predictions, so count over one column
+    counts = []
     for _, mask in data('train_mask', 'val_mask', 'test_mask'):
-        pred = logits[mask].max(1)[1]
-        acc = pred.eq(data.y[mask]).sum().item() / mask.sum().item()
-        accs.append(acc)
+        counts.append(pred[mask].eq(data.y[mask]).sum())
+        counts.append(mask.sum())
+    counts = torch.stack(counts)
+    dist.all_reduce(counts, op=dist.reduce_op.SUM, group=col_group)
+    counts = counts.tolist()
+
+    accs = []
+    for i in range(0, len(counts), 2):
+        if counts[i + 1] > 0:
+            accs.append(counts[i] / counts[i + 1])
+        else:
+            accs.append(0)
 
     if len(accs) != 3:
         accs = accs + [0] * (3 - len(accs))
 
     return accs
-    # logits, accs = outputs, []
-    # datay_rank = torch.split(data.y, vertex_count)[rank]
-    # for _, mask in data('train_mask', 'val_mask', 'test_mask'):
-    #     mask_rank = torch.split(mask, vertex_count)[rank]
-    #     count = mask_rank.nonzero().size(0)
-    #     if count > 0:
-    #         pred = logits[mask_rank].max(1)[1]
-    #         acc = pred.eq(datay_rank[mask_rank]).sum().item() / mask_rank.sum().item()
-    #         # pred = logits[mask].max(1)[1]
-    #         # acc = pred.eq(data.y[mask]).sum().item() / mask.sum().item()
-    #     else:
-    #         acc = -1
-    #     accs.append(acc)
-    # return accs
 
 
 # Split a COO into partitions of size n_per_proc
@@ -1051,6 +1364,8 @@ def scale_elements(adj_matrix, adj_part, node_count, row_vtx, col_vtx):
     if not normalization:
         return adj_part
 
+    import torch_sparse
+
     adj_part = adj_part.coalesce()
     deg = torch.histc(adj_matrix[0].double(), bins=node_count)
     deg = deg.pow(-0.5)
@@ -1160,6 +1475,59 @@ def twod_partition(rank, size, inputs, adj_matrix, data, features, classes, devi
     print(inputs_loc.size(), flush=True)
     return inputs_loc, adj_matrix_loc, am_pbyp
 
+# twod_partition for a generated graph. A is symmetric, so this rank generates the rows of its
+# block column as columns and keeps the edges landing in its block row, and only its block row of
+# the features. Normalization would need global degrees, so the values stay ones.
+def synthetic_partition(rank, size, node_count):
+    proc_row = proc_row_size(size)
+    proc_col = proc_col_size(size)
+    n_per_proc = node_count // proc_row
+
+    rank_row = int(rank / proc_col)
+    rank_col = rank % proc_col
+
+    row_start = rank_row * n_per_proc
+    row_stop = node_count if rank_row == proc_row - 1 else row_start + n_per_proc
+    col_start = rank_col * n_per_proc
+    col_stop = node_count if rank_col == proc_col - 1 else col_start + n_per_proc
+
+    features = synth_graph.features
+    features_per_col = features // proc_col
+    feature_start = rank_col * features_per_col
+    feature_stop = features if rank_col == proc_col - 1 else feature_start + features_per_col
+
+    with torch.no_grad():
+        edge_index = synth_graph.edges(col_start, col_stop)
+        keep = (edge_index[1] >= row_start) & (edge_index[1] < row_stop)
+        adj_block = torch.stack([edge_index[1, keep] - row_start, edge_index[0, keep] - col_start])
+
+        adj_matrix_loc = torch.sparse_coo_tensor(adj_block, torch.ones(adj_block.size(1)), 
+                                                    size=(row_stop - row_start, col_stop - col_start),
+                                                    requires_grad=False)
+        inputs_loc = synth_graph.inputs(row_start, row_stop)[:, feature_start:feature_stop]
+
+    print(f"rank: {rank} adj_matrix_loc.size: {adj_matrix_loc.size()} nnz: {adj_block.size(1)}", 
+            flush=True)
+    return inputs_loc, adj_matrix_loc
+
+# Keep only this process row's labels and masks for the sharded evaluator
+def label_partition(rank, size, data, node_count, device):
+    proc_row = proc_row_size(size)
+    proc_col = proc_col_size(size)
+    rank_row = int(rank / proc_col)
+
+    height_per_proc = node_count // proc_row
+    row_start = rank_row * height_per_proc
+    row_stop = row_start + height_per_proc
+    if rank_row == proc_row - 1:
+        row_stop = node_count
+
+    data_loc = Data()
+    data_loc.y = data.y[row_start:row_stop].long().to(device)
+    for key, mask in data('train_mask', 'val_mask', 'test_mask'):
+        data_loc[key] = mask[row_start:row_stop].bool().to(device)
+    return data_loc
+
 def rank_to_devid(rank, acc_per_rank):
     return rank % acc_per_rank
 
@@ -1169,10 +1537,13 @@ def run(rank, size, inputs, adj_matrix, data, features, mid_layer, classes, devi
     global epochs
     global timing
     global run
+    global tracer
 
+    node_count = synth_graph.nodes if synth_graph is not None else inputs.size(0)
     best_val_acc = test_acc = 0
     outputs = None
 
+    tstart = time.time()
     group = dist.new_group(list(range(size)))
     row_groups, col_groups = get_proc_groups(rank, size, group)
 
@@ -1185,6 +1556,7 @@ def run(rank, size, inputs, adj_matrix, data, features, mid_layer, classes, devi
     if rank_row >= proc_row or rank_col >= proc_col:
         return
 
+    # Each rank is in one transpose pair, with local synchronization it only builds that one
     transpose_groups = []
 
     for i in range(proc_row):
@@ -1193,7 +1565,7 @@ def run(rank, size, inputs, adj_matrix, data, features, mid_layer, classes, devi
             local_rank = i * proc_col + j
             local_rank_t = j * proc_row + i
             if local_rank < local_rank_t:
-                transpose_groups_row.append(dist.new_group([local_rank, local_rank_t]))
+                transpose_groups_row.append(topology.new_group([local_rank, local_rank_t], rank))
             else:
                 transpose_groups_row.append(None)
         transpose_groups.append(transpose_groups_row)
@@ -1202,11 +1574,29 @@ def run(rank, size, inputs, adj_matrix, data, features, mid_layer, classes, devi
         transpose_group = transpose_groups[rank_row][rank_col]
     else:
         transpose_group = transpose_groups[rank_col][rank_row]
+    startup["groups"] = time.time() - tstart
 
     # adj_matrix_loc = torch.rand(node_count, n_per_proc)
     # inputs_loc = torch.rand(n_per_proc, inputs.size(1))
 
+    if accuracy or eval_every > 0:
+        data_loc = label_partition(rank, size, data, node_count, device)
+
+    ckpt = None
+    if resume:
+        ckpt = checkpoint.load(ckpt_dir, rank)
+
+    ax = None
+
+    ckpt_writer = None
+    if ckpt_dir is not None and ckpt_every > 0:
+        ckpt_writer = checkpoint.CheckpointWriter(ckpt_dir, rank, device, ckpt_queue)
+
     for i in range(run_count):
+        # Runs finished before the checkpoint are not repeated
+        if ckpt is not None and i < ckpt["run"]:
+            continue
+
         run = i
         torch.manual_seed(0)
         weight1_nonleaf = torch.rand(features, mid_layer, requires_grad=True)
@@ -1222,8 +1612,31 @@ def run(rank, size, inputs, adj_matrix, data, features, mid_layer, classes, devi
 
         optimizer = torch.optim.Adam([weight1, weight2], lr=0.01)
 
-        inputs_loc, adj_matrix_loc, _ = twod_partition(rank, size, inputs, adj_matrix, data, features,
-                                                            classes, device)
+        start_epoch = 0
+        best = None
+        if ckpt is not None and i == ckpt["run"]:
+            best = checkpoint.restore(ckpt, [weight1, weight2], optimizer, device)
+            start_epoch = ckpt["epoch"] + 1
+
+        if inference and ckpt_dir is not None:
+            checkpoint.load_weights(ckpt_dir, [weight1, weight2])
+
+        # Later runs reuse the partition the first run cached
+        tstart = time.time()
+        partition = None
+        if ckpt_dir is not None and (resume or i > 0):
+            partition = checkpoint.load_partition(ckpt_dir, rank)
+
+        if partition is None:
+            if synth_graph is not None:
+                inputs_loc, adj_matrix_loc = synthetic_partition(rank, size, node_count)
+            else:
+                inputs_loc, adj_matrix_loc, _ = twod_partition(rank, size, inputs, adj_matrix, data, 
+                                                                    features, classes, device)
+            if ckpt_dir is not None:
+                checkpoint.save_partition(ckpt_dir, rank, (inputs_loc, adj_matrix_loc))
+        else:
+            inputs_loc, adj_matrix_loc = partition
 
         adj_matrix_loc = adj_matrix_loc.coalesce()
 
@@ -1232,6 +1645,17 @@ def run(rank, size, inputs, adj_matrix, data, features, mid_layer, classes, devi
 
         print(f"rank: {rank} adj_matrix_loc.nnz: {adj_matrix_loc._nnz()}")
 
+        summa_sparse_setup(adj_matrix_loc, rank, rank_row, size, acc_per_rank, row_groups)
+
+        if "partition" not in startup:
+            startup["partition"] = time.time() - tstart
+            print(f"rank: {rank} startup: {startup} total: {time.time() - startup_tstart}s", flush=True)
+
+            # Stage k multiplies the A block of column k of this rank's grid row
+            stages = [(acol_nnzs[k], adj_matrix_loc.size(0), adj_matrix_loc.size(1)) 
+                            for k in range(proc_col)]
+            perf.balance(rank, group, stages, features, mem_bandwidth, imbalance, device)
+
         total_time[i] = dict()
         comp_time[i] = dict()
         comm_time[i] = dict()
@@ -1246,6 +1670,7 @@ def run(rank, size, inputs, adj_matrix, data, features, mid_layer, classes, devi
         summa_sparse_comp[i] = dict()
         summa_comp[i] = dict()
         summa_loc_bcast[i] = dict()
+        summa_loc_comp[i] = dict()
         fwd_time[i] = dict()
         bwd_time[i] = dict()
         transpose_time[i] = dict()
@@ -1254,6 +1679,7 @@ def run(rank, size, inputs, adj_matrix, data, features, mid_layer, classes, devi
         summa_sparse_time[i] = dict()
         summa_time[i] = dict()
         summa_loc_time[i] = dict()
+        work[i] = dict()
 
         total_time[i][rank] = 0.0
         comp_time[i][rank] = 0.0
@@ -1269,6 +1695,7 @@ def run(rank, size, inputs, adj_matrix, data, features, mid_layer, classes, devi
         summa_sparse_comp[i][rank] = 0.0
         summa_comp[i][rank] = 0.0
         summa_loc_bcast[i][rank] = 0.0
+        summa_loc_comp[i][rank] = 0.0
         fwd_time[i][rank] = 0.0
         bwd_time[i][rank] = 0.0
         transpose_time[i][rank] = 0.0
@@ -1277,11 +1704,39 @@ def run(rank, size, inputs, adj_matrix, data, features, mid_layer, classes, devi
         summa_sparse_time[i][rank] = 0.0
         summa_time[i][rank] = 0.0
         summa_loc_time[i][rank] = 0.0
+        work[i][rank] = perf.Counts()
+
+        # The features never change, so A * X and its transpose are computed once, untimed, and
+        # reused by every run
+        if precompute_ax and ax is None:
+            timing_on = timing == True
+            timing = False
+            with torch.no_grad():
+                ax = summa_sparse(adj_matrix_loc, inputs_loc, rank, rank_row, rank_col, size, acc_per_rank, 
+                                    row_groups, col_groups, node_count, node_count, features)
+                ax_t = transpose(ax, rank_row, rank_col, node_count, features, size, acc_per_rank, 
+                                    transpose_group)
+            ax = (ax, ax_t)
+            if timing_on:
+                timing = True
+
+        # Each run is one forward pass in inference
+        if inference:
+            dist.barrier(group)
+            torch.cuda.reset_peak_memory_stats(device)
+            tstart = time.time()
+            outputs = forward(inputs_loc, [weight1, weight2], node_count, adj_matrix_loc, rank, size, 
+                                acc_per_rank, row_groups, col_groups, layer_count, ax)
+            torch.cuda.synchronize(device=device)
+            total_time[i][rank] = time.time() - tstart
+            print(f"rank: {rank} run {i} inference_time: {total_time[i][rank]} " \
+                    f"peak_memory: {torch.cuda.max_memory_allocated(device) / 2**20}MB", flush=True)
+            continue
 
         # Do not time first epoch
         # timing_on = timing == True
         # timing = False
-        # outputs = train(inputs_loc, weight1, weight2, inputs.size(0), adj_matrix_loc, None, 
+        # outputs = train(inputs_loc, weight1, weight2, node_count, adj_matrix_loc, None, 
         #                         optimizer, data, rank, size, acc_per_rank, group, row_groups, 
         #                         col_groups, transpose_group)
         # if timing_on:
@@ -1289,34 +1744,112 @@ def run(rank, size, inputs, adj_matrix, data, features, mid_layer, classes, devi
 
         # # tstart = start_time(group, rank)
         dist.barrier(group)
+        # The trace clock starts at the barrier before the first timed run, on every rank at once
+        if trace_path is not None and tracer is None:
+            tracer = timeline.Timeline(trace_path, rank)
         tstart = time.time()
 
         print(f"Starting training... rank {rank} run {i}", flush=True)
-        for epoch in range(0, epochs):
-            outputs = train(inputs_loc, weight1, weight2, inputs.size(0), adj_matrix_loc, None, 
+        best_val_acc = test_acc = 0
+        best_weights = None
+        bad_evals = 0
+        # A resumed run continues the early stopping of the checkpointed one
+        if best is not None:
+            best_weights = best["weights"]
+            best_val_acc = best["val_acc"]
+            test_acc = best["test_acc"]
+            bad_evals = best["bad_evals"]
+        for epoch in range(start_epoch, epochs):
+            tstart_epoch = time.time()
+
+            # The outputs of an epoch come from the weights before its optimizer step
+            eval_epoch = eval_every > 0 and epoch % eval_every == 0
+            if eval_epoch:
+                weights_pre = [w.detach().clone() for w in [weight1, weight2]]
+
+            outputs = train(inputs_loc, weight1, weight2, node_count, adj_matrix_loc, None, 
                                     optimizer, data, rank, size, acc_per_rank, group, row_groups, 
-                                    col_groups, transpose_group)
+                                    col_groups, transpose_group, ax)
+            if tracer is not None:
+                tracer.event(f"epoch {epoch}", tstart_epoch, tid=timeline.epoch_tid, cat="epoch")
             print("Epoch: {:03d}".format(epoch), flush=True)
 
+            if eval_epoch:
+                train_acc, val_acc, tmp_test_acc = test(outputs, data_loc, rank_col * (classes // proc_col), 
+                                                        classes, row_groups[rank_row], 
+                                                        col_groups[rank_col])
+                log = 'Epoch: {:03d}, Train: {:.4f}, Val: {:.4f}, Test: {:.4f}'
+                print(log.format(epoch, train_acc, val_acc, tmp_test_acc), flush=True)
+
+                # val_acc is globally reduced, so every rank takes the same early-stopping decision
+                if val_acc > best_val_acc:
+                    best_val_acc = val_acc
+                    test_acc = tmp_test_acc
+                    best_weights = weights_pre
+                    bad_evals = 0
+                else:
+                    bad_evals += 1
+                    if patience > 0 and bad_evals >= patience:
+                        print(f"rank: {rank} early stop at epoch {epoch} best val: {best_val_acc}", 
+                                flush=True)
+                        break
+
+            if ckpt_writer is not None and epoch % ckpt_every == 0:
+                ckpt_writer.save(i, epoch, [weight1, weight2], optimizer, dict(weights=best_weights, 
+                            val_acc=best_val_acc, test_acc=test_acc, bad_evals=bad_evals))
+
         # dur = stop_time(group, rank, tstart)
         tstop = time.time()
         total_time[i][rank] = tstop - tstart
 
+        # Keep the best weights seen by the periodic evaluation
+        if best_weights is not None:
+            with torch.no_grad():
+                for w, w_best in zip([weight1, weight2], best_weights):
+                    w.copy_(w_best)
+
+        # The outputs so far came from the last epoch's weights, and a resumed run with no epochs
+        # left has none.
+        if best_weights is not None or outputs is None:
+            timing_on = timing == True
+            timing = False
+            with torch.no_grad():
+                outputs = forward(inputs_loc, [weight1, weight2], node_count, adj_matrix_loc, 
+                                    rank, size, acc_per_rank, row_groups, col_groups, None, ax)
+            if timing_on:
+                timing = True
+
+    if ckpt_writer is not None:
+        ckpt_writer.close()
+
+    if inference and out_dir is not None:
+        width = [weight1, weight2][:layer_count][-1].size(1)
+        col_start = rank_col * (width // proc_col)
+        pred = None
+        if layer_count is None:
+            pred = dist_argmax(outputs, col_start, classes, row_groups[rank_row])
+        checkpoint.save_outputs(out_dir, rank, outputs, rank_row * (node_count // proc_row), 
+                                    col_start, pred)
+
     # Get median runtime according to rank0 and print that run's breakdown
     dist.barrier(group)
+
+    # A resumed process only has the runs from the checkpoint onwards
+    run_ids = sorted(total_time.keys())
     if rank == 0:
         total_times_r0 = [] 
-        for i in range(run_count):
+        for i in run_ids:
             total_times_r0.append(total_time[i][0])
 
         print(f"total_times_r0: {total_times_r0}")
         median_run_time = statistics.median(total_times_r0)
-        median_idx = total_times_r0.index(median_run_time)
+        median_idx = run_ids[total_times_r0.index(median_run_time)]
         median_idx = torch.cuda.LongTensor([median_idx])
     else:
-        median_idx = torch.cuda.LongTensor([0])
+        median_idx = torch.cuda.LongTensor([run_ids[0]])
 
-    # dist.broadcast(median_idx, src=0, group=group)        
+    # Every rank reports rank 0's median run
+    dist.broadcast(median_idx, src=0, group=group)
     median_idx = median_idx.item()
     print(f"rank: {rank} median_idx: {median_idx}")
     print(f"rank: {rank} Time: {total_time[median_idx][rank]}")
@@ -1333,6 +1866,7 @@ def run(rank, size, inputs, adj_matrix, data, features, mid_layer, classes, devi
     print(f"rank: {rank} summa_bcast1: {summa_bcast1[median_idx][rank]}")
     print(f"rank: {rank} summa_bcast2: {summa_bcast2[median_idx][rank]}")
     print(f"rank: {rank} summa_loc_bcast: {summa_loc_bcast[median_idx][rank]}")
+    print(f"rank: {rank} summa_loc_comp: {summa_loc_comp[median_idx][rank]}")
     print(f"rank: {rank} transpose_time: {transpose_time[median_idx][rank]}")
     print(f"rank: {rank} grad_weight_time: {grad_weight_time[median_idx][rank]}")
     print(f"rank: {rank} loss_calc_time: {loss_calc_time[median_idx][rank]}")
@@ -1340,42 +1874,31 @@ def run(rank, size, inputs, adj_matrix, data, features, mid_layer, classes, devi
     print(f"rank: {rank} summa_time: {summa_time[median_idx][rank]}")
     print(f"rank: {rank} summa_loc_time: {summa_loc_time[median_idx][rank]}")
     print(f"rank: {rank} {outputs}")
-    
-    # All-gather outputs to test accuracy
-    if accuracy:
-        # All-gather across process row
-        output_parts_row = []
-        width_per_proc = classes // proc_col
-        for i in range(proc_col):
-            output_parts_row.append(torch.cuda.FloatTensor(outputs.size(0), classes - width_per_proc * (proc_col - 1)))
-
-        if outputs.size(1) != classes - width_per_proc * (proc_col - 1):
-            pad_col = (classes - width_per_proc * (proc_col - 1)) - outputs.size(1)
-            outputs = torch.cat((outputs, torch.cuda.FloatTensor(outputs.size(0), pad_col, device=device)), dim=1)
-
-        dist.all_gather(output_parts_row, outputs, group=row_groups[rank_row])
-        for i in range(proc_col - 1):
-            output_parts_row[i] = output_parts_row[i][:,:width_per_proc]
-
-        outputs_row = torch.cat(output_parts_row, dim=1)
 
-        # All-gather across process col
-        output_parts_col = []
-        height_per_proc = inputs.size(0) // proc_row
-        for i in range(proc_row):
-            output_parts_col.append(torch.cuda.FloatTensor(inputs.size(0) - height_per_proc * (proc_row - 1), classes))
-
-        if outputs_row.size(0) != inputs.size(0) - height_per_proc * (proc_row - 1):
-            pad_row = (inputs.size(0) - height_per_proc * (proc_col - 1)) - outputs_row.size(0)
-            outputs_row = torch.cat((outputs_row, torch.cuda.FloatTensor(pad_row, classes, device=device)), dim=0)
-
-        dist.all_gather(output_parts_col, outputs_row, group=col_groups[rank_col])
-        for i in range(proc_row - 1):
-            output_parts_col[i] = output_parts_col[i][:height_per_proc,:]
-
-        outputs = torch.cat(output_parts_col, dim=0)
+    # Phase timers are only filled with --timing
+    if timing:
+        phases = dict()
+        for name, timer in [("summa_sparse_bcast1", summa_sparse_bcast1), 
+                                ("summa_sparse_bcast2", summa_sparse_bcast2),
+                                ("summa_sparse_comp", summa_sparse_comp), 
+                                ("summa_bcast1", summa_bcast1), ("summa_bcast2", summa_bcast2), 
+                                ("summa_comp", summa_comp), ("summa_loc_bcast", summa_loc_bcast),
+                                ("summa_loc_comp", summa_loc_comp), ("transpose", transpose_time)]:
+            phases[name] = timer[median_idx][rank]
+        perf.report(rank, group, phases, work[median_idx][rank], total_time[median_idx][rank], device)
+    
+    # Every rank writes its part of the trace, rank 0 merges them
+    if tracer is not None:
+        tracer.write()
+        dist.barrier(group)
+        if rank == 0:
+            timeline.merge(trace_path, dist.get_world_size(group))
+            print(f"trace: {trace_path}", flush=True)
 
-        train_acc, val_acc, tmp_test_acc = test(outputs, data, inputs.size(0), rank)
+    if accuracy:
+        train_acc, val_acc, tmp_test_acc = test(outputs, data_loc, rank_col * (classes // proc_col), 
+                                                    classes, row_groups[rank_row], 
+                                                    col_groups[rank_col])
         if val_acc > best_val_acc:
             best_val_acc = val_acc
             test_acc = tmp_test_acc
@@ -1400,12 +1923,17 @@ def main():
     path = osp.join(osp.dirname(osp.realpath(__file__)), '..', 'data', graphname)
 
     # mid_layer = 16
+    tstart = time.time()
     if graphname == 'Cora':
+        from torch_geometric.datasets import Planetoid
+        import torch_geometric.transforms as T
         dataset = Planetoid(path, graphname, T.NormalizeFeatures())
         data = dataset[0]
         num_features = dataset.num_features
         num_classes = dataset.num_classes
     elif graphname == 'Reddit':
+        from reddit import Reddit
+        import torch_geometric.transforms as T
         dataset = Reddit(path, T.NormalizeFeatures())
         data = dataset[0]
         num_features = dataset.num_features
@@ -1457,13 +1985,31 @@ def main():
         data = Data()
         data.y = torch.rand(n).uniform_(0, num_classes - 1)
         data.train_mask = torch.ones(n).long()
+    elif synth_graph is not None:
+        # Each rank generates only its own block of A and of the features in run(). The loss
+        # indexes the labels and train mask globally, so those are built for the whole graph.
+        if normalization:
+            print(f"normalization is not applied to generated graphs", flush=True)
+        n = synth_graph.nodes
+        edge_index = None
+        num_features = synth_graph.features
+        num_classes = synth_graph.classes
+        inputs = None
+        data = Data()
+        data.y = synth_graph.labels(0, n)
+        masks = synth_graph.masks(0, n)
+        for key, mask in zip(['train_mask', 'val_mask', 'test_mask'], masks):
+            data[key] = mask.long()
 
     if download:
         exit()
+    startup["load"] = time.time() - tstart
 
     if "OMPI_COMM_WORLD_RANK" in os.environ.keys():
         os.environ["RANK"] = os.environ["OMPI_COMM_WORLD_RANK"]
-    dist.init_process_group(backend='nccl')
+    tstart = time.time()
+    dist.init_process_group(backend=backend)
+    startup["init"] = time.time() - tstart
     # dist.init_process_group('gloo', init_method='env://')
     rank = dist.get_rank()
     size = dist.get_world_size()
@@ -1496,6 +2042,9 @@ def main():
         data = data.to(device)
         inputs.requires_grad = True
         data.y = data.y.to(device)
+    elif synth_graph is not None:
+        data = data.to(device)
+        data.y = data.y.to(device)
     else:
         data = data.to(device)
         data.x.requires_grad = True
@@ -1505,7 +2054,9 @@ def main():
 
         edge_index = data.edge_index
 
-    if normalization:
+    if synth_graph is not None:
+        adj_matrix = None
+    elif normalization:
         adj_matrix, _ = add_remaining_self_loops(edge_index)
     else:
         adj_matrix = edge_index
@@ -1527,12 +2078,34 @@ if __name__ == '__main__':
     parser.add_argument("--epochs", type=int)
     parser.add_argument("--graphname", type=str)
     parser.add_argument("--timing", type=str)
+    parser.add_argument("--trace", type=str, default=None)
+    parser.add_argument("--imbalance", type=float, default=1.5)
+    parser.add_argument("--membw", type=float, default=900.)
     parser.add_argument("--midlayer", type=int)
     parser.add_argument("--runcount", type=int)
     parser.add_argument("--normalization", type=str)
     parser.add_argument("--activations", type=str)
     parser.add_argument("--accuracy", type=str)
     parser.add_argument("--download", type=bool)
+    parser.add_argument("--cacheadj", type=int)
+    parser.add_argument("--pipeline", type=str)
+    parser.add_argument("--evalevery", type=int, default=0)
+    parser.add_argument("--patience", type=int, default=0)
+    parser.add_argument("--checkpoint", type=str, default=None)
+    parser.add_argument("--ckptevery", type=int, default=0)
+    parser.add_argument("--ckptqueue", type=int, default=2)
+    parser.add_argument("--resume", type=str, default="False")
+    parser.add_argument("--inference", type=str, default="False")
+    parser.add_argument("--outdir", type=str, default=None)
+    parser.add_argument("--embedlayer", type=int, default=0)
+    parser.add_argument("--precomputeax", type=str, default="False")
+    parser.add_argument("--backend", type=str, default="nccl")
+    parser.add_argument("--nodes", type=int, default=1 << 20)
+    parser.add_argument("--degree", type=int, default=16)
+    parser.add_argument("--skew", type=str, default=synthetic.default_skew)
+    parser.add_argument("--features", type=int, default=128)
+    parser.add_argument("--classes", type=int, default=16)
+    parser.add_argument("--seed", type=int, default=0)
     args = parser.parse_args()
     print(args)
 
@@ -1543,18 +2116,52 @@ if __name__ == '__main__':
     epochs = args.epochs
     graphname = args.graphname
     timing = args.timing == "True"
+    trace_path = args.trace
+    imbalance = args.imbalance
+    mem_bandwidth = args.membw
+    # The trace records the phase timers
+    if trace_path is not None:
+        timing = True
     mid_layer = args.midlayer
     run_count = args.runcount
     normalization = args.normalization == "True"
     activations = args.activations == "True"
     accuracy = args.accuracy == "True"
     download = args.download
+    eval_every = args.evalevery
+    patience = args.patience
+    ckpt_dir = args.checkpoint
+    ckpt_every = args.ckptevery
+    ckpt_queue = args.ckptqueue
+    resume = args.resume == "True" and ckpt_dir is not None
+    inference = args.inference == "True"
+    out_dir = args.outdir
+    if args.embedlayer > 0:
+        layer_count = args.embedlayer
+    precompute_ax = args.precomputeax == "True"
+    backend = args.backend
+    if graphname == "rmat" or graphname == "er":
+        synth_graph = synthetic.Graph(graphname, args.nodes, args.degree, args.skew, args.features, 
+                                        args.classes, args.seed)
+    if args.cacheadj is not None:
+        cache_adj = args.cacheadj
+    pipeline = args.pipeline == "True"
 
     if not download:
         if (epochs is None) or (graphname is None) or (timing is None) or (mid_layer is None) or (run_count is None):
             print(f"Error: missing argument {epochs} {graphname} {timing} {mid_layer}")
             exit()
 
+    # Inference runs the trained weights of --checkpoint, without them it would score random ones
+    if inference and ckpt_dir is None:
+        print(f"Error: --inference=True needs the trained weights of --checkpoint")
+        exit()
+
+    # Inference embeddings are hidden features, not class scores to take the accuracy of
+    if inference and accuracy and layer_count is not None:
+        print(f"Error: --accuracy=True scores class predictions and cannot be used with --embedlayer")
+        exit()
+
     print(f"Arguments: epochs: {epochs} graph: {graphname} timing: {timing} mid: {mid_layer} norm: {normalization} act: {activations} acc: {accuracy}")
     
     print(main())
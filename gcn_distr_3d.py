@@ -1,3 +1,6 @@
+import time
+startup_tstart = time.time()
+
 import os
 import os.path as osp
 import argparse
@@ -5,35 +8,28 @@ import argparse
 import math
 
 import torch
-import torch_sparse
 import torch.distributed as dist
 
-from torch_geometric.data import Data, Dataset
-from torch_geometric.datasets import Planetoid, PPI
-from reddit import Reddit
-from torch_geometric.nn import GCNConv, ChebConv  # noqa
-from torch_geometric.utils import (
-        add_remaining_self_loops, 
-        to_dense_adj, 
-        dense_to_sparse, 
-        to_scipy_sparse_matrix
-)
-import torch_geometric.transforms as T
+from torch_geometric.data import Data
+import checkpoint
+import topology
+import perf
+import synthetic
+import timeline
+from torch_geometric.utils import add_remaining_self_loops
 
 import torch.multiprocessing as mp
 
-from torch.multiprocessing import Manager, Process
-
 from torch.nn import Parameter
 import torch.nn.functional as F
 
-from torch_scatter import scatter_add
+from sparse_coo_tensor_cpp import spmm_csr_gpu
 
-import socket
-import time
-import numpy as np
+# The dataset loaders are imported where they are used, so a run only loads what its graph needs
 
-from sparse_coo_tensor_cpp import sparse_coo_tensor_gpu, spmm_gpu
+# Seconds spent in each startup phase, printed once the partition is ready
+startup = dict()
+startup["imports"] = time.time() - startup_tstart
 
 comp_time = 0.0
 comm_time = 0.0
@@ -58,13 +54,37 @@ loss_calc_time = 0.0
 summa_sparse_time = 0.0
 summa_time = 0.0
 summa_loc_time = 0.0
+work = perf.Counts() # counted flops and bytes of the timed phases, next to the timers
 
 epochs = 0
 graphname = ""
 mid_layer = 0
 timing = False
 normalization = False
-no_occur_val = 42.1234
+activations = False
+accuracy = False
+eval_every = 0 # evaluate every k epochs during training (0 disables)
+patience = 0 # stop after this many evaluations without a better val accuracy (0 disables)
+ckpt_dir = None # checkpoint directory (None disables checkpointing)
+ckpt_every = 0 # checkpoint every k epochs (0 disables)
+ckpt_queue = 2 # checkpoints in flight before training waits for the writer
+resume = False
+inference = False # forward-only pass over the whole graph with trained weights
+out_dir = None # directory for each rank's output shard in inference
+layer_count = None # layers to run in inference, None runs all of them and writes predictions
+precompute_ax = False # compute A * X once and skip layer 0's SpMM
+
+# Compact SUMMA wire format state, filled once by split3dspmm_sparse_setup
+acol_nnzs = None # nnz of the A block sent in each row stage
+acol_loc = None  # this rank's A block, already packed for broadcasting
+acol_cache = dict() # stage -> A block kept resident so its broadcast is skipped
+cache_adj = 0 # MB of GPU memory allowed for cached A blocks (0 disables the cache)
+backend = "nccl" # torch.distributed backend, gloo where NCCL is unavailable
+synth_graph = None # synthetic.Graph each rank generates its own block of, instead of graphname
+tracer = None # timeline.Timeline every timed phase is recorded in with --trace
+trace_path = None # Chrome trace file the ranks' timelines are merged into
+imbalance = 1.5 # nnz imbalance (max / mean) over which the pre-training balance report warns
+mem_bandwidth = 900. # GB/s the balance report predicts the SpMM stage times at
 
 def sync_and_sleep(rank, device):
     torch.cuda.synchronize(device=device)
@@ -86,20 +106,25 @@ def start_time(group, rank):
         return 0.0
     # dist.barrier(group)
     torch.cuda.synchronize(device=device)
-    tstart = 0.0
-    if rank == 0:
-     tstart = time.time()
+    tstart = time.time()
     return tstart
 
-def stop_time(group, rank, tstart):
+# Count a phase's flops and bytes next to its timer. Only timed work is counted, so the counts
+# match the seconds they are divided by.
+def count_work(phase, phase_work):
+    if timing:
+        work.add(phase, phase_work)
+
+def stop_time(group, rank, tstart, name=None):
     device = torch.device('cuda:{}'.format(rank_to_devid(rank, acc_per_rank)))
     if not timing:
         return 0.0
     # dist.barrier(group)
     torch.cuda.synchronize(device=device)
-    tstop = 0.0
-    if rank == 0:
-        tstop = time.time()
+    # Every rank times, the perf report compares the ranks
+    tstop = time.time()
+    if tracer is not None and name is not None:
+        tracer.event(name, tstart, tstop)
     return tstop - tstart
 
 def transpose(mat, rank, height, width, height_c, width_c, size, acc_per_rank, c_groups, transpose_group):
@@ -119,10 +144,11 @@ def transpose(mat, rank, height, width, height_c, width_c, size, acc_per_rank, c
     width_per_proc_c = width_c // proc_c
     mat_c_recv_width = width_c - width_per_proc_c * (proc_c - 1)
 
+    # Only the last member of the c group can be wider, so pad to its width and
+    # slice the known widths back out after the gather
     if mat.size(1) != mat_c_recv_width:
         pad_col = mat_c_recv_width - mat.size(1)
-        # mat = torch.cat((mat, torch.FloatTensor(mat.size(0), pad_col, device=device).fill_(no_occur_val)),
-        mat = torch.cat((mat, torch.cuda.FloatTensor(mat.size(0), pad_col, device=device).fill_(no_occur_val)),
+        mat = torch.cat((mat, torch.cuda.FloatTensor(mat.size(0), pad_col, device=device).fill_(0)),
                             dim=1) 
 
     mat_c_recv = []
@@ -131,10 +157,8 @@ def transpose(mat, rank, height, width, height_c, width_c, size, acc_per_rank, c
         mat_c_recv.append(torch.cuda.FloatTensor(mat.size(), device=device))
 
     dist.all_gather(mat_c_recv, mat, group=c_groups[int(rank // proc_c)])
-    for i in range(proc_c):
-        mat_c_recv[i] = mat_c_recv[i].t_()
-        mat_c_recv[i] = mat_c_recv[i][(mat_c_recv[i][:, 0] != no_occur_val).nonzero().squeeze(1)]
-        mat_c_recv[i] = mat_c_recv[i].t_()
+    for i in range(proc_c - 1):
+        mat_c_recv[i] = mat_c_recv[i][:, :width_per_proc_c]
 
     mat = torch.cat(mat_c_recv, dim=1)
     mat.t_()
@@ -266,9 +290,10 @@ def split3dspmm_dense(adj_matrix, inputs, rank, row, col, rank_c, size, acc_per_
         acol = acol.contiguous()
         dist.broadcast(acol, row_src_rank, row_groups[row][rank_c])
 
-        dur = stop_time(row_groups[row][rank_c], rank, tstart)
+        dur = stop_time(row_groups[row][rank_c], rank, tstart, "summa_bcast1")
         comm_time += dur
         summa_bcast1 += dur
+        count_work("summa_bcast1", perf.message_work(acol))
 
         if col_src_rank == rank:
             brow = inputs
@@ -281,17 +306,19 @@ def split3dspmm_dense(adj_matrix, inputs, rank, row, col, rank_c, size, acc_per_
         brow = brow.contiguous()
         dist.broadcast(brow, col_src_rank, col_groups[col][rank_c])
 
-        dur = stop_time(row_groups[0][0], rank, tstart)
+        dur = stop_time(row_groups[0][0], rank, tstart, "summa_bcast2")
         comm_time += dur
         summa_bcast2 += dur
+        count_work("summa_bcast2", perf.message_work(brow))
 
         tstart = start_time(row_groups[0][0], rank)
 
         z_loc += torch.mm(acol, brow)
 
-        dur = stop_time(row_groups[0][0], rank, tstart)
+        dur = stop_time(row_groups[0][0], rank, tstart, "summa_comp")
         comp_time += dur
         summa_comp += dur
+        count_work("summa_comp", perf.gemm_work(acol.size(0), acol.size(1), brow.size(1)))
 
         del acol
         del brow
@@ -300,12 +327,13 @@ def split3dspmm_dense(adj_matrix, inputs, rank, row, col, rank_c, size, acc_per_
     tstart = start_time(c_groups[0], rank)
 
     dist.all_reduce(z_loc, group=c_groups[int(rank // proc_c)])
+    count_work("summa_reduce", perf.message_work(z_loc))
     z_loc = torch.split(z_loc, chunk_sizes_row, dim=0)
     z_loc = z_loc[rank_c].contiguous()
 
 
     # dur = stop_time(row_groups[0][0], rank, tstart)
-    dur = stop_time(c_groups[0], rank, tstart)
+    dur = stop_time(c_groups[0], rank, tstart, "summa_reduce")
     comm_time += dur
     summa_reduce += dur
     # dist.all_gather(z_tmp_recv, z_tmp, group=c_groups[int(rank // proc_c)])
@@ -322,6 +350,82 @@ def split3dspmm_dense(adj_matrix, inputs, rank, row, col, rank_c, size, acc_per_
 
     return z_loc
 
+# Bytes needed to send a height-row block with nnz nonzeros in the compact wire format
+def csr_nbytes(height, nnz):
+    return 4 * (height + 1 + 2 * nnz)
+
+# View a packed block as its int32 row offsets, int32 column indices and float32 values
+def csr_unpack(buf, height, nnz):
+    words = buf.view(torch.int32)
+    rowptr = words[:(height + 1)]
+    colind = words[(height + 1):(height + 1 + nnz)]
+    values = words[(height + 1 + nnz):(height + 1 + 2 * nnz)].view(torch.float32)
+    return rowptr, colind, values
+
+# Pack a coalesced COO block into one byte buffer laid out as rowptr | colind | values.
+# Indices stay exact up to 2^31 and the block costs height + 1 + 2 * nnz words on the wire.
+def csr_pack(adj_matrix, device):
+    height = adj_matrix.size(0)
+    nnz = adj_matrix._nnz()
+    indices = adj_matrix.indices()
+
+    buf = torch.cuda.ByteTensor(csr_nbytes(height, nnz), device=device)
+    rowptr, colind, values = csr_unpack(buf, height, nnz)
+
+    rowptr[0] = 0
+    rowptr[1:] = torch.cumsum(torch.bincount(indices[0], minlength=height), dim=0)
+    colind.copy_(indices[1])
+    values.copy_(adj_matrix.values())
+    return buf
+
+# A never changes, so pack the local block and exchange every stage's nnz once per run
+def split3dspmm_sparse_setup(adj_matrix, rank, row, rank_c, size, acc_per_rank, row_groups):
+    global acol_nnzs
+    global acol_loc
+    global acol_cache
+
+    proc_col = proc_col_size(size)
+    proc_c = proc_c_size(size)
+    device = torch.device('cuda:{}'.format(rank_to_devid(rank, acc_per_rank)))
+
+    acol_loc = csr_pack(adj_matrix, device)
+
+    nnz = torch.cuda.LongTensor([adj_matrix._nnz()], device=device)
+    nnz_recv = []
+    for i in range(proc_col):
+        nnz_recv.append(torch.cuda.LongTensor(1, device=device))
+
+    # Row group members are ordered by stage, so entry k is the nnz of stage k's block
+    dist.all_gather(nnz_recv, nnz, group=row_groups[row][rank_c])
+    acol_nnzs = torch.cat(nnz_recv).tolist()
+
+    # Largest blocks first, so the budget removes as many words per stage as possible. Member m
+    # of the row already holds stage m's block, so the budget only holds the blocks it receives.
+    # A stage is added when it fits the member receiving the most, so all members pick the same stages.
+    height = adj_matrix.size(0)
+    budget = cache_adj * 1024 * 1024
+    stage_nbytes = [csr_nbytes(height, nnz) for nnz in acol_nnzs]
+    cached_stages = []
+    for k in sorted(range(proc_col), key=lambda k: -acol_nnzs[k]):
+        stages = cached_stages + [k]
+        received = max(sum(stage_nbytes[j] for j in stages if j != m) for m in range(proc_col))
+        if received <= budget:
+            cached_stages.append(k)
+
+    acol_cache = dict()
+    for k in sorted(cached_stages):
+        row_src_rank = row * (proc_col * proc_c) + rank_c + k * proc_c
+        if row_src_rank == rank:
+            acol = acol_loc
+        else:
+            acol = torch.cuda.ByteTensor(csr_nbytes(height, acol_nnzs[k]), device=device)
+
+        dist.broadcast(acol, row_src_rank, row_groups[row][rank_c])
+        acol_cache[k] = acol
+
+    if cached_stages:
+        print(f"rank: {rank} cached A stages: {sorted(cached_stages)}", flush=True)
+
 def split3dspmm_sparse(adj_matrix, inputs, rank, row, col, rank_c, size, acc_per_rank, 
                             row_groups, col_groups, c_groups, 
                             height, middim, width):
@@ -395,62 +499,29 @@ def split3dspmm_sparse(adj_matrix, inputs, rank, row, col, rank_c, size, acc_per
         if rank_c == proc_c - 1:
             middim_per_proc = middim_per_col - middim_per_proc * (proc_c - 1)
 
-        if row_src_rank == rank:
-            # acol = adj_matrix.clone()
-            acol_indices_len = torch.cuda.LongTensor(
-            # acol_indices_len = torch.LongTensor(
-                                            [adj_matrix.indices().contiguous()[0].size(0)], 
-                                            device=device)
-            acol_values_len = torch.cuda.LongTensor([adj_matrix.values().contiguous().size(0)],
-            # acol_values_len = torch.LongTensor([adj_matrix.values().contiguous().size(0)],
-                                                    device=device)
+        # Block nnz were exchanged once in split3dspmm_sparse_setup, so no length broadcast is needed
+        acol_nnz = acol_nnzs[k]
+        if k in acol_cache:
+            # Cached at setup, so only the dense operand moves this stage
+            acol = acol_cache[k]
         else:
-            # acol = torch.sparse.FloatTensor(height_per_proc, middim_per_proc)
-            acol_indices_len = torch.cuda.LongTensor([0], device=device)
-            acol_values_len = torch.cuda.LongTensor([0], device=device)
-
-            # acol_indices_len = torch.LongTensor([0], device=device)
-            # acol_values_len = torch.LongTensor([0], device=device)
-
-        dist.broadcast(acol_indices_len, row_src_rank, row_groups[row][rank_c])
-
-        acol_indices_len = acol_indices_len.item() # nnz
-        acol_values_len = acol_indices_len
-
-        if row_src_rank == rank:
-            acol_indices = adj_matrix.indices().contiguous().long()
-            acol_values = adj_matrix.values().contiguous().float()
-        else:
-            acol_indices = torch.cuda.LongTensor(2, acol_indices_len, device=device).fill_(0)
-            acol_values = torch.cuda.FloatTensor(acol_values_len, device=device).fill_(0)
-            # acol_indices = torch.LongTensor(2, acol_indices_len, device=device).fill_(0)
-            # acol_values = torch.FloatTensor(acol_values_len, device=device).fill_(0)
-        
-
-        acol = torch.cat((acol_indices.float(), acol_values.unsqueeze(0)), dim=0)
-
-        tstart = start_time(row_groups[row][rank_c], rank)
-
-        dist.broadcast(acol.contiguous(), row_src_rank, row_groups[row][rank_c])
+            if row_src_rank == rank:
+                acol = acol_loc
+            else:
+                acol = torch.cuda.ByteTensor(csr_nbytes(height_per_proc, acol_nnz), device=device)
 
-        dur = stop_time(row_groups[row][rank_c], rank, tstart)
-        comm_time += dur
-        summa_sparse_bcast1 += dur
-        if rank == 0:
-            summa_sparse_bcast1_words += 3 * acol_values_len
+            tstart = start_time(row_groups[row][rank_c], rank)
 
-        acol_indices = acol[:2].long()
-        acol_values = acol[2].squeeze(0)
+            dist.broadcast(acol, row_src_rank, row_groups[row][rank_c])
 
-        if row_src_rank == rank:
-            acol = adj_matrix
-        else:
-            acol = sparse_coo_tensor_gpu(acol_indices, acol_values, 
-                                            torch.Size([height_per_proc, middim_per_proc]))
-            # acol = torch.sparse_coo_tensor(acol_indices, acol_values, 
-            #                                 torch.Size([height_per_proc, middim_per_proc]),
-            #                                 requires_grad=False)
+            dur = stop_time(row_groups[row][rank_c], rank, tstart, "summa_sparse_bcast1")
+            comm_time += dur
+            summa_sparse_bcast1 += dur
+            count_work("summa_sparse_bcast1", perf.message_work(acol))
+            if rank == 0:
+                summa_sparse_bcast1_words += acol.size(0) // 4
 
+        acol_rowptr, acol_colind, acol_values = csr_unpack(acol, height_per_proc, acol_nnz)
 
         if col_src_rank == rank:
             brow = inputs
@@ -464,22 +535,25 @@ def split3dspmm_sparse(adj_matrix, inputs, rank, row, col, rank_c, size, acc_per
         brow = brow.contiguous()
         dist.broadcast(brow, col_src_rank, col_groups[col][rank_c])
 
-        dur = stop_time(row_groups[0][0], rank, tstart)
+        dur = stop_time(row_groups[0][0], rank, tstart, "summa_sparse_bcast2")
         comm_time += dur
         summa_sparse_bcast2 += dur
+        count_work("summa_sparse_bcast2", perf.message_work(brow))
         if rank == 0:
             summa_sparse_bcast2_words += brow.size(0) * brow.size(1)
 
         tstart = start_time(row_groups[0][0], rank)
 
         # z_tmp = torch.cuda.FloatTensor(height_per_proc, width_per_proc, device=device).fill_(0)
-        spmm_gpu(acol_indices[0].int(), acol_indices[1].int(), acol_values, 
+        spmm_csr_gpu(acol_rowptr, acol_colind, acol_values, 
                         height_per_proc, middim_per_proc, brow, z_loc)
         # z_loc += torch.sparse.mm(acol, brow)
 
-        dur = stop_time(row_groups[0][0], rank, tstart)
+        dur = stop_time(row_groups[0][0], rank, tstart, "summa_sparse_comp")
         comp_time += dur
         summa_sparse_comp += dur
+        count_work("summa_sparse_comp", perf.spmm_work(acol_nnz, height_per_proc, middim_per_proc, 
+                                                            brow.size(1)))
 
         # del acol
         # del brow
@@ -489,11 +563,12 @@ def split3dspmm_sparse(adj_matrix, inputs, rank, row, col, rank_c, size, acc_per
     tstart = start_time(c_groups[0], rank)
 
     dist.all_reduce(z_loc, group=c_groups[int(rank // proc_c)])
+    count_work("summa_sparse_reduce", perf.message_work(z_loc))
     z_loc = torch.split(z_loc, chunk_sizes_col, dim=1)
     z_loc = z_loc[rank_c].contiguous()
 
     # dur = stop_time(row_groups[0][0], rank, tstart)
-    dur = stop_time(c_groups[0], rank, tstart)
+    dur = stop_time(c_groups[0], rank, tstart, "summa_sparse_reduce")
     comm_time += dur
     summa_sparse_reduce += dur
 
@@ -578,9 +653,10 @@ def split3dspmm_loc(mata, matb, rank, row, col, rank_c, size, acc_per_rank,
 
         dist.broadcast(acol.contiguous(), row_src_rank, row_groups[row][rank_c])
 
-        dur = stop_time(row_groups[row][rank_c], rank, tstart)
+        dur = stop_time(row_groups[row][rank_c], rank, tstart, "summa_bcast1")
         comm_time += dur
         summa_bcast1 += dur
+        count_work("summa_bcast1", perf.message_work(acol))
 
         # if col_src_rank == rank:
         #     brow = matb.clone()
@@ -595,19 +671,21 @@ def split3dspmm_loc(mata, matb, rank, row, col, rank_c, size, acc_per_rank,
 
         z_tmp = torch.mm(acol, brow)
 
-        dur = stop_time(row_groups[0][0], rank, tstart)
+        dur = stop_time(row_groups[0][0], rank, tstart, "summa_comp")
         summa_comp += dur
         comp_time += dur
+        count_work("summa_comp", perf.gemm_work(acol.size(0), acol.size(1), brow.size(1)))
 
         # tstart = start_time(row_groups[0][0], rank)
         tstart = start_time(c_groups[0], rank)
 
         dist.all_reduce(z_tmp, group=c_groups[int(rank // proc_c)])
+        count_work("summa_reduce", perf.message_work(z_tmp))
 
         z_loc += z_tmp
 
         # dur = stop_time(row_groups[0][0], rank, tstart)
-        dur = stop_time(c_groups[0], rank, tstart)
+        dur = stop_time(c_groups[0], rank, tstart, "summa_reduce")
         summa_reduce += dur
         comm_time += dur
 
@@ -649,7 +727,7 @@ def get_proc_groups(rank, size, group):
         for j in range(proc_c):
             proc_start = i * proc_col * proc_c + j
             proc_end = (i + 1) * proc_col * proc_c + j
-            row_groups_c.append(dist.new_group(list(range(proc_start, proc_end, proc_c))))
+            row_groups_c.append(topology.new_group(list(range(proc_start, proc_end, proc_c)), rank))
             row_procs_c.append(list(range(proc_start, proc_end, proc_c)))
         row_groups.append(row_groups_c)
         row_procs.append(row_procs_c)
@@ -660,88 +738,141 @@ def get_proc_groups(rank, size, group):
         for j in range(proc_c):
             proc_start = i * proc_c + j
             proc_end = proc_row * proc_col * proc_c + i * proc_c + j
-            col_groups_c.append(dist.new_group(list(range(proc_start, proc_end, proc_c * proc_col))))
+            col_groups_c.append(topology.new_group(list(range(proc_start, proc_end, proc_c * proc_col)), 
+                                                    rank))
             col_procs_c.append(list(range(proc_start, proc_end, proc_c * proc_col)))
         col_groups.append(col_groups_c)
         col_procs.append(col_procs_c)
 
     for i in range(0, size, proc_c):
-        c_groups.append(dist.new_group(list(range(i, i + proc_c))))
+        c_groups.append(topology.new_group(list(range(i, i + proc_c)), rank))
         c_procs.append(list(range(i, i + proc_c)))
 
     return row_groups, col_groups, c_groups
 
 def dist_log_softmax(z, rank, size, acc_per_rank, group):
-    torch.set_printoptions(edgeitems=4)
+    # Row maxes and normalizers are combined with one n x 1 all_reduce each, so the
+    # class dimension never leaves its rank
+    maxes = torch.max(z, dim=1, keepdim=True)[0]
+    dist.all_reduce(maxes, op=dist.reduce_op.MAX, group=group)
+
+    sm_sum = torch.sum(torch.exp(z - maxes), dim=1, keepdim=True)
+    dist.all_reduce(sm_sum, op=dist.reduce_op.SUM, group=group)
+
+    # Log of each row's softmax normalizer, kept for the backward pass
+    lse = maxes + torch.log(sm_sum)
+    h = z - lse
+    return h, lse
+
+def dist_log_softmax_backward(z, lse, grad_output, group):
+    # d log_softmax(z) = g - softmax(z) * rowsum(g), with the row sum taken over every class
+    grad_sum = torch.sum(grad_output, dim=1, keepdim=True)
+    dist.all_reduce(grad_sum, op=dist.reduce_op.SUM, group=group)
+    return grad_output - torch.exp(z - lse) * grad_sum
+
+# One GCN layer, sigma(A * H * W) on the 3D grid. Returns the pre-activation z and the
+# log_softmax normalizer as well for the backward.
+# With ax, the precomputed (A * X, its chunk sizes, (A * X)^T) of layer 0, the SpMM is skipped.
+def layer_forward(inputs, weight, node_count, adj_matrix, rank, size, acc_per_rank, row_groups, 
+                    col_groups, c_groups, func, ax=None):
     proc_row = proc_row_size(size)
     proc_col = proc_col_size(size)
-    rank_row = int(rank / proc_col)
-    rank_col = rank % proc_col
-    device = torch.device('cuda:{}'.format(rank_to_devid(rank, acc_per_rank)))
-    
-    maxes = torch.max(z, dim=1, keepdim=True)[0]
-    maxes_recv = []
-    for i in range(proc_col):
-        maxes_recv.append(torch.cuda.FloatTensor(maxes.size(), device=device))
-
-    # dist.all_reduce(maxes, op=dist.reduce_op.MAX, group=group)
-    dist.all_gather(maxes_recv, maxes, group=group)
-    maxes_recv[rank_col] = maxes
-    maxes = torch.max(torch.cat(maxes_recv, dim=1), dim=1, keepdim=True)[0]
-
-    h = torch.exp(z - maxes)
-    sm_sum = torch.sum(h, dim=1, keepdim=True)
+    proc_c = proc_c_size(size)
 
-    sm_sum_recv = []
-    for i in range(proc_col):
-        sm_sum_recv.append(torch.cuda.FloatTensor(sm_sum.size(), device=device))
+    rank_row = int((rank // proc_c) // proc_col) # i in process grid
+    rank_col = int((rank // proc_c) % proc_col)  # j in process grid
+    rank_c = rank - (rank_row * (proc_col * proc_c) + rank_col * proc_c) # k in process grid
 
-    # dist.all_reduce(sm_sum, op=dist.reduce_op.SUM, group=group)
-    dist.all_gather(sm_sum_recv, sm_sum, group=group)
-    sm_sum_recv[rank_col] = sm_sum
-    sm_sum = torch.sum(torch.cat(sm_sum_recv, dim=1), dim=1, keepdim=True)
-    sm_sum = torch.log(sm_sum)
-    h = z - maxes - sm_sum
-    return h
+    adj_matrix_t = adj_matrix # Only true for undirected graphs
 
-def dist_log_softmax2(z, rank, size, acc_per_rank, group):
-    proc_row = proc_row_size(size)
-    proc_col = proc_col_size(size)
-    rank_row = int(rank / proc_col)
-    rank_col = rank % proc_col
-    device = torch.device('cuda:{}'.format(rank_to_devid(rank, acc_per_rank)))
-    
-    maxes = torch.max(z, dim=1, keepdim=True)[0]
-    maxes_recv = []
-    for i in range(proc_col):
-        maxes_recv.append(torch.cuda.FloatTensor(maxes.size(), device=device))
+    # TODO: will need to change height argument when n % sqrt(P) != 0 and non-square grid
+    if ax is not None:
+        z, chunk_sizes_loc = ax[0], ax[1]
+    else:
+        # z = summa_sparse(adj_matrix_t, inputs, rank, rank_row, rank_col, size, acc_per_rank, 
+        z, chunk_sizes_loc = split3dspmm_sparse(adj_matrix_t, inputs, 
+        # z, chunk_sizes_loc = split3dspmm_dense(adj_matrix_t, inputs, 
+                                                    rank, rank_row, rank_col, rank_c, size, acc_per_rank, 
+                                                    row_groups, col_groups, c_groups, 
+                                                    node_count, node_count, weight.size(0))
 
-    # dist.all_reduce(maxes, op=dist.reduce_op.MAX, group=group)
-    dist.all_gather(maxes_recv, maxes, group=group)
+    chunk_sizes_loc_tens = torch.cuda.LongTensor(chunk_sizes_loc)
+    chunk_sizes = []
     for i in range(proc_col):
-        maxes_recv[rank_col].requires_grad = True
-    maxes_recv[rank_col] = maxes
-    maxes = torch.max(torch.cat(maxes_recv, dim=1), dim=1, keepdim=True)[0]
+        chunk_sizes.append(torch.cuda.LongTensor(chunk_sizes_loc_tens.size()))
+    dist.all_gather(chunk_sizes, chunk_sizes_loc_tens, group=row_groups[rank_row][rank_c])
+    chunk_sizes = torch.cat(chunk_sizes).tolist()
 
-    h = torch.exp(z - maxes)
-    # sm_sum = torch.sum(h, dim=1, keepdim=True)
+    chunk_sizes_row = []
+    chunk_sizes_col = []
+    weight_per_row = weight.size(0) // (proc_row * proc_c)
+    weight_per_col = weight.size(1) // proc_col
+    # for i in range(proc_row * proc_c):
+    #     if i == proc_row * proc_c - 1:
+    #         chunk_sizes_row.append(weight.size(0) - weight_per_row * (proc_row * proc_c - 1))
+    #     else:
+    #         chunk_sizes_row.append(weight_per_row)
+    chunk_sizes_row = chunk_sizes
 
-    # sm_sum_recv = []
-    # for i in range(proc_col):
-    #     sm_sum_recv.append(torch.cuda.FloatTensor(sm_sum.size(), device=device))
+    for i in range(proc_col):
+        if i == proc_col - 1:
+            chunk_sizes_col.append(weight.size(1) - weight_per_col * (proc_col - 1))
+        else:
+            chunk_sizes_col.append(weight_per_col)
+
+    # weight_rows = torch.split(weight, math.ceil(float(weight.size(0)) / proc_row), dim=0)
+    weight_rows = torch.split(weight, chunk_sizes_row, dim=0)
+    weight_parts_tmp = []
+    for i in weight_rows:
+        # weight_cols = torch.split(i, math.ceil(float(weight.size(1)) / proc_col), dim=1)
+        weight_cols = torch.split(i, chunk_sizes_col, dim=1)
+        weight_parts_tmp.extend(weight_cols)
+
+    weight_parts = [None] * size
+    for i in range(proc_row * proc_c):
+        for j in range(proc_col):
+            rank_old = i * proc_col + j
 
-    # # dist.all_reduce(sm_sum, op=dist.reduce_op.SUM, group=group)
-    # dist.all_gather(sm_sum_recv, sm_sum, group=group)
-    # sm_sum_recv[rank_col] = sm_sum
-    # sm_sum = torch.sum(torch.cat(sm_sum_recv, dim=1), dim=1, keepdim=True)
-    # sm_sum = torch.log(sm_sum)
-    # h = z - maxes - sm_sum
-    return h
+            rank_new_row = i // proc_c
+            rank_new_c = i % proc_c
+            rank_new = rank_new_row * proc_col * proc_c + j * proc_c + rank_new_c
+            
+            if j == rank_col:
+                weight_parts[rank_new] = weight_parts_tmp[rank_old]
+            else:
+                weight_parts[rank_new] = None
+
+    # z = torch.mm(z, weight)
+    z = split3dspmm_loc(z, weight_parts, rank, rank_row, rank_col, rank_c, size, acc_per_rank, row_groups, 
+                            col_groups, c_groups, node_count, weight.size(0), weight.size(1))
+
+    h = z
+    lse = None
+    if activations:
+        if func is F.log_softmax:
+            h, lse = dist_log_softmax(z, rank, size, acc_per_rank, row_groups[rank_row][rank_c])
+        elif func is F.relu:
+            h = func(z)
+
+    return z, h, lse
+
+# Forward-only pass over the whole graph through the first layer_count layers. Bypasses
+# GCNFunc, so nothing is saved for a backward and no autograd graph is built.
+def forward(inputs, weights, node_count, adj_matrix, rank, size, acc_per_rank, row_groups, col_groups, 
+                c_groups, layer_count=None, ax=None):
+    outputs = inputs
+    with torch.no_grad():
+        for i, w in enumerate(weights[:layer_count]):
+            _, outputs, _ = layer_forward(outputs, w, node_count, adj_matrix, rank, size, acc_per_rank, 
+                                            row_groups, col_groups, c_groups, 
+                                            F.relu if i < len(weights) - 1 else F.log_softmax, 
+                                            ax if i == 0 else None)
+    return outputs
 
 class GCNFunc(torch.autograd.Function):
     @staticmethod
     def forward(ctx, inputs, weight, node_count, adj_matrix, am_partitions, rank, size, 
-                        acc_per_rank, group, row_groups, col_groups, transpose_group, c_groups, func):
+                        acc_per_rank, group, row_groups, col_groups, transpose_group, c_groups, func, ax):
         # inputs: H
         # adj_matrix: A
         # weight: W
@@ -768,83 +899,19 @@ class GCNFunc(torch.autograd.Function):
         ctx.col_groups = col_groups
         ctx.c_groups = c_groups
         ctx.transpose_group = transpose_group
+        ctx.ax = ax
 
         ctx.func = func
 
-        adj_matrix_t = adj_matrix # Only true for undirected graphs
-
-        # TODO: will need to change height argument when n % sqrt(P) != 0 and non-square grid
-        # z = summa_sparse(adj_matrix_t, inputs, rank, rank_row, rank_col, size, acc_per_rank, 
-        z, chunk_sizes_loc = split3dspmm_sparse(adj_matrix_t, inputs, 
-        # z, chunk_sizes_loc = split3dspmm_dense(adj_matrix_t, inputs, 
-                                                    rank, rank_row, rank_col, rank_c, size, acc_per_rank, 
-                                                    row_groups, col_groups, c_groups, 
-                                                    node_count, node_count, weight.size(0))
-
-        chunk_sizes_loc_tens = torch.cuda.LongTensor(chunk_sizes_loc)
-        chunk_sizes = []
-        for i in range(proc_col):
-            chunk_sizes.append(torch.cuda.LongTensor(chunk_sizes_loc_tens.size()))
-        dist.all_gather(chunk_sizes, chunk_sizes_loc_tens, group=row_groups[rank_row][rank_c])
-        chunk_sizes = torch.cat(chunk_sizes).tolist()
-
-        chunk_sizes_row = []
-        chunk_sizes_col = []
-        weight_per_row = weight.size(0) // (proc_row * proc_c)
-        weight_per_col = weight.size(1) // proc_col
-        # for i in range(proc_row * proc_c):
-        #     if i == proc_row * proc_c - 1:
-        #         chunk_sizes_row.append(weight.size(0) - weight_per_row * (proc_row * proc_c - 1))
-        #     else:
-        #         chunk_sizes_row.append(weight_per_row)
-        chunk_sizes_row = chunk_sizes
-
-        for i in range(proc_col):
-            if i == proc_col - 1:
-                chunk_sizes_col.append(weight.size(1) - weight_per_col * (proc_col - 1))
-            else:
-                chunk_sizes_col.append(weight_per_col)
-
-        # weight_rows = torch.split(weight, math.ceil(float(weight.size(0)) / proc_row), dim=0)
-        weight_rows = torch.split(weight, chunk_sizes_row, dim=0)
-        weight_parts_tmp = []
-        for i in weight_rows:
-            # weight_cols = torch.split(i, math.ceil(float(weight.size(1)) / proc_col), dim=1)
-            weight_cols = torch.split(i, chunk_sizes_col, dim=1)
-            weight_parts_tmp.extend(weight_cols)
-
-        weight_parts = [None] * size
-        for i in range(proc_row * proc_c):
-            for j in range(proc_col):
-                rank_old = i * proc_col + j
+        z, h, ctx.lse = layer_forward(inputs, weight, node_count, adj_matrix, rank, size, acc_per_rank, 
+                                        row_groups, col_groups, c_groups, func, ax)
 
-                rank_new_row = i // proc_c
-                rank_new_c = i % proc_c
-                rank_new = rank_new_row * proc_col * proc_c + j * proc_c + rank_new_c
-                
-                if j == rank_col:
-                    weight_parts[rank_new] = weight_parts_tmp[rank_old]
-                else:
-                    weight_parts[rank_new] = None
-
-        # z = torch.mm(z, weight)
-        z = split3dspmm_loc(z, weight_parts, rank, rank_row, rank_col, rank_c, size, acc_per_rank, row_groups, 
-                                col_groups, c_groups, node_count, weight.size(0), weight.size(1))
-
-        # z.requires_grad = True
+        z.requires_grad = True
         ctx.z = z
 
-        # Worry about activation later
-        # if func is F.log_softmax:
-        #     h = dist_log_softmax(z, rank, size, acc_per_rank, row_groups[rank_row])
-        # elif func is F.relu:
-        #     h = func(z)
-        # else:
-        #     h = z
-
         # fwd_time += dur
 
-        return z
+        return h
 
     @staticmethod
     def backward(ctx, grad_output):
@@ -880,22 +947,36 @@ class GCNFunc(torch.autograd.Function):
 
         # tstart = start_time(row_groups[0], rank)
             
-        # Worry about activation later
-        # with torch.set_grad_enabled(True):
-        #     if func is F.log_softmax:
-        #         func_eval = dist_log_softmax2(z, rank, size, acc_per_rank, row_groups[rank_row])
-        #     elif func is F.relu:
-        #         func_eval = func(z)
-        #     else:
-        #         func_eval = z
-
-        #     # sigmap = torch.autograd.grad(outputs=func_eval, inputs=z,grad_outputs=grad_output)[0]
-        #     sigmap = torch.autograd.grad(outputs=func_eval, inputs=z,grad_outputs=grad_output)[0]
-        #     print(f"rank: {rank} sigmap: {sigmap}", flush=True)
-        #     grad_output = sigmap
+        if activations:
+            with torch.set_grad_enabled(True):
+                if func is F.log_softmax:
+                    grad_output = dist_log_softmax_backward(z, ctx.lse, grad_output, 
+                                                                row_groups[rank_row][rank_c])
+                elif func is F.relu:
+                    func_eval = func(z)
+                    sigmap = torch.autograd.grad(outputs=func_eval, inputs=z,grad_outputs=grad_output)[0]
+                    grad_output = sigmap
 
         tmp_summa_sparse_bcast2 = summa_sparse_bcast2
 
+        # Layer 0 on A * X: the features need no gradient, and the weight gradient is (A * X)^T * G,
+        # the backward below with A * X and G swapped and the transpose precomputed
+        if ctx.ax is not None:
+            ax_t = ctx.ax[2]
+            grad_weight = split3dspmm_dense(ax_t, grad_output, 
+                                    rank, rank_row, rank_col, rank_c, size, acc_per_rank, 
+                                    row_groups, col_groups, c_groups, weight.size(0), node_count, weight.size(1))
+
+            grad_weight_fin = torch.cuda.FloatTensor(weight.size(0), weight.size(1), 
+                                                        device=device).fill_(0)
+            row_off = rank_row * (weight.size(0) // proc_row) + rank_c * (ax_t.size(0) // proc_c)
+            col_off = rank_col * (weight.size(1) // proc_col)
+            grad_weight_fin[row_off:(row_off + grad_weight.size(0)), 
+                                col_off:(col_off + grad_weight.size(1))] = grad_weight
+
+            dist.all_reduce(grad_weight_fin, op=dist.reduce_op.SUM)
+            return None, grad_weight_fin, None, None, None, None, None, None, None, None, None, None, None, None, None
+
         # First backprop equation
         # TODO: will need to change height argument when n % sqrt(P) != 0 and non-square grid
         ag, chunk_sizes_loc = split3dspmm_sparse(adj_matrix, grad_output, 
@@ -973,7 +1054,8 @@ class GCNFunc(torch.autograd.Function):
         ag_t = transpose(ag, rank, node_count, weight.size(1), height_c, width_c, size, acc_per_rank, 
                                 c_groups, transpose_group)
 
-        transpose_time += stop_time(row_groups[0][0], rank, tstart_transpose)
+        transpose_time += stop_time(row_groups[0][0], rank, tstart_transpose, "transpose")
+        count_work("transpose", perf.message_work(ag_t))
 
         # grad_weight = summa(inputs_t, ag, rank, rank_row, rank_col, size, acc_per_rank, row_groups,
         #                         col_groups, weight.size(0), node_count, weight.size(1))
@@ -982,65 +1064,16 @@ class GCNFunc(torch.autograd.Function):
                                 row_groups, col_groups, c_groups, weight.size(1), node_count, weight.size(0))
         
         # tstart_grad_weight = start_time(row_groups[0], rank)
-        # Collect grad_weight's across processes
-        grad_weight_recv = []
-        # max_row_chunk = max(chunk_sizes_col) #transpose
-        # max_col_chunk = max(chunk_sizes_row)
-        max_row_chunk = max(chunk_sizes_row)
-        max_col_chunk = max(chunk_sizes_col)
-        for i in range(size):
-            grad_weight_recv.append(torch.cuda.FloatTensor(
-            # grad_weight_recv.append(torch.FloatTensor(
-                                                max_row_chunk,
-                                                max_col_chunk,
-                                                device=device))
-
-        # pad_row = math.ceil(float(weight.size(0)) / proc_row) - grad_weight.size(0)
-        # pad_col = math.ceil(float(weight.size(1)) / proc_col) - grad_weight.size(1)
-        pad_row = max_row_chunk - grad_weight.size(0)
-        pad_col = max_col_chunk - grad_weight.size(1)
-
-        # TODO: make this part less hacky
-        grad_weight = torch.cat((grad_weight, 
-                        torch.cuda.FloatTensor(pad_row, grad_weight.size(1), device=device).fill_(no_occur_val)), 
-                        # torch.FloatTensor(pad_row, grad_weight.size(1), device=device).fill_(no_occur_val)), 
-                        dim=0) 
-        grad_weight = torch.cat((grad_weight, 
-                        torch.cuda.FloatTensor(grad_weight.size(0), pad_col, device=device).fill_(no_occur_val)), 
-                        # torch.FloatTensor(grad_weight.size(0), pad_col, device=device).fill_(no_occur_val)), 
-                        dim=1) 
-
-        dist.all_gather(grad_weight_recv, grad_weight)
-
-        # for i in range(size):
-        #     if rank == i:
-        #         grad_weight_recv[i] = grad_weight
-        #     dist.broadcast(grad_weight_recv[i], i, group)
-        # grad_weight_recv[0] = grad_weight
-
-        for i in range(len(grad_weight_recv)):
-            grad_weight_recv[i] = grad_weight_recv[i][(grad_weight_recv[i][:, 0] != no_occur_val)
-                                                                .nonzero().squeeze(1)]
-
-            grad_weight_recv_t = grad_weight_recv[i].t()
-            grad_weight_recv_t = grad_weight_recv_t[(grad_weight_recv_t[:, 0] != no_occur_val)
-                                                                .nonzero().squeeze(1)]
-
-            grad_weight_recv[i] = grad_weight_recv_t.t()
-        
-        grad_weight_fin = torch.cuda.FloatTensor(device=device)
-        # grad_weight_fin = torch.FloatTensor(device=device)
-        for i in range(proc_row):
-            grad_weight_row = torch.cuda.FloatTensor(device=device)
-            # grad_weight_row = torch.FloatTensor(device=device)
-            for j in range(proc_col):
-                # grad_weight_col = torch.FloatTensor(device=device)
-                grad_weight_col = torch.cuda.FloatTensor(device=device)
-                for k in range(proc_c):
-                    rank_wt = i * proc_row * proc_c + j * proc_c + k
-                    grad_weight_col = torch.cat((grad_weight_col, grad_weight_recv[rank_wt]), dim=0)
-                grad_weight_row = torch.cat((grad_weight_row, grad_weight_col), dim=1)
-            grad_weight_fin = torch.cat((grad_weight_fin, grad_weight_row), dim=0)
+        # Collect grad_weight's across processes. Each rank's block lands at its offset in a
+        # zero buffer of the full (transposed) weight size, so a single all_reduce assembles it.
+        grad_weight_fin = torch.cuda.FloatTensor(weight.size(1), weight.size(0), 
+                                                    device=device).fill_(0)
+        row_off = rank_row * (weight.size(1) // proc_row) + rank_c * (ag_t.size(0) // proc_c)
+        col_off = rank_col * (weight.size(0) // proc_col)
+        grad_weight_fin[row_off:(row_off + grad_weight.size(0)), 
+                            col_off:(col_off + grad_weight.size(1))] = grad_weight
+
+        dist.all_reduce(grad_weight_fin, op=dist.reduce_op.SUM)
 
         # dur = stop_time(row_groups[0], rank, tstart)
         # bwd_time += dur
@@ -1049,10 +1082,10 @@ class GCNFunc(torch.autograd.Function):
         grad_weight_fin = grad_weight_fin.t()
 
         del ag
-        return grad_input, grad_weight_fin, None, None, None, None, None, None, None, None, None, None, None, None
+        return grad_input, grad_weight_fin, None, None, None, None, None, None, None, None, None, None, None, None, None
 
 def train(inputs, weight1, weight2, node_count, adj_matrix, am_partitions, optimizer, data, rank, 
-                size, acc_per_rank, group, row_groups, col_groups, transpose_group, c_groups):
+                size, acc_per_rank, group, row_groups, col_groups, transpose_group, c_groups, ax=None):
 
     global loss_calc_time
 
@@ -1060,11 +1093,11 @@ def train(inputs, weight1, weight2, node_count, adj_matrix, am_partitions, optim
 
     outputs = GCNFunc.apply(inputs, weight1, node_count, adj_matrix, am_partitions, rank, size, 
                                 acc_per_rank, group, row_groups, col_groups, transpose_group, c_groups, 
-                                F.relu)
+                                F.relu, ax)
 
     outputs = GCNFunc.apply(outputs, weight2, node_count, adj_matrix, am_partitions, rank, size, 
                                 acc_per_rank, group, row_groups, col_groups, transpose_group, c_groups, 
-                                F.log_softmax)
+                                F.log_softmax, None)
 
     proc_row = proc_row_size(size)
     proc_col = proc_col_size(size)
@@ -1117,7 +1150,7 @@ def train(inputs, weight1, weight2, node_count, adj_matrix, am_partitions, optim
         vertex_train_count = (data.train_mask.size(0) - (data.train_mask == 0).sum(dim=0))
         loss_calc = -loss_calc / vertex_train_count
 
-        loss_calc_time += stop_time(row_groups[0][0], rank, tstart_loss_calc)
+        loss_calc_time += stop_time(row_groups[0][0], rank, tstart_loss_calc, "loss_calc")
 
         loss_calc.backward()
 
@@ -1136,25 +1169,51 @@ def train(inputs, weight1, weight2, node_count, adj_matrix, am_partitions, optim
         # fake_loss = (outputs * torch.zeros(outputs.size())).sum()
         fake_loss.backward()
 
+    tstart_step = start_time(group, rank)
     optimizer.step()
+    stop_time(group, rank, tstart_step, "optimizer_step")
 
     return outputs
     # del outputs
 
-def test(outputs, data, vertex_count, rank):
-    logits, accs = outputs, []
-    datay_rank = torch.split(data.y, vertex_count)[rank]
+# Row-wise argmax of a matrix whose columns are split across group. Ties go to the lowest class.
+def dist_argmax(z, col_offset, classes, group):
+    maxes, pred = torch.max(z, dim=1)
+    pred += col_offset
+
+    maxes_glob = maxes.clone()
+    dist.all_reduce(maxes_glob, op=dist.reduce_op.MAX, group=group)
+
+    # Ranks that do not hold a row's max propose a class past the last one
+    pred[maxes != maxes_glob] = classes
+    dist.all_reduce(pred, op=dist.reduce_op.MIN, group=group)
+    return pred
+
+# Scores this rank's rows and classes, so only a handful of counts are reduced
+def test(outputs, data, col_offset, classes, row_group, col_group, c_group):
+    pred = dist_argmax(outputs.detach(), col_offset, classes, row_group)
+
+    # Every member of a row group holds the same predictions, so count over one column,
+    # then across the c replicas, which hold disjoint row chunks
+    counts = []
     for _, mask in data('train_mask', 'val_mask', 'test_mask'):
-        mask_rank = torch.split(mask, vertex_count)[rank]
-        count = mask_rank.nonzero().size(0)
-        if count > 0:
-            pred = logits[mask_rank].max(1)[1]
-            acc = pred.eq(datay_rank[mask_rank]).sum().item() / mask_rank.sum().item()
-            # pred = logits[mask].max(1)[1]
-            # acc = pred.eq(data.y[mask]).sum().item() / mask.sum().item()
+        counts.append(pred[mask].eq(data.y[mask]).sum())
+        counts.append(mask.sum())
+    counts = torch.stack(counts)
+    dist.all_reduce(counts, op=dist.reduce_op.SUM, group=col_group)
+    dist.all_reduce(counts, op=dist.reduce_op.SUM, group=c_group)
+    counts = counts.tolist()
+
+    accs = []
+    for i in range(0, len(counts), 2):
+        if counts[i + 1] > 0:
+            accs.append(counts[i] / counts[i + 1])
         else:
-            acc = -1
-        accs.append(acc)
+            accs.append(0)
+
+    if len(accs) != 3:
+        accs = accs + [0] * (3 - len(accs))
+
     return accs
 
 
@@ -1338,6 +1397,42 @@ def twod_partition(rank, size, inputs, adj_matrix, data, features, classes, devi
 
     return inputs_loc, adj_matrix_loc, am_pbyp
 
+# twod_partition for a generated graph. A is symmetric, so this rank generates the rows of its
+# block column as columns and keeps the edges landing in its block row, and only its block row of
+# the features. Normalization would need global degrees, so the values stay ones.
+def synthetic_partition(rank, size, node_count):
+    proc_row = proc_row_size(size)
+    proc_col = proc_col_size(size)
+    proc_c = proc_c_size(size)
+    n_per_proc = node_count // proc_row
+
+    rank_row = int((rank // proc_c) // proc_col) # i in process grid
+    rank_col = int((rank // proc_c) % proc_col)  # j in process grid
+
+    row_start = rank_row * n_per_proc
+    row_stop = node_count if rank_row == proc_row - 1 else row_start + n_per_proc
+    col_start = rank_col * n_per_proc
+    col_stop = node_count if rank_col == proc_col - 1 else col_start + n_per_proc
+
+    features = synth_graph.features
+    features_per_col = features // proc_col
+    feature_start = rank_col * features_per_col
+    feature_stop = features if rank_col == proc_col - 1 else feature_start + features_per_col
+
+    with torch.no_grad():
+        edge_index = synth_graph.edges(col_start, col_stop)
+        keep = (edge_index[1] >= row_start) & (edge_index[1] < row_stop)
+        adj_block = torch.stack([edge_index[1, keep] - row_start, edge_index[0, keep] - col_start])
+
+        adj_matrix_loc = torch.sparse_coo_tensor(adj_block, torch.ones(adj_block.size(1)), 
+                                                    size=(row_stop - row_start, col_stop - col_start),
+                                                    requires_grad=False)
+        inputs_loc = synth_graph.inputs(row_start, row_stop)[:, feature_start:feature_stop]
+
+    print(f"rank: {rank} adj_matrix_loc.size: {adj_matrix_loc.size()} nnz: {adj_block.size(1)}", 
+            flush=True)
+    return inputs_loc, adj_matrix_loc
+
 def threed_partition_loc(rank, size, inputs, adj_matrix, height, width, data, features, classes, device):
     proc_row = proc_row_size(size)
     proc_col = proc_col_size(size)
@@ -1459,6 +1554,33 @@ def threed_partition(rank, size, inputs, adj_matrix, data, features, classes, de
     print(f"rank: {rank} inputs_loc.size: {inputs_loc.size()}", flush=True)
     return inputs_loc, adj_matrix_loc, am_pbyp
 
+# Keep only the labels and masks of this rank's row chunk for the sharded evaluator
+def label_partition(rank, size, data, node_count, device):
+    proc_row = proc_row_size(size)
+    proc_col = proc_col_size(size)
+    proc_c = proc_c_size(size)
+
+    rank_row = int((rank // proc_c) // proc_col) # i in process grid
+    rank_col = int((rank // proc_c) % proc_col)  # j in process grid
+    rank_c = rank - (rank_row * (proc_col * proc_c) + rank_col * proc_c) # k in process grid
+
+    height_per_proc = node_count // proc_row
+    if rank_row == proc_row - 1:
+        height_per_proc = node_count - height_per_proc * (proc_row - 1)
+
+    # Row blocks are split again across c, the last chunk taking the remainder
+    height_per_proc_c = height_per_proc // proc_c
+    row_start = rank_row * (node_count // proc_row) + rank_c * height_per_proc_c
+    row_stop = row_start + height_per_proc_c
+    if rank_c == proc_c - 1:
+        row_stop = rank_row * (node_count // proc_row) + height_per_proc
+
+    data_loc = Data()
+    data_loc.y = data.y[row_start:row_stop].long().to(device)
+    for key, mask in data('train_mask', 'val_mask', 'test_mask'):
+        data_loc[key] = mask[row_start:row_stop].bool().to(device)
+    return data_loc
+
 def rank_to_devid(rank, acc_per_rank):
     return rank % acc_per_rank
 
@@ -1467,10 +1589,13 @@ def run(rank, size, inputs, adj_matrix, data, features, mid_layer, classes, devi
     global comp_time
     global epochs
     global timing
+    global tracer
 
+    node_count = synth_graph.nodes if synth_graph is not None else inputs.size(0)
     best_val_acc = test_acc = 0
     outputs = None
 
+    tstart = time.time()
     group = dist.new_group(list(range(size)))
     row_groups, col_groups, c_groups = get_proc_groups(rank, size, group)
 
@@ -1478,6 +1603,11 @@ def run(rank, size, inputs, adj_matrix, data, features, mid_layer, classes, devi
     proc_col = proc_col_size(size)
     proc_c = proc_c_size(size)
 
+    # The c groups all-reduce every SpMM's partial sums and should stay on a node
+    node_of = topology.node_ids(size, device)
+    topology.check_local([list(range(i, i + proc_c)) for i in range(0, size, proc_c)], node_of, "c", 
+                            rank)
+
     rank_row = int((rank // proc_c) // proc_col) # i in process grid
     rank_col = int((rank // proc_c) % proc_col)  # j in process grid
     rank_c = rank - (rank_row * (proc_col * proc_c) + rank_col * proc_c) # k in process grid
@@ -1487,6 +1617,7 @@ def run(rank, size, inputs, adj_matrix, data, features, mid_layer, classes, devi
 
     rank_t = rank_col * proc_col * proc_c + rank_row * proc_c + rank_c
 
+    # Each rank is in one transpose pair, with local synchronization it only builds that one
     transpose_groups = []
     transpose_group = None
 
@@ -1499,7 +1630,7 @@ def run(rank, size, inputs, adj_matrix, data, features, mid_layer, classes, devi
                 local_rank_t = j * proc_col * proc_c + i * proc_c + k
 
                 if local_rank < local_rank_t:
-                    transpose_groups_col.append(dist.new_group([local_rank, local_rank_t]))
+                    transpose_groups_col.append(topology.new_group([local_rank, local_rank_t], rank))
                 else:
                     transpose_groups_col.append(None)
             transpose_groups_row.append(transpose_groups_col)
@@ -1509,6 +1640,7 @@ def run(rank, size, inputs, adj_matrix, data, features, mid_layer, classes, devi
         transpose_group = transpose_groups[rank_row][rank_col][rank_c]
     else:
         transpose_group = transpose_groups[rank_col][rank_row][rank_c]
+    startup["groups"] = time.time() - tstart
 
     # adj_matrix_loc = torch.rand(node_count, n_per_proc)
     # inputs_loc = torch.rand(n_per_proc, inputs.size(1))
@@ -1527,47 +1659,184 @@ def run(rank, size, inputs, adj_matrix, data, features, mid_layer, classes, devi
 
     optimizer = torch.optim.Adam([weight1, weight2], lr=0.01)
 
+    ckpt_writer = None
+    if ckpt_dir is not None and ckpt_every > 0:
+        ckpt_writer = checkpoint.CheckpointWriter(ckpt_dir, rank, device, ckpt_queue)
+
+    start_epoch = 1
+    best = None
+    if resume:
+        ckpt = checkpoint.load(ckpt_dir, rank)
+        if ckpt is not None:
+            best = checkpoint.restore(ckpt, [weight1, weight2], optimizer, device)
+            start_epoch = ckpt["epoch"] + 1
+
+    if inference and ckpt_dir is not None:
+        checkpoint.load_weights(ckpt_dir, [weight1, weight2])
+
     # inputs_loc, adj_matrix_loc, _ = threed_partition(rank, size, inputs, adj_matrix, data, features,
     #                                                     classes, device)
-    print(f"Before partitioning...", flush=True)
-    inputs_loc, adj_matrix_loc, _ = twod_partition(rank, size, inputs, adj_matrix, data, features,
-                                                        classes, device)
-    adj_matrix_loc = adj_matrix_loc.coalesce()
-
-    inputs_loc, adj_matrix_loc = threed_partition_loc(rank, size, inputs_loc, adj_matrix_loc.indices(), 
-                                                                adj_matrix_loc.size(0), adj_matrix_loc.size(1),
-                                                                data, features, classes, device)
-    print(f"After partitioning...", flush=True)
+    tstart = time.time()
+    partition = None
+    if resume:
+        partition = checkpoint.load_partition(ckpt_dir, rank)
+
+    if partition is None:
+        print(f"Before partitioning...", flush=True)
+        if synth_graph is not None:
+            inputs_loc, adj_matrix_loc = synthetic_partition(rank, size, node_count)
+        else:
+            inputs_loc, adj_matrix_loc, _ = twod_partition(rank, size, inputs, adj_matrix, data, 
+                                                                features, classes, device)
+        adj_matrix_loc = adj_matrix_loc.coalesce()
+
+        inputs_loc, adj_matrix_loc = threed_partition_loc(rank, size, inputs_loc, adj_matrix_loc.indices(), 
+                                                                    adj_matrix_loc.size(0), adj_matrix_loc.size(1),
+                                                                    data, features, classes, device)
+        print(f"After partitioning...", flush=True)
+        if ckpt_dir is not None:
+            checkpoint.save_partition(ckpt_dir, rank, (inputs_loc, adj_matrix_loc))
+    else:
+        inputs_loc, adj_matrix_loc = partition
 
     adj_matrix_loc = adj_matrix_loc.coalesce()
 
     inputs_loc = inputs_loc.to(device)
     adj_matrix_loc = adj_matrix_loc.to(device)
 
-    print(f"rank: {rank} Before first epoch...", flush=True)
+    split3dspmm_sparse_setup(adj_matrix_loc, rank, rank_row, rank_c, size, acc_per_rank, row_groups)
+
+    startup["partition"] = time.time() - tstart
+    print(f"rank: {rank} startup: {startup} total: {time.time() - startup_tstart}s", flush=True)
+
+    # Stage k multiplies the A block of column k of this rank's grid row and layer
+    stages = [(acol_nnzs[k], adj_matrix_loc.size(0), adj_matrix_loc.size(1)) for k in range(proc_col)]
+    perf.balance(rank, group, stages, features, mem_bandwidth, imbalance, device)
+
+    if accuracy or eval_every > 0:
+        data_loc = label_partition(rank, size, data, node_count, device)
+
+    # The features never change, so A * X and its transpose are computed once, untimed
+    ax = None
+    if precompute_ax:
+        timing_on = timing == True
+        timing = False
+        with torch.no_grad():
+            ax, chunk_sizes_loc = split3dspmm_sparse(adj_matrix_loc, inputs_loc, 
+                                                        rank, rank_row, rank_col, rank_c, size, acc_per_rank, 
+                                                        row_groups, col_groups, c_groups, 
+                                                        node_count, node_count, features)
+
+            height_c = node_count // proc_row
+            if rank_row == proc_row - 1:
+                height_c = node_count - height_c * (proc_row - 1)
+
+            width_c = features // proc_col
+            if rank_col == proc_col - 1:
+                width_c = features - width_c * (proc_col - 1)
+
+            ax_t = transpose(ax, rank, node_count, features, height_c, width_c, size, acc_per_rank, 
+                                c_groups, transpose_group)
+        ax = (ax, chunk_sizes_loc, ax_t)
+        if timing_on:
+            timing = True
+
+    # One forward pass and no training in inference
+    if inference:
+        dist.barrier(group)
+        torch.cuda.reset_peak_memory_stats(device)
+        tstart = time.time()
+        outputs = forward(inputs_loc, [weight1, weight2], node_count, adj_matrix_loc, rank, size, 
+                            acc_per_rank, row_groups, col_groups, c_groups, layer_count, ax)
+        torch.cuda.synchronize(device=device)
+        print(f"rank: {rank} inference_time: {time.time() - tstart} " \
+                f"peak_memory: {torch.cuda.max_memory_allocated(device) / 2**20}MB", flush=True)
+
+        if out_dir is not None:
+            height_per_proc = node_count // proc_row
+            if rank_row == proc_row - 1:
+                height_per_proc = node_count - height_per_proc * (proc_row - 1)
+            row_start = rank_row * (node_count // proc_row) + rank_c * (height_per_proc // proc_c)
+
+            width = [weight1, weight2][:layer_count][-1].size(1)
+            col_start = rank_col * (width // proc_col)
+            pred = None
+            if layer_count is None:
+                pred = dist_argmax(outputs, col_start, classes, row_groups[rank_row][rank_c])
+            checkpoint.save_outputs(out_dir, rank, outputs, row_start, col_start, pred)
+
+        return outputs
+
     # Do not time first epoch
-    timing_on = timing == True
-    timing = False
-    outputs = train(inputs_loc, weight1, weight2, inputs.size(0), adj_matrix_loc, None, 
-                            optimizer, data, rank, size, acc_per_rank, group, row_groups, 
-                            col_groups, transpose_group, c_groups)
-    print(f"After first epoch...", flush=True)
-
-    if timing_on:
-        timing = True
+    # The warm-up epoch also steps the optimizer, a resumed run already did it
+    if start_epoch == 1:
+        print(f"rank: {rank} Before first epoch...", flush=True)
+        timing_on = timing == True
+        timing = False
+        outputs = train(inputs_loc, weight1, weight2, node_count, adj_matrix_loc, None, 
+                                optimizer, data, rank, size, acc_per_rank, group, row_groups, 
+                                col_groups, transpose_group, c_groups, ax)
+        print(f"After first epoch...", flush=True)
+
+        if timing_on:
+            timing = True
 
     dist.barrier(group)
-    if rank == 0:
-        tstart = time.time()
+    # The trace clock starts at the barrier before the first timed run, on every rank at once
+    if trace_path is not None and tracer is None:
+        tracer = timeline.Timeline(trace_path, rank)
+    # Every rank times the run for the perf report
+    tstart = time.time()
 
     print(f"rank: {rank} Starting training...", flush=True)
-    for epoch in range(1, epochs):
-        if rank == 0:
-            tstart_epoch = time.time()
-
-        outputs = train(inputs_loc, weight1, weight2, inputs.size(0), adj_matrix_loc, None, 
+    best_val_acc = test_acc = 0
+    best_weights = None
+    bad_evals = 0
+    # A resumed run continues the early stopping of the checkpointed one
+    if best is not None:
+        best_weights = best["weights"]
+        best_val_acc = best["val_acc"]
+        test_acc = best["test_acc"]
+        bad_evals = best["bad_evals"]
+    for epoch in range(start_epoch, epochs):
+        tstart_epoch = time.time()
+
+        # The outputs of an epoch come from the weights before its optimizer step
+        eval_epoch = eval_every > 0 and epoch % eval_every == 0
+        if eval_epoch:
+            weights_pre = [w.detach().clone() for w in [weight1, weight2]]
+
+        outputs = train(inputs_loc, weight1, weight2, node_count, adj_matrix_loc, None, 
                                 optimizer, data, rank, size, acc_per_rank, group, row_groups, 
-                                col_groups, transpose_group, c_groups)
+                                col_groups, transpose_group, c_groups, ax)
+
+        if eval_epoch:
+            train_acc, val_acc, tmp_test_acc = test(outputs, data_loc, rank_col * (classes // proc_col), 
+                                                    classes, row_groups[rank_row][rank_c], 
+                                                    col_groups[rank_col][rank_c], 
+                                                    c_groups[int(rank // proc_c)])
+            log = 'Epoch: {:03d}, Train: {:.4f}, Val: {:.4f}, Test: {:.4f}'
+            print(log.format(epoch, train_acc, val_acc, tmp_test_acc), flush=True)
+
+            # val_acc is globally reduced, so every rank takes the same early-stopping decision
+            if val_acc > best_val_acc:
+                best_val_acc = val_acc
+                test_acc = tmp_test_acc
+                best_weights = weights_pre
+                bad_evals = 0
+            else:
+                bad_evals += 1
+                if patience > 0 and bad_evals >= patience:
+                    print(f"rank: {rank} early stop at epoch {epoch} best val: {best_val_acc}", 
+                            flush=True)
+                    break
+
+        if ckpt_writer is not None and epoch % ckpt_every == 0:
+            ckpt_writer.save(0, epoch, [weight1, weight2], optimizer, dict(weights=best_weights, 
+                        val_acc=best_val_acc, test_acc=test_acc, bad_evals=bad_evals))
+
+        if tracer is not None:
+            tracer.event(f"epoch {epoch}", tstart_epoch, tid=timeline.epoch_tid, cat="epoch")
 
         # sync_and_sleep(rank, device)
         if rank == 0:
@@ -1599,9 +1868,28 @@ def run(rank, size, inputs, adj_matrix, data, features, mid_layer, classes, devi
             # print(f"summa_time: {summa_time}")
             print("Epoch: {:03d}".format(epoch), flush=True)
 
+    # Keep the best weights seen by the periodic evaluation
+    if best_weights is not None:
+        with torch.no_grad():
+            for w, w_best in zip([weight1, weight2], best_weights):
+                w.copy_(w_best)
+
+    # The outputs so far came from the last epoch's weights, and a resumed run with no epochs
+    # left has none.
+    if best_weights is not None or outputs is None:
+        timing_on = timing == True
+        timing = False
+        with torch.no_grad():
+            outputs = forward(inputs_loc, [weight1, weight2], node_count, adj_matrix_loc, rank, 
+                                size, acc_per_rank, row_groups, col_groups, c_groups, None, ax)
+        if timing_on:
+            timing = True
+
+    if ckpt_writer is not None:
+        ckpt_writer.close()
     dist.barrier()
+    tstop = time.time()
     if rank == 0:
-        tstop = time.time()
         print("Time: " + str(tstop - tstart))
 
     if rank == 0:
@@ -1628,22 +1916,34 @@ def run(rank, size, inputs, adj_matrix, data, features, mid_layer, classes, devi
         print(f"summa_sparse_time: {summa_sparse_time}")
         print(f"summa_time: {summa_time}")
         print(f"summa_loc_time: {summa_loc_time}")
-    
-    # All-gather outputs to test accuracy
-    # output_parts = []
-    # for i in range(size):
-    #     output_parts.append(torch.cuda.FloatTensor(am_partitions[0].size(1), classes).fill_(0))
 
-    # dist.all_gather(output_parts, outputs)
-    # outputs = torch.cat(output_parts, dim=0)
-
-    # train_acc, val_acc, tmp_test_acc = test(outputs, data, am_partitions[0].size(1), rank)
-    # if val_acc > best_val_acc:
-    #     best_val_acc = val_acc
-    #     test_acc = tmp_test_acc
-    # log = 'Epoch: {:03d}, Train: {:.4f}, Val: {:.4f}, Test: {:.4f}'
-
-    # print(log.format(200, train_acc, best_val_acc, test_acc))
+    # Phase timers are only filled with --timing
+    if timing:
+        phases = dict(summa_sparse_bcast1=summa_sparse_bcast1, summa_sparse_bcast2=summa_sparse_bcast2,
+                        summa_sparse_comp=summa_sparse_comp, summa_sparse_reduce=summa_sparse_reduce,
+                        summa_bcast1=summa_bcast1, summa_bcast2=summa_bcast2, summa_comp=summa_comp,
+                        summa_reduce=summa_reduce, transpose=transpose_time)
+        perf.report(rank, group, phases, work, tstop - tstart, device)
+    
+    # Every rank writes its part of the trace, rank 0 merges them
+    if tracer is not None:
+        tracer.write()
+        dist.barrier(group)
+        if rank == 0:
+            timeline.merge(trace_path, dist.get_world_size(group))
+            print(f"trace: {trace_path}", flush=True)
+
+    if accuracy:
+        train_acc, val_acc, tmp_test_acc = test(outputs, data_loc, rank_col * (classes // proc_col), 
+                                                    classes, row_groups[rank_row][rank_c], 
+                                                    col_groups[rank_col][rank_c], 
+                                                    c_groups[int(rank // proc_c)])
+        if val_acc > best_val_acc:
+            best_val_acc = val_acc
+            test_acc = tmp_test_acc
+        log = 'Epoch: {:03d}, Train: {:.4f}, Val: {:.4f}, Test: {:.4f}'
+
+        print(log.format(epochs, train_acc, best_val_acc, test_acc))
     print(f"rank: {rank} {outputs}")
     return outputs
 
@@ -1663,12 +1963,17 @@ def main():
     path = osp.join(osp.dirname(osp.realpath(__file__)), '..', 'data', graphname)
 
     # mid_layer = 16
+    tstart = time.time()
     if graphname == 'Cora':
+        from torch_geometric.datasets import Planetoid
+        import torch_geometric.transforms as T
         dataset = Planetoid(path, graphname, T.NormalizeFeatures())
         data = dataset[0]
         num_features = dataset.num_features
         num_classes = dataset.num_classes
     elif graphname == 'Reddit':
+        from reddit import Reddit
+        import torch_geometric.transforms as T
         dataset = Reddit(path, T.NormalizeFeatures())
         data = dataset[0]
         num_features = dataset.num_features
@@ -1716,10 +2021,29 @@ def main():
         data = Data()
         data.y = torch.rand(n).uniform_(0, num_classes - 1)
         data.train_mask = torch.ones(n).long()
+    elif synth_graph is not None:
+        # Each rank generates only its own block of A and of the features in run(). The loss
+        # indexes the labels and train mask globally, so those are built for the whole graph.
+        if normalization:
+            print(f"normalization is not applied to generated graphs", flush=True)
+        n = synth_graph.nodes
+        edge_index = None
+        num_features = synth_graph.features
+        num_classes = synth_graph.classes
+        inputs = None
+        data = Data()
+        data.y = synth_graph.labels(0, n)
+        masks = synth_graph.masks(0, n)
+        for key, mask in zip(['train_mask', 'val_mask', 'test_mask'], masks):
+            data[key] = mask.long()
+
+    startup["load"] = time.time() - tstart
 
     if "OMPI_COMM_WORLD_RANK" in os.environ.keys():
         os.environ["RANK"] = os.environ["OMPI_COMM_WORLD_RANK"]
-    dist.init_process_group(backend='nccl')
+    tstart = time.time()
+    dist.init_process_group(backend=backend)
+    startup["init"] = time.time() - tstart
     # dist.init_process_group('gloo', init_method='env://')
     rank = dist.get_rank()
     size = dist.get_world_size()
@@ -1753,6 +2077,9 @@ def main():
         data = data.to(device)
         # inputs.requires_grad = True
         data.y = data.y.to(device)
+    elif synth_graph is not None:
+        data = data.to(device)
+        data.y = data.y.to(device)
     else:
         data = data.to(device)
         # data.x.requires_grad = True
@@ -1763,7 +2090,9 @@ def main():
         edge_index = data.edge_index
         print("edge count: " + str(len(edge_index[0])))
 
-    if normalization:
+    if synth_graph is not None:
+        adj_matrix = None
+    elif normalization:
         adj_matrix, _ = add_remaining_self_loops(edge_index)
     else:
         adj_matrix = edge_index
@@ -1785,7 +2114,30 @@ if __name__ == '__main__':
     parser.add_argument("--epochs", type=int)
     parser.add_argument("--graphname", type=str)
     parser.add_argument("--timing", type=str)
+    parser.add_argument("--trace", type=str, default=None)
+    parser.add_argument("--imbalance", type=float, default=1.5)
+    parser.add_argument("--membw", type=float, default=900.)
     parser.add_argument("--midlayer", type=int)
+    parser.add_argument("--activations", type=str)
+    parser.add_argument("--accuracy", type=str)
+    parser.add_argument("--cacheadj", type=int)
+    parser.add_argument("--evalevery", type=int, default=0)
+    parser.add_argument("--patience", type=int, default=0)
+    parser.add_argument("--checkpoint", type=str, default=None)
+    parser.add_argument("--ckptevery", type=int, default=0)
+    parser.add_argument("--ckptqueue", type=int, default=2)
+    parser.add_argument("--resume", type=str, default="False")
+    parser.add_argument("--inference", type=str, default="False")
+    parser.add_argument("--outdir", type=str, default=None)
+    parser.add_argument("--embedlayer", type=int, default=0)
+    parser.add_argument("--precomputeax", type=str, default="False")
+    parser.add_argument("--backend", type=str, default="nccl")
+    parser.add_argument("--nodes", type=int, default=1 << 20)
+    parser.add_argument("--degree", type=int, default=16)
+    parser.add_argument("--skew", type=str, default=synthetic.default_skew)
+    parser.add_argument("--features", type=int, default=128)
+    parser.add_argument("--classes", type=int, default=16)
+    parser.add_argument("--seed", type=int, default=0)
     args = parser.parse_args()
     print(args)
 
@@ -1796,12 +2148,47 @@ if __name__ == '__main__':
     epochs = args.epochs
     graphname = args.graphname
     timing = args.timing == "True"
+    trace_path = args.trace
+    imbalance = args.imbalance
+    mem_bandwidth = args.membw
+    # The trace records the phase timers
+    if trace_path is not None:
+        timing = True
     mid_layer = args.midlayer
+    activations = args.activations == "True"
+    accuracy = args.accuracy == "True"
+    eval_every = args.evalevery
+    patience = args.patience
+    ckpt_dir = args.checkpoint
+    ckpt_every = args.ckptevery
+    ckpt_queue = args.ckptqueue
+    resume = args.resume == "True" and ckpt_dir is not None
+    inference = args.inference == "True"
+    out_dir = args.outdir
+    if args.embedlayer > 0:
+        layer_count = args.embedlayer
+    precompute_ax = args.precomputeax == "True"
+    backend = args.backend
+    if graphname == "rmat" or graphname == "er":
+        synth_graph = synthetic.Graph(graphname, args.nodes, args.degree, args.skew, args.features, 
+                                        args.classes, args.seed)
+    if args.cacheadj is not None:
+        cache_adj = args.cacheadj
 
     if (epochs is None) or (graphname is None) or (timing is None) or (mid_layer is None):
         print(f"Error: missing argument {epochs} {graphname} {timing} {mid_layer}")
         exit()
 
-    print(f"Arguments: epochs: {epochs} graph: {graphname} timing: {timing} mid: {mid_layer}")
+    # Inference runs the trained weights of --checkpoint, without them it would score random ones
+    if inference and ckpt_dir is None:
+        print(f"Error: --inference=True needs the trained weights of --checkpoint")
+        exit()
+
+    # Inference embeddings are hidden features, not class scores to take the accuracy of
+    if inference and accuracy and layer_count is not None:
+        print(f"Error: --accuracy=True scores class predictions and cannot be used with --embedlayer")
+        exit()
+
+    print(f"Arguments: epochs: {epochs} graph: {graphname} timing: {timing} mid: {mid_layer} act: {activations} acc: {accuracy}")
     
     print(main())
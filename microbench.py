@@ -0,0 +1,230 @@
+import argparse
+import math
+import os
+import time
+
+import torch
+import torch.distributed as dist
+
+import topology
+
+# Microbenchmarks of the local SpMM, the dense GEMMs and the collectives of each algorithm, at the
+# sizes a graph with --nodes vertices and --degree average degree produces on this process count.
+# Blocks are uniformly random, so each holds its area's share of the nonzeros.
+
+device = None
+iters = 20
+warmup = 3
+groups = dict() # rank lists -> process group, every rank creates every group in the same order
+
+def sync():
+    if device.type == "cuda":
+        torch.cuda.synchronize(device)
+
+# Mean seconds per call of fn, the max over all ranks
+def timed(fn):
+    for i in range(warmup):
+        fn()
+    sync()
+    dist.barrier()
+    tstart = time.time()
+    for i in range(iters):
+        fn()
+    sync()
+    dur = torch.tensor([(time.time() - tstart) / iters], device=device)
+    dist.all_reduce(dur, op=dist.reduce_op.MAX)
+    return dur.item()
+
+# Groups of k consecutive ranks
+def consecutive(size, k):
+    return [list(range(i, i + k)) for i in range(0, size - size % k, k)]
+
+# Groups of k ranks stride apart, within each run of k * stride ranks
+def strided(size, k, stride):
+    procs = []
+    for start in range(0, size - size % (k * stride), k * stride):
+        for i in range(stride):
+            procs.append(list(range(start + i, start + k * stride, stride)))
+    return procs
+
+def get_group(ranks, rank):
+    key = tuple(ranks)
+    if key not in groups:
+        groups[key] = topology.new_group(ranks, rank)
+    return groups[key]
+
+# Local SpMM, GEMM and collective shapes of an algorithm, or None when it cannot run on size ranks.
+# Collectives are (name, op, groups, elements) with every group running at once.
+def shapes(algorithm, size, n, nnz, f, h, c):
+    if algorithm == "1d":
+        rows = n // size
+        return dict(spmm=(rows, rows, f), gemm=(rows, f, h),
+                        colls=[("bcast", "broadcast", [list(range(size))], rows * f),
+                                ("weight_allreduce", "all_reduce", [list(range(size))], f * h)])
+    if algorithm == "15d":
+        if c > size:
+            return None
+        # Ranks past the last full block row of c replicas stay idle
+        active = (size // c) * c
+        rows = n * c // active
+        return dict(spmm=(rows, rows, f), gemm=(rows, f, h),
+                        colls=[("col_bcast", "broadcast", strided(active, active // c, c), rows * f),
+                                ("row_allreduce", "all_reduce", consecutive(active, c), rows * f)])
+    if algorithm == "2d":
+        s = int(round(math.sqrt(size)))
+        if s * s != size:
+            return None
+        rows = n // s
+        # A blocks go out as rowptr, colind and values, about three words per nonzero
+        return dict(spmm=(rows, rows, f // s), gemm=(rows, f // s, h // s),
+                        colls=[("dense_bcast", "broadcast", consecutive(size, s), rows * (f // s)),
+                                ("sparse_bcast", "broadcast", strided(size, s, s), 3 * nnz // size)])
+    if algorithm == "3d":
+        q = int(round(size ** (1. / 3.)))
+        if q ** 3 != size:
+            return None
+        rows = n // q
+        mid = n // (q * q)
+        return dict(spmm=(rows, mid, f // q), gemm=(rows, f // q, h // q),
+                        colls=[("row_bcast", "broadcast", strided(size, q, q), mid * (f // q)),
+                                ("c_allreduce", "all_reduce", consecutive(size, q), rows * (f // q))])
+
+# Random CSR block with int32 offsets and columns
+def random_csr(rows, cols, nnz):
+    row = torch.randint(rows, (nnz,), device=device)
+    col = torch.randint(cols, (nnz,), device=device)
+    row, order = torch.sort(row)
+    col = col[order]
+    rowptr = torch.zeros(rows + 1, dtype=torch.long, device=device)
+    rowptr[1:] = torch.cumsum(torch.bincount(row, minlength=rows), dim=0)
+    return row, rowptr.int(), col.int()
+
+def bench_spmm(rows, cols, width, nnz):
+    row, rowptr, col = random_csr(rows, cols, nnz)
+    b = torch.rand(cols, width, device=device)
+    z = torch.zeros(rows, width, device=device)
+
+    if device.type == "cuda":
+        from sparse_coo_tensor_cpp import spmm_csr_gpu
+        values = torch.ones(nnz, device=device)
+        fn = lambda: spmm_csr_gpu(rowptr, col, values, rows, cols, b, z)
+    else:
+        a = torch.sparse_coo_tensor(torch.stack([row, col.long()]), torch.ones(nnz), 
+                                        size=(rows, cols)).coalesce()
+        fn = lambda: torch.sparse.mm(a, b)
+
+    dur = timed(fn)
+    # Compulsory traffic: the CSR arrays, B read once, and C read and written
+    words = (rows + 1) + nnz + cols * width + 2 * rows * width
+    return dur, 2. * nnz * width, 4. * words
+
+def bench_gemm(m, k, n):
+    a = torch.rand(m, k, device=device)
+    b = torch.rand(k, n, device=device)
+    dur = timed(lambda: torch.mm(a, b))
+    return dur, 2. * m * k * n, 4. * (m * k + k * n + m * n)
+
+def bench_coll(op, procs, elements, rank):
+    my_ranks = None
+    for ranks in procs:
+        group = get_group(ranks, rank)
+        if rank in ranks:
+            my_ranks, my_group = ranks, group
+
+    if my_ranks is None:
+        return timed(lambda: None), 0
+    buf = torch.rand(max(elements, 1), device=device)
+    if op == "broadcast":
+        fn = lambda: dist.broadcast(buf, src=my_ranks[0], group=my_group)
+    else:
+        fn = lambda: dist.all_reduce(buf, group=my_group)
+    return timed(fn), len(my_ranks)
+
+def report(rank, name, dur, flops, nbytes, extra=""):
+    if rank == 0:
+        gflops = f" GFLOP/s: {flops / dur / 1e9:.2f}" if flops > 0 else ""
+        print(f"{name}{extra} time: {dur * 1e3:.3f}ms{gflops} GB/s: {nbytes / dur / 1e9:.2f}",
+                flush=True)
+
+def main():
+    global device
+
+    dist.init_process_group(backend=backend)
+    rank = dist.get_rank()
+    size = dist.get_world_size()
+
+    if device_type == "cuda":
+        device = torch.device(f"cuda:{rank % acc_per_rank}")
+        torch.cuda.set_device(device)
+    else:
+        device = torch.device("cpu")
+
+    nnz = node_count * degree
+    if rank == 0:
+        print(f"Processes: {size} device: {device.type} backend: {backend} nodes: {node_count} " \
+                f"nnz: {nnz}", flush=True)
+
+    for algorithm in algorithms:
+        for f in widths:
+            shape = shapes(algorithm, size, node_count, nnz, f, mid_layer, replication)
+            if shape is None:
+                if rank == 0:
+                    print(f"{algorithm}: no process grid for {size} ranks", flush=True)
+                break
+
+            rows, cols, width = shape["spmm"]
+            block_nnz = max(1, int(nnz * (float(rows) / node_count) * (float(cols) / node_count)))
+            dur, flops, nbytes = bench_spmm(rows, cols, max(width, 1), block_nnz)
+            report(rank, f"{algorithm} spmm", dur, flops, nbytes,
+                    f" rows: {rows} cols: {cols} nnz: {block_nnz} width: {width}")
+
+            m, k, n = shape["gemm"]
+            dur, flops, nbytes = bench_gemm(m, max(k, 1), max(n, 1))
+            report(rank, f"{algorithm} gemm", dur, flops, nbytes, f" m: {m} k: {k} n: {n}")
+
+            for name, op, procs, elements in shape["colls"]:
+                dur, group_size = bench_coll(op, procs, elements, rank)
+                # Bus bandwidth as in nccl-tests, an all_reduce moves 2(p - 1)/p of the buffer
+                nbytes = 4. * elements
+                if op == "all_reduce" and group_size > 1:
+                    nbytes *= 2. * (group_size - 1) / group_size
+                report(rank, f"{algorithm} {name}", dur, 0, nbytes,
+                        f" {op} group: {len(procs[0])} words: {elements} width: {f}")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--local_rank", type=int)
+    parser.add_argument("--accperrank", type=int, default=1)
+    parser.add_argument("--device", type=str, default=None)
+    parser.add_argument("--backend", type=str, default=None)
+    parser.add_argument("--algorithms", type=str, default="1d,15d,2d,3d")
+    parser.add_argument("--nodes", type=int, default=1 << 20)
+    parser.add_argument("--degree", type=int, default=16)
+    parser.add_argument("--features", type=str, default="16,128,512")
+    parser.add_argument("--midlayer", type=int, default=16)
+    parser.add_argument("--replication", type=int, default=1)
+    parser.add_argument("--iters", type=int, default=20)
+    parser.add_argument("--warmup", type=int, default=3)
+    args = parser.parse_args()
+
+    device_type = args.device
+    if device_type is None:
+        device_type = "cuda" if torch.cuda.is_available() else "cpu"
+    backend = args.backend
+    if backend is None:
+        backend = "nccl" if device_type == "cuda" else "gloo"
+
+    acc_per_rank = args.accperrank
+    algorithms = args.algorithms.split(",")
+    node_count = args.nodes
+    degree = args.degree
+    widths = [int(f) for f in args.features.split(",")]
+    mid_layer = args.midlayer
+    replication = args.replication
+    iters = args.iters
+    warmup = args.warmup
+
+    if "OMPI_COMM_WORLD_RANK" in os.environ.keys():
+        os.environ["RANK"] = os.environ["OMPI_COMM_WORLD_RANK"]
+
+    main()
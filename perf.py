@@ -0,0 +1,133 @@
+import torch
+import torch.distributed as dist
+
+# Work counted next to the phase timers, so each phase's achieved rate is its counted flops and
+# bytes over its timed seconds. Compute phases count their compulsory traffic (operands read once,
+# results read and written once), communication phases the size of the messages they send.
+
+def spmm_work(nnz, rows, cols, width):
+    return 2. * nnz * width, 4. * ((rows + 1) + nnz + cols * width + 2 * rows * width)
+
+def gemm_work(m, k, n):
+    return 2. * m * k * n, 4. * (m * k + k * n + m * n)
+
+def message_work(tensor):
+    return 0., float(tensor.numel() * tensor.element_size())
+
+# Counted flops and bytes of each phase in one run on one rank
+class Counts:
+    def __init__(self):
+        self.flops = dict()
+        self.nbytes = dict()
+
+    def add(self, phase, work):
+        flops, nbytes = work
+        self.flops[phase] = self.flops.get(phase, 0.) + flops
+        self.nbytes[phase] = self.nbytes.get(phase, 0.) + nbytes
+
+# Summary of one run over the ranks of group. phases maps a phase name to this rank's seconds in it
+# and total is this rank's run time. Rank 0 prints for each phase the slowest and mean rank's
+# seconds, the load imbalance (max / mean) of its time and of its counted flops or bytes, the share
+# of the run the slowest rank spends in it, and the achieved GFLOP/s and GB/s per rank, with the
+# flops per byte telling compute-bound phases from bandwidth-bound ones.
+def report(rank, group, phases, counts, total, device):
+    names = list(phases.keys())
+    local = [total] + [phases[p] for p in names] + [counts.flops.get(p, 0.) for p in names] + \
+                [counts.nbytes.get(p, 0.) for p in names]
+    vmax = torch.tensor(local, dtype=torch.double, device=device)
+    vsum = vmax.clone()
+    dist.all_reduce(vmax, op=dist.reduce_op.MAX, group=group)
+    dist.all_reduce(vsum, op=dist.reduce_op.SUM, group=group)
+    vmax = vmax.tolist()
+    vsum = vsum.tolist()
+
+    if rank != 0:
+        return
+
+    ranks = dist.get_world_size(group)
+    count = len(names)
+    total_max = vmax[0]
+    print(f"perf: ranks: {ranks} total_time: {total_max:.4f}s", flush=True)
+    for i, name in enumerate(names):
+        t_max, t_sum = vmax[1 + i], vsum[1 + i]
+        f_max, f_sum = vmax[1 + count + i], vsum[1 + count + i]
+        b_max, b_sum = vmax[1 + 2 * count + i], vsum[1 + 2 * count + i]
+        t_mean = t_sum / ranks
+
+        line = f"perf: {name} max: {t_max:.4f}s mean: {t_mean:.4f}s"
+        if t_mean > 0:
+            line += f" imbalance: {t_max / t_mean:.2f}"
+        # The work imbalance is the flops' for compute phases, the bytes' for communication
+        w_max, w_sum = (f_max, f_sum) if f_sum > 0 else (b_max, b_sum)
+        if w_sum > 0:
+            line += f" work_imbalance: {w_max / (w_sum / ranks):.2f}"
+        if total_max > 0:
+            line += f" critical: {100. * t_max / total_max:.1f}%"
+        if t_sum > 0 and f_sum > 0:
+            line += f" GFLOP/s: {f_sum / t_sum / 1e9:.2f}"
+        if t_sum > 0 and b_sum > 0:
+            line += f" GB/s: {b_sum / t_sum / 1e9:.2f}"
+        if f_sum > 0 and b_sum > 0:
+            line += f" flops/byte: {f_sum / b_sum:.2f}"
+        print(line, flush=True)
+
+# Nonzero balance of the adjacency blocks, reported before training. stages lists this rank's local
+# SpMMs of one layer as (nnz, rows, cols), one per stage. A stage ends when its slowest rank does,
+# so its predicted time is the largest block's compulsory traffic at bandwidth GB/s, and summed over
+# the stages against the mean block's it gives the slowdown the partition costs every SpMM. Ranks
+# with more than threshold times the mean nnz are reported as stragglers.
+def balance(rank, group, stages, width, bandwidth, threshold, device):
+    count = torch.tensor([len(stages)], dtype=torch.long, device=device)
+    dist.all_reduce(count, op=dist.reduce_op.MAX, group=group)
+    count = int(count.item())
+
+    # Ranks with fewer stages are padded with empty blocks
+    local = torch.zeros(count, 3, dtype=torch.double, device=device)
+    if len(stages) > 0:
+        local[:len(stages)] = torch.tensor(stages, dtype=torch.double, device=device)
+    ranks = dist.get_world_size(group)
+    recv = [torch.zeros_like(local) for i in range(ranks)]
+    dist.all_gather(recv, local, group=group)
+
+    if rank != 0:
+        return
+    blocks = [b.tolist() for b in recv]
+
+    rank_nnz = [sum(s[0] for s in blocks[r]) for r in range(ranks)]
+    rank_rows = [max([s[1] for s in blocks[r]], default=0.) for r in range(ranks)]
+    mean_nnz = sum(rank_nnz) / ranks
+    mean_rows = sum(rank_rows) / ranks
+    nnz_imbalance = max(rank_nnz) / mean_nnz if mean_nnz > 0 else 1.
+    row_imbalance = max(rank_rows) / mean_rows if mean_rows > 0 else 1.
+
+    print(f"balance: ranks: {ranks} stages: {count} nnz: {int(sum(rank_nnz))} " \
+            f"nnz_imbalance: {nnz_imbalance:.2f} row_imbalance: {row_imbalance:.2f}", flush=True)
+    for r in range(ranks):
+        ratio = rank_nnz[r] / mean_nnz if mean_nnz > 0 else 1.
+        print(f"balance: rank: {r} nnz: {int(rank_nnz[r])} rows: {int(rank_rows[r])} " \
+                f"nnz_ratio: {ratio:.2f}", flush=True)
+
+    predicted = 0.
+    balanced = 0.
+    for k in range(count):
+        times = [spmm_work(*blocks[r][k], width)[1] / (bandwidth * 1e9) for r in range(ranks)]
+        nnzs = [blocks[r][k][0] for r in range(ranks)]
+        slowest = times.index(max(times))
+        predicted += times[slowest]
+        balanced += sum(times) / ranks
+        stage_imbalance = max(nnzs) / (sum(nnzs) / ranks) if sum(nnzs) > 0 else 1.
+        print(f"balance: stage: {k} max_nnz: {int(max(nnzs))} mean_nnz: {sum(nnzs) / ranks:.1f} " \
+                f"imbalance: {stage_imbalance:.2f} slowest_rank: {slowest} " \
+                f"predicted: {times[slowest] * 1e3:.3f}ms", flush=True)
+
+    slowdown = predicted / balanced if balanced > 0 else 1.
+    print(f"balance: predicted_spmm: {predicted * 1e3:.3f}ms balanced_spmm: {balanced * 1e3:.3f}ms " \
+            f"slowdown: {slowdown:.2f}", flush=True)
+
+    stragglers = [r for r in range(ranks) if rank_nnz[r] > threshold * mean_nnz]
+    if nnz_imbalance > threshold:
+        print(f"warning: nnz imbalance {nnz_imbalance:.2f} exceeds {threshold}, stragglers: " \
+                f"{stragglers}", flush=True)
+    if slowdown > threshold:
+        print(f"warning: stage imbalance slows the SpMM {slowdown:.2f}x over a balanced partition",
+                flush=True)
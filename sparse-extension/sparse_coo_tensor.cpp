@@ -111,40 +111,23 @@ void printCusparseSpMat(int32_t rows, int32_t cols, int32_t nnz, int32_t *row_in
   delete [] col_indices_host;
 }
 
-// at::Tensor spmm_gpu(const at::Tensor& A_rowindices, 
-void spmm_gpu(const at::Tensor& A_rowindices, 
-                        const at::Tensor& A_colindices,
-                        const at::Tensor& A_values, 
-                        int32_t n,
-                        int32_t m,
-                        at::Tensor& B,
-                        at::Tensor& C) {
+// C += A * B for an n x m CSR matrix A whose row offsets are already on the device
+void csrmm_gpu(int32_t *d_a_csrrows,
+                const at::Tensor& A_colindices,
+                const at::Tensor& A_values,
+                int32_t n,
+                int32_t m,
+                at::Tensor& B,
+                at::Tensor& C) {
 
-    // cusparseHandle_t handle;
-    // CHECK_CUSPARSE(cusparseCreate(&handle));
-    auto state = at::globalContext().lazyInitCUDA();
-    // auto handle = THCState_getCurrentSparseHandle(state);
     auto handle = at::cuda::getCurrentCUDASparseHandle();
 
-    // Impl1 -- coo2csr + csrmm2
-    int nnz = A_values.size(0);
+    int nnz = A_colindices.size(0);
 
-    clock_t start, stop;
-    
-    int32_t *d_a_csrrows;
-
-    
-    // int devid_old = 0;
-    // cudaGetDevice(&devid_old);
-    // cudaSetDevice(devid);
-
-    cudaMalloc(&d_a_csrrows, (n + 1) * sizeof(int32_t));
-    CHECK_CUSPARSE(cusparseXcoo2csr(handle, 
-                                        A_rowindices.data<int>(), 
-                                        nnz, 
-                                        n, 
-                                        d_a_csrrows, 
-                                        CUSPARSE_INDEX_BASE_ZERO));
+    // Callers with all-1 matrices keep a shared ones vector and pass a slice of it
+    TORCH_CHECK(A_values.numel() == nnz, "csrmm_gpu: A_values has ", A_values.numel(), 
+                    " values for ", nnz, " nonzeros");
+    const float *a_values = A_values.data<float>();
 
     float alpha = 1;
     float beta = 1;
@@ -153,17 +136,12 @@ void spmm_gpu(const at::Tensor& A_rowindices,
     cusparseSetMatType(descrA,CUSPARSE_MATRIX_TYPE_GENERAL);
     cusparseSetMatIndexBase(descrA,CUSPARSE_INDEX_BASE_ZERO);
 
-    // auto C = torch::ones({n, B.size(1)}, torch::dtype(torch::kDouble).device(torch::kCUDA));
-
     int32_t b_row = B.size(0);
     int32_t b_col = B.size(1);
     int32_t c_row = C.size(0);
     int32_t c_col = C.size(1);
     
     // Row-major to column-major
-    // B.t_();
-    // B.set_data(B.contiguous());
-    // B.set_data(B.view({b_row, b_col}));
     C.t_();
     C.set_data(C.contiguous());
     C.set_data(C.view({c_row, c_col}));
@@ -177,7 +155,7 @@ void spmm_gpu(const at::Tensor& A_rowindices,
                                     nnz,
                                     &alpha,
                                     descrA,
-                                    A_values.data<float>(),
+                                    a_values,
                                     d_a_csrrows,
                                     A_colindices.data<int>(),
                                     B.data<float>(),
@@ -186,16 +164,62 @@ void spmm_gpu(const at::Tensor& A_rowindices,
                                     C.data<float>(),
                                     n)); 
 
-    cudaFree(d_a_csrrows);
+    cusparseDestroyMatDescr(descrA);
 
     // Column-major to row-major
-    // B.set_data(B.view({b_col, b_row}));
-    // B.t_();
     C.set_data(C.view({c_col, c_row}));
     C.t_();
 }
 
+// at::Tensor spmm_gpu(const at::Tensor& A_rowindices, 
+void spmm_gpu(const at::Tensor& A_rowindices, 
+                        const at::Tensor& A_colindices,
+                        const at::Tensor& A_values, 
+                        int32_t n,
+                        int32_t m,
+                        at::Tensor& B,
+                        at::Tensor& C) {
+
+    // cusparseHandle_t handle;
+    // CHECK_CUSPARSE(cusparseCreate(&handle));
+    auto state = at::globalContext().lazyInitCUDA();
+    // auto handle = THCState_getCurrentSparseHandle(state);
+    auto handle = at::cuda::getCurrentCUDASparseHandle();
+
+    // Impl1 -- coo2csr + csrmm2
+    int nnz = A_colindices.size(0);
+
+    int32_t *d_a_csrrows;
+
+    cudaMalloc(&d_a_csrrows, (n + 1) * sizeof(int32_t));
+    CHECK_CUSPARSE(cusparseXcoo2csr(handle, 
+                                        A_rowindices.data<int>(), 
+                                        nnz, 
+                                        n, 
+                                        d_a_csrrows, 
+                                        CUSPARSE_INDEX_BASE_ZERO));
+
+    csrmm_gpu(d_a_csrrows, A_colindices, A_values, n, m, B, C);
+
+    cudaFree(d_a_csrrows);
+}
+
+// Same as spmm_gpu, but A arrives in CSR form with int32 row offsets, so no coo2csr is needed
+void spmm_csr_gpu(const at::Tensor& A_rowptr, 
+                        const at::Tensor& A_colindices,
+                        const at::Tensor& A_values, 
+                        int32_t n,
+                        int32_t m,
+                        at::Tensor& B,
+                        at::Tensor& C) {
+
+    auto state = at::globalContext().lazyInitCUDA();
+
+    csrmm_gpu(A_rowptr.data<int>(), A_colindices, A_values, n, m, B, C);
+}
+
 PYBIND11_MODULE(TORCH_EXTENSION_NAME, m) {
     m.def("sparse_coo_tensor_gpu", &sparse_coo_tensor_gpu, "Sparse Tensor GPU-only constructor");
     m.def("spmm_gpu", &spmm_gpu, "SpMM wrapper for cusparse");
+    m.def("spmm_csr_gpu", &spmm_csr_gpu, "SpMM wrapper for cusparse with a CSR input matrix");
 }
@@ -0,0 +1,151 @@
+import math
+
+import torch
+
+# Rows generated from one seed. A graph is a function of its parameters only, not of how many ranks
+# generate it or which rows each one asks for.
+chunk_rows = 1 << 16
+
+# Odd multiplier scattering vertex ids over [0, 2^scale). R-MAT's heavy vertices are the ids with
+# few one bits, which would otherwise crowd the first block rows.
+scatter_mult = 0x5bd1e995
+
+# Default R-MAT quadrant probabilities (a, b, c, d), as in Graph500
+default_skew = "0.57,0.19,0.19,0.05"
+
+# Vertices v with v % split_mod == split_mod - 2 are validation vertices, with split_mod - 1 test
+# vertices, the rest train vertices. Ids are already scattered, so this is a uniform 80/10/10 split
+# whose sizes are known without generating it.
+split_mod = 10
+
+# Inverse of an odd x modulo 2^bits by Newton iteration, each step doubles the correct low bits
+def inverse_mod(x, bits):
+    inv = x
+    for i in range(6):
+        inv = (inv * (2 - x * inv)) % (1 << bits)
+    return inv
+
+def ratio(x, y):
+    return x / y if y > 0 else 0.
+
+# An R-MAT graph, or an Erdős–Rényi graph, which is R-MAT with four equal quadrants.
+# R-MAT picks one quadrant per id bit independently, so a row's expected degree only depends on its
+# number of one bits, and each column bit only on the row bit at the same level. That lets a rank
+# draw the edges of any row range on its own: Poisson row degrees, then columns bit by bit.
+# Duplicate edges are dropped, so the average degree comes out slightly below the requested one
+# on skewed graphs.
+# The graph is undirected: every drawn edge (u, v) is also emitted as (v, u), since the training
+# scripts' backward passes and the mini-batch sampler use A as its own transpose. The mirrored edges
+# of a row can come from any chunk, so a rank draws every chunk but only keeps its own rows.
+class Graph:
+    def __init__(self, kind, nodes, degree, skew, features, classes, seed):
+        if kind == "er":
+            probs = [0.25, 0.25, 0.25, 0.25]
+        else:
+            probs = [float(p) for p in skew.split(",")]
+            assert len(probs) == 4, f"R-MAT skew needs four probabilities, got {skew}"
+        a, b, c, d = [p / sum(probs) for p in probs]
+
+        self.kind = kind
+        self.nodes = nodes
+        self.degree = degree
+        self.features = features
+        self.classes = classes
+        self.seed = seed
+
+        # Ids stay below 2^31, so they fit the int32 CSR blocks and id products fit in int64
+        self.scale = max(1, math.ceil(math.log2(nodes)))
+        assert self.scale <= 31, f"{nodes} vertices do not fit in 31-bit ids"
+        self.span = 1 << self.scale
+        self.mult = scatter_mult % self.span | 1
+        self.inv = inverse_mod(self.mult, self.scale)
+
+        self.row_probs = (a + b, c + d)
+        self.col_probs = (ratio(b, a + b), ratio(d, c + d))
+
+        # Only about nodes / 2^scale of the rows and of the columns are kept when nodes is not a
+        # power of two, so the edge count is raised to keep the requested average degree. Half of
+        # it is drawn, mirroring gives the other half.
+        self.edge_count = nodes * degree / 2 * (self.span / nodes) ** 2
+
+    def generator(self, chunk, stream):
+        gen = torch.Generator()
+        gen.manual_seed(self.seed * 1000003 + chunk * 3 + stream)
+        return gen
+
+    # Chunks covering rows [row_start, row_stop), as (chunk, chunk_start, chunk_stop)
+    def chunks(self, row_start, row_stop):
+        for chunk in range(row_start // chunk_rows, math.ceil(row_stop / chunk_rows)):
+            start = chunk * chunk_rows
+            yield chunk, start, min(start + chunk_rows, self.nodes)
+
+    def chunk_edges(self, chunk, start, stop):
+        gen = self.generator(chunk, 0)
+        rows = torch.arange(start, stop, dtype=torch.long)
+        orig = rows * self.inv % self.span
+
+        ones = torch.zeros_like(orig)
+        for bit in range(self.scale):
+            ones += (orig >> bit) & 1
+        ones = ones.double()
+        row_prob = self.row_probs[1] ** ones * self.row_probs[0] ** (self.scale - ones)
+        degrees = torch.poisson(self.edge_count * row_prob, generator=gen).long()
+
+        src = torch.repeat_interleave(rows, degrees)
+        src_orig = torch.repeat_interleave(orig, degrees)
+        dst = torch.zeros_like(src_orig)
+        lo, hi = self.col_probs
+        for bit in range(self.scale):
+            col_prob = lo + ((src_orig >> bit) & 1).double() * (hi - lo)
+            col_bit = (torch.rand(src.size(0), generator=gen, dtype=torch.double) < col_prob).long()
+            dst |= col_bit << bit
+        dst = dst * self.mult % self.span
+
+        keep = dst < self.nodes
+        ids = torch.unique(src[keep] * self.nodes + dst[keep])
+        return torch.stack([ids // self.nodes, ids % self.nodes])
+
+    # Edges (2 x nnz, global ids) whose source is in rows [row_start, row_stop), each once. Every
+    # chunk is drawn, as its mirrored edges may land in the range, but only the range's edges are
+    # kept, so memory follows the range while the work follows the whole graph.
+    def edges(self, row_start, row_stop):
+        parts = []
+        for chunk, start, stop in self.chunks(0, self.nodes):
+            edge_index = self.chunk_edges(chunk, start, stop)
+            edge_index = torch.cat([edge_index, edge_index.flip(0)], dim=1)
+            keep = (edge_index[0] >= row_start) & (edge_index[0] < row_stop)
+            parts.append(edge_index[:, keep])
+        if len(parts) == 0:
+            return torch.zeros(2, 0, dtype=torch.long)
+        edge_index = torch.cat(parts, dim=1)
+        ids = torch.unique(edge_index[0] * self.nodes + edge_index[1])
+        return torch.stack([ids // self.nodes, ids % self.nodes])
+
+    # Uniform random features of rows [row_start, row_stop)
+    def inputs(self, row_start, row_stop):
+        parts = []
+        for chunk, start, stop in self.chunks(row_start, row_stop):
+            x = torch.rand(stop - start, self.features, generator=self.generator(chunk, 1))
+            parts.append(x[max(row_start - start, 0):min(row_stop, stop) - start])
+        if len(parts) == 0:
+            return torch.zeros(0, self.features)
+        return torch.cat(parts, dim=0)
+
+    # Train, validation and test masks of rows [row_start, row_stop)
+    def masks(self, row_start, row_stop):
+        split = torch.arange(row_start, row_stop) % split_mod
+        return split < split_mod - 2, split == split_mod - 2, split == split_mod - 1
+
+    def train_count(self):
+        full, rest = divmod(self.nodes, split_mod)
+        return full * (split_mod - 2) + min(rest, split_mod - 2)
+
+    # Uniform random labels of rows [row_start, row_stop)
+    def labels(self, row_start, row_stop):
+        parts = []
+        for chunk, start, stop in self.chunks(row_start, row_stop):
+            y = torch.randint(self.classes, (stop - start,), generator=self.generator(chunk, 2))
+            parts.append(y[max(row_start - start, 0):min(row_stop, stop) - start])
+        if len(parts) == 0:
+            return torch.zeros(0, dtype=torch.long)
+        return torch.cat(parts, dim=0)
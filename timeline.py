@@ -0,0 +1,75 @@
+import json
+import os
+import sys
+import time
+
+# Timeline of the timed phases in the Chrome trace event format, which chrome://tracing and
+# ui.perfetto.dev open. Each rank is a process row, with its phases on one thread and its epochs on
+# another, so stragglers show as ranks whose phases end late and overlap as phases running side by
+# side across ranks.
+
+# Phases whose name contains one of these are communication, everything else computation
+comm_names = ["bcast", "comm", "reduce", "gather", "transpose", "barrier"]
+
+phase_tid = 0
+epoch_tid = 1
+
+def category(name):
+    if any(c in name for c in comm_names):
+        return "comm"
+    return "comp"
+
+# Per-rank part of a trace, next to the merged file
+def part_path(path, rank):
+    return f"{path}.rank{rank}"
+
+# A rank's events, in microseconds since the Timeline was made. The scripts make it right after a
+# barrier, so every rank's zero is the same moment within the barrier's skew and the ranks line up
+# without synchronized host clocks.
+class Timeline:
+    def __init__(self, path, rank):
+        self.path = path
+        self.rank = rank
+        self.events = []
+        self.t0 = time.time()
+
+    # Complete event over [tstart, tstop] seconds, as time.time() returns them
+    def event(self, name, tstart, tstop=None, tid=phase_tid, cat=None, args=None):
+        if tstop is None:
+            tstop = time.time()
+        if cat is None:
+            cat = category(name)
+        event = dict(name=name, cat=cat, ph="X", pid=self.rank, tid=tid,
+                        ts=(tstart - self.t0) * 1e6, dur=(tstop - tstart) * 1e6)
+        if args is not None:
+            event["args"] = args
+        self.events.append(event)
+
+    def write(self):
+        with open(part_path(self.path, self.rank), "w") as f:
+            json.dump(self.events, f)
+
+# Merge the parts of ranks [0, size) into path and remove them. The training scripts call this on
+# rank 0 once every rank has written its part, which needs path on a filesystem all ranks share.
+def merge(path, size):
+    events = []
+    for rank in range(size):
+        with open(part_path(path, rank)) as f:
+            events += json.load(f)
+        events.append(dict(name="process_name", ph="M", pid=rank, args=dict(name=f"rank {rank}")))
+        events.append(dict(name="process_sort_index", ph="M", pid=rank, args=dict(sort_index=rank)))
+        events.append(dict(name="thread_name", ph="M", pid=rank, tid=phase_tid,
+                            args=dict(name="phases")))
+        events.append(dict(name="thread_name", ph="M", pid=rank, tid=epoch_tid,
+                            args=dict(name="epochs")))
+
+    with open(path, "w") as f:
+        json.dump(dict(traceEvents=events, displayTimeUnit="ms"), f)
+    for rank in range(size):
+        os.remove(part_path(path, rank))
+
+# Merges by hand when the ranks wrote their parts on different nodes:
+#   python timeline.py <trace> <ranks>
+if __name__ == '__main__':
+    merge(sys.argv[1], int(sys.argv[2]))
+    print(f"wrote {sys.argv[1]}")
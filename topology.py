@@ -0,0 +1,113 @@
+import inspect
+import socket
+import zlib
+
+import torch
+import torch.distributed as dist
+
+# Since PyTorch 2.1 only a group's members need to enter dist.new_group, so a rank builds just the
+# groups it belongs to instead of taking part in every group's creation
+local_sync = "use_local_synchronization" in inspect.signature(dist.new_group).parameters
+
+# dist.new_group, called by every rank for every group. Non-members get the non-member placeholder,
+# which collectives and barriers skip, as dist.new_group itself returns.
+def new_group(ranks, rank):
+    if not local_sync:
+        return dist.new_group(ranks)
+    if rank not in ranks:
+        return dist.GroupMember.NON_GROUP_MEMBER
+    return dist.new_group(ranks, use_local_synchronization=True)
+
+# Node index of every rank, numbered in order of each node's lowest rank. Hostnames are gathered
+# as CRC32 hashes, since the collectives only move tensors.
+def node_ids(size, device):
+    host = torch.cuda.LongTensor([zlib.crc32(socket.gethostname().encode())], device=device)
+    hosts = [torch.cuda.LongTensor(1, device=device) for i in range(size)]
+    dist.all_gather(hosts, host)
+
+    nodes = dict()
+    node_of = []
+    for h in hosts:
+        h = h.item()
+        if h not in nodes:
+            nodes[h] = len(nodes)
+        node_of.append(nodes[h])
+    return node_of
+
+# Warn about groups whose members span several nodes. The replication (1.5D) and c (3D) groups
+# carry the heaviest reductions and are consecutive ranks, which launchers place on one node when
+# the group size divides the ranks per node.
+def check_local(procs, node_of, name, rank):
+    remote = [p for p in procs if len(set(node_of[r] for r in p)) > 1]
+    if rank == 0:
+        if len(remote) > 0:
+            print(f"warning: {len(remote)}/{len(procs)} {name} groups span several nodes, " \
+                    f"e.g. ranks {remote[0]}", flush=True)
+        else:
+            print(f"{name} groups: all node-local", flush=True)
+    return len(remote) == 0
+
+# Two-level collectives over a group whose members sit on several nodes: one inter-node step
+# between a single member per node, then one intra-node step on every node, so each node receives
+# one copy over the network. Needs the same number (at least 2) of members on every node,
+# otherwise the flat group is used. Every rank must build every HierGroup, in the same order,
+# since each builds new process groups.
+class HierGroup:
+    def __init__(self, members, node_of, group):
+        self.group = group
+        self.node_of = node_of
+
+        nodes = sorted(set(node_of[r] for r in members))
+        self.local_ranks = dict()
+        for n in nodes:
+            self.local_ranks[n] = [r for r in members if node_of[r] == n]
+
+        per_node = set(len(ranks) for ranks in self.local_ranks.values())
+        self.hier = len(nodes) > 1 and len(per_node) == 1 and min(per_node) > 1
+        if not self.hier:
+            return
+
+        # Position of each member among the members on its node
+        self.local_idx = dict()
+        for n in nodes:
+            for k, r in enumerate(self.local_ranks[n]):
+                self.local_idx[r] = k
+
+        rank = dist.get_rank()
+        self.intra_groups = dict()
+        for n in nodes:
+            self.intra_groups[n] = new_group(self.local_ranks[n], rank)
+
+        # inter_groups[k] holds the k-th member of every node
+        self.inter_groups = []
+        for k in range(min(per_node)):
+            self.inter_groups.append(new_group([self.local_ranks[n][k] for n in nodes], rank))
+
+    def broadcast(self, tensor, src):
+        if not self.hier:
+            dist.broadcast(tensor, src=src, group=self.group)
+            return
+
+        rank = dist.get_rank()
+        node = self.node_of[rank]
+        k = self.local_idx[src]
+
+        # src to the members at its position on the other nodes, then each of them to its node
+        if self.local_idx[rank] == k:
+            dist.broadcast(tensor, src=src, group=self.inter_groups[k])
+        dist.broadcast(tensor, src=self.local_ranks[node][k], group=self.intra_groups[node])
+
+    def all_reduce(self, tensor, op=dist.reduce_op.SUM):
+        if not self.hier:
+            dist.all_reduce(tensor, op=op, group=self.group)
+            return
+
+        rank = dist.get_rank()
+        node = self.node_of[rank]
+        leader = self.local_ranks[node][0]
+
+        # Reduce onto the first member of each node, all-reduce between those, and send it back
+        dist.reduce(tensor, dst=leader, op=op, group=self.intra_groups[node])
+        if rank == leader:
+            dist.all_reduce(tensor, op=op, group=self.inter_groups[0])
+        dist.broadcast(tensor, src=leader, group=self.intra_groups[node])